@@ -14,7 +14,9 @@ import os
 import sys
 import random
 import logging
+import sqlite3
 import config
+from model_index import ModelIndex
 from questions import YesNoQuestion, MultiChoiceQuestion
 
 
@@ -36,9 +38,17 @@ class AdminUI(tk.Tk):
         self.questions = storage.load_questions()
         self.diseases = storage.load_diseases()
         self.diagnosis_model = storage.load_model()
+        # Collections edited since the last save: "questions", "diseases"
+        # and/or "model".  ``save_all`` only writes these.
+        self.dirty = set()
+        self.reindex()
         self.create_menu()
         self.create_widgets()
 
+    def reindex(self):
+        """Rebuild the question lookup tables after the data changes."""
+        self.index = ModelIndex(self.diseases, self.questions, self.diagnosis_model)
+
     def create_menu(self):
         """Create the application menu bar."""
         menubar = tk.Menu(self)
@@ -202,7 +212,7 @@ class AdminUI(tk.Tk):
         if not d or not qid:
             self.training_prompt_lbl.config(text="")
             return
-        q = next((x for x in self.questions if x.qid == qid), None)
+        q = self.index.question(qid)
         if not q:
             self.training_prompt_lbl.config(text="")
             return
@@ -219,7 +229,7 @@ class AdminUI(tk.Tk):
             self.diagnosis_model[d] = {}
         if qid not in self.diagnosis_model[d]:
             self.diagnosis_model[d][qid] = {}
-        q = next((x for x in self.questions if x.qid == qid), None)
+        q = self.index.question(qid)
         if q and q.qtype == "yesno":
             key = "Yes"
         elif q and q.choices:
@@ -227,6 +237,7 @@ class AdminUI(tk.Tk):
         else:
             key = "Yes"
         self.diagnosis_model[d][qid][key] = rating
+        self.store_weight(d, qid, key, rating)
         messagebox.showinfo("Saved", "Rating recorded.")
 
     def show_training_tips(self):
@@ -279,6 +290,8 @@ class AdminUI(tk.Tk):
             choices = simpledialog.askstring("Choices", "Choices (comma separated):")
             q = MultiChoiceQuestion(qid, qtext, [c.strip() for c in choices.split(",")])
         self.questions.append(q)
+        self.dirty.add("questions")
+        self.reindex()
         self.refresh_q_list()
 
     def edit_q(self):
@@ -294,6 +307,8 @@ class AdminUI(tk.Tk):
             choices = simpledialog.askstring("Choices", "Choices (comma separated):", initialvalue=",".join(q.choices))
             q2 = MultiChoiceQuestion(q.qid, qtext, [c.strip() for c in choices.split(",")])
         self.questions[idx[0]] = q2
+        self.dirty.add("questions")
+        self.reindex()
         self.refresh_q_list()
 
     def del_q(self):
@@ -304,6 +319,8 @@ class AdminUI(tk.Tk):
         if not messagebox.askyesno("Confirm", "Delete selected question?"):
             return
         del self.questions[idx[0]]
+        self.dirty.add("questions")
+        self.reindex()
         self.refresh_q_list()
 
     def move_q_up(self):
@@ -313,6 +330,7 @@ class AdminUI(tk.Tk):
             return
         i = idx[0]
         self.questions[i - 1], self.questions[i] = self.questions[i], self.questions[i - 1]
+        self.dirty.add("questions")
         self.refresh_q_list()
         self.q_listbox.select_set(i - 1)
 
@@ -323,6 +341,7 @@ class AdminUI(tk.Tk):
             return
         i = idx[0]
         self.questions[i + 1], self.questions[i] = self.questions[i], self.questions[i + 1]
+        self.dirty.add("questions")
         self.refresh_q_list()
         self.q_listbox.select_set(i + 1)
 
@@ -331,6 +350,7 @@ class AdminUI(tk.Tk):
         d = simpledialog.askstring("Add Disease", "Disease name:")
         if d and d not in self.diseases:
             self.diseases.append(d)
+            self.dirty.add("diseases")
             self.refresh_d_list()
 
     def edit_d(self):
@@ -342,6 +362,7 @@ class AdminUI(tk.Tk):
         d2 = simpledialog.askstring("Edit Disease", "Disease name:", initialvalue=d)
         if d2:
             self.diseases[idx[0]] = d2
+            self.dirty.add("diseases")
             self.refresh_d_list()
 
     def del_d(self):
@@ -352,6 +373,7 @@ class AdminUI(tk.Tk):
         if not messagebox.askyesno("Confirm", "Delete selected disease?"):
             return
         del self.diseases[idx[0]]
+        self.dirty.add("diseases")
         self.refresh_d_list()
 
     def move_d_up(self):
@@ -361,6 +383,7 @@ class AdminUI(tk.Tk):
             return
         i = idx[0]
         self.diseases[i - 1], self.diseases[i] = self.diseases[i], self.diseases[i - 1]
+        self.dirty.add("diseases")
         self.refresh_d_list()
         self.d_listbox.select_set(i - 1)
 
@@ -371,6 +394,7 @@ class AdminUI(tk.Tk):
             return
         i = idx[0]
         self.diseases[i + 1], self.diseases[i] = self.diseases[i], self.diseases[i + 1]
+        self.dirty.add("diseases")
         self.refresh_d_list()
         self.d_listbox.select_set(i + 1)
 
@@ -382,7 +406,7 @@ class AdminUI(tk.Tk):
         qid = self.q_combo.get()
         if not d or not qid:
             return
-        q = next((x for x in self.questions if x.qid == qid), None)
+        q = self.index.question(qid)
         if not q:
             return
         wdict = self.diagnosis_model.get(d, {}).get(qid, {})
@@ -409,14 +433,41 @@ class AdminUI(tk.Tk):
             self.diagnosis_model[d][qid] = {}
         for c, var in self.weight_vars.items():
             self.diagnosis_model[d][qid][c] = var.get()
+            self.store_weight(d, qid, c, var.get())
         messagebox.showinfo("Saved", "Weight updated.")
 
+    def store_weight(self, disease, qid, answer, weight):
+        """Record one edited weight.
+
+        Storages offering ``set_weight`` persist the cell immediately;
+        otherwise the whole model is saved by ``save_all``.
+        """
+        set_weight = getattr(self.storage, "set_weight", None)
+        if set_weight is None:
+            self.dirty.add("model")
+            return
+        try:
+            set_weight(disease, qid, answer, weight)
+        except Exception as exc:  # keep the edit for the next Save All
+            self.logger.error("Failed to store weight: %s", exc)
+            self.dirty.add("model")
+
     def save_all(self):
         """Persist all modifications back to disk."""
-        # Persist all modifications back to disk using the storage helpers.
-        self.storage.save_questions(self.questions)
-        self.storage.save_diseases(self.diseases)
-        self.storage.save_model(self.diagnosis_model)
+        # Only the collections edited since the last save are written.
+        savers = {
+            "questions": (self.storage.save_questions, self.questions),
+            "diseases": (self.storage.save_diseases, self.diseases),
+            "model": (self.storage.save_model, self.diagnosis_model),
+        }
+        try:
+            for name in [n for n in savers if n in self.dirty]:
+                save, data = savers[name]
+                save(data)
+                self.dirty.discard(name)
+        except (RuntimeError, sqlite3.Error) as exc:
+            messagebox.showerror("Save failed", str(exc))
+            return
         messagebox.showinfo("Saved", "All data saved!")
 
     def show_about(self):
@@ -455,12 +506,17 @@ class AdminUI(tk.Tk):
 
 
 if __name__ == "__main__":
-    import storage_json
+    if config.STORAGE_BACKEND == "sqlite":
+        from storage_sqlite import SQLiteStorage
+
+        storage = SQLiteStorage(config.SQLITE_FILE)
+    else:
+        import storage_json as storage
 
     if os.name != "nt" and not os.getenv("DISPLAY"):
         sys.exit("Error: no DISPLAY environment variable set")
     try:
-        app = AdminUI(storage_json)
+        app = AdminUI(storage)
     except TclError as exc:
         sys.exit(f"Error initializing Tkinter: {exc}")
 
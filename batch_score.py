@@ -0,0 +1,220 @@
+"""Re-score archived cases in bulk.
+
+Each input line is a JSON object holding a complete answer set::
+
+    {"id": "case-17", "answers": {"red_eye": "Yes", "pain": "No"}}
+
+and produces one output line with the top ranked diseases::
+
+    {"id": "case-17", "top": [["Conjunctivitis", 4], ...]}
+
+Cases are scored a chunk at a time as a case x feature indicator matrix
+multiplied with the compiled weight matrix, which gives the same scores as
+answering every question through ``DiagnosisEngine``.  Large inputs are
+spread over a process pool; results are streamed in input order.
+
+Run it with::
+
+    python batch_score.py cases.jsonl -o results.jsonl --top 3
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from model_compiled import CompiledModel
+
+NEG_INF = float("-inf")
+
+# Inputs smaller than this are scored in-process when ``workers`` is auto.
+PARALLEL_THRESHOLD_BYTES = 1 << 20
+
+_worker_model = None
+
+
+def case_features(compiled: CompiledModel, answers) -> List[int]:
+    """Return the feature ids set by ``answers``.
+
+    ``answers`` is a ``question -> answer`` mapping or a list of pairs.
+    Answers unknown to the model carry no weight and are skipped.
+    """
+
+    items = answers.items() if isinstance(answers, dict) else answers
+    features = []
+    for q, a in items:
+        f = compiled.feature_id(q, a)
+        if f is not None:
+            features.append(f)
+    return features
+
+
+def score_cases(compiled: CompiledModel, feature_lists: Iterable[List[int]]) -> List[list]:
+    """Multiply the sparse case x feature indicator rows by the weights.
+
+    Returns one score vector per case, indexed like ``compiled.diseases``,
+    with ruled out diseases set to ``-inf``.
+    """
+
+    deltas = compiled.deltas
+    rules_out = compiled.rules_out
+    results = []
+    for features in feature_lists:
+        scores = list(compiled.zero_scores)
+        for f in features:
+            for i, w in deltas[f]:
+                scores[i] += w
+        for f in features:
+            for i in rules_out[f]:
+                scores[i] = NEG_INF
+        results.append(scores)
+    return results
+
+
+def top_diseases(compiled: CompiledModel, scores, k: int = 3) -> list:
+    """Return the ``k`` best ``[disease, score]`` pairs of ``scores``.
+
+    Ties keep model order, as in ``DiagnosisEngine.get_top_diseases``.
+    """
+
+    active = [(d, s) for d, s in zip(compiled.diseases, scores) if s != NEG_INF]
+    return [list(p) for p in heapq.nlargest(k, active, key=lambda x: x[1])]
+
+
+def score_lines(compiled: CompiledModel, lines: List[str], top_k: int = 3) -> List[dict]:
+    """Parse and score a chunk of JSONL ``lines``.
+
+    Lines that cannot be parsed produce an ``error`` record instead of
+    aborting the whole batch.
+    """
+
+    records: List[Dict] = []
+    feature_lists = []
+    for line in lines:
+        try:
+            case = json.loads(line)
+            record = {"id": case.get("id")}
+            feature_lists.append(case_features(compiled, case["answers"]))
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            records.append({"error": f"Invalid case: {exc}", "line": line.strip()})
+            continue
+        records.append(record)
+    scored = iter(score_cases(compiled, feature_lists))
+    for record in records:
+        if "error" not in record:
+            record["top"] = top_diseases(compiled, next(scored), top_k)
+    return records
+
+
+def _init_worker(paths: Optional[dict], version: Optional[str]) -> None:
+    global _worker_model
+    from storage_json import load_compiled_model
+
+    _worker_model = load_compiled_model(**(paths or {}))
+    if version is not None and _worker_model.version != version:
+        raise ValueError(
+            f"Worker loaded model {_worker_model.version}, expected {version}"
+        )
+
+
+def _score_chunk(lines: List[str], top_k: int) -> List[dict]:
+    return score_lines(_worker_model, lines, top_k)
+
+
+def _chunks(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for line in lines:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_results(
+    lines: Iterable[str],
+    compiled: CompiledModel = None,
+    *,
+    paths: Optional[dict] = None,
+    top_k: int = 3,
+    workers: int = 1,
+    chunk_size: int = 500,
+) -> Iterator[dict]:
+    """Yield one result record per case in ``lines``, in input order.
+
+    The model is ``compiled``, or else loaded from ``paths``, the keyword
+    arguments of ``storage_json.load_compiled_model`` (default: the
+    configured data files).  With ``workers`` above one the chunks are
+    scored by a process pool whose workers load the model from ``paths``
+    once each; a ``compiled`` model must then come with the ``paths`` it
+    was loaded from, and the workers check they got the same version.
+    At most ``2 * workers`` chunks are in flight so memory stays bounded
+    for any input size.
+    """
+
+    if workers <= 1:
+        if compiled is None:
+            from storage_json import load_compiled_model
+
+            compiled = load_compiled_model(**(paths or {}))
+        for chunk in _chunks(lines, chunk_size):
+            yield from score_lines(compiled, chunk, top_k)
+        return
+
+    if compiled is not None and paths is None:
+        raise ValueError("workers need the paths the given model was loaded from")
+    version = None if compiled is None else compiled.version
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(paths, version)
+    ) as pool:
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.submit(_score_chunk, chunk, top_k))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Score archived cases in bulk")
+    parser.add_argument("input", help="JSONL file of cases, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output JSONL file")
+    parser.add_argument("--top", type=int, default=3, help="diseases per case")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="worker processes (0 picks automatically from the input size)",
+    )
+    parser.add_argument("--chunk-size", type=int, default=500, help="cases per chunk")
+    args = parser.parse_args(argv)
+
+    workers = args.workers
+    if workers <= 0:
+        large = args.input != "-" and os.path.getsize(args.input) >= PARALLEL_THRESHOLD_BYTES
+        workers = (os.cpu_count() or 1) if large else 1
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for record in iter_results(
+            src, top_k=args.top, workers=workers, chunk_size=args.chunk_size
+        ):
+            dst.write(json.dumps(record) + "\n")
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Performance benchmarks for model loading and engine sessions.
+
+The suite times the shipped data files and synthetic models built by
+replicating them ``N`` times (``N`` times the diseases and the questions,
+each disease copy answering its own copy of the questions).  Every
+dataset, the shipped one included, is measured from a copy in a temporary
+directory.  Loading is timed cold and from the on-disk compiled cache::
+
+    python bench.py -o baseline.json
+    python bench.py --compare baseline.json
+
+Every run prints one JSON document.  With ``--compare`` each median is
+checked against the baseline and the process exits with status 1 when
+any measurement got slower than ``--threshold`` allows.  The 1000x model
+takes a few gigabytes of memory and minutes to run, so it is only
+measured when requested with ``--scales 1,10,100,1000``.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import config
+import storage_json
+from engine_rule import DiagnosisEngine
+from model_compiled import compile_model, validate_model
+
+DEFAULT_SCALES = (1, 10, 100)
+# Relative slowdown of a median tolerated by ``compare``.
+DEFAULT_THRESHOLD = 0.25
+# Medians below this many milliseconds are too noisy to compare.
+NOISE_FLOOR_MS = 0.05
+
+BENCHMARKS = ("load", "load_cached", "construct", "select", "session", "undo_session")
+
+
+def scale_dataset(questions: List[dict], diseases: List[str], model: dict, factor: int):
+    """Return ``(questions, diseases, model)`` replicated ``factor`` times.
+
+    Copy ``k`` suffixes every disease and question id with ``#k``; copy
+    ``0`` keeps the original names so ``factor=1`` returns the input.
+    """
+
+    def name(value, k):
+        return value if k == 0 else f"{value}#{k}"
+
+    out_questions = []
+    out_diseases = []
+    out_model = {}
+    for k in range(factor):
+        for q in questions:
+            q = dict(q)
+            q["id"] = name(q["id"], k)
+            out_questions.append(q)
+        for d in diseases:
+            out_diseases.append(name(d, k))
+            out_model[name(d, k)] = {
+                name(q, k): dict(weights) for q, weights in model.get(d, {}).items()
+            }
+    return out_questions, out_diseases, out_model
+
+
+def write_dataset(directory: str, questions, diseases, model) -> Dict[str, str]:
+    """Write the three data files into ``directory`` and return their paths.
+
+    The keys are the path arguments of ``storage_json.load_compiled_model``.
+    """
+
+    paths = {
+        "questions_file": os.path.join(directory, "questions.json"),
+        "diseases_file": os.path.join(directory, "diseases.json"),
+        "model_file": os.path.join(directory, "diagnosis_model.json"),
+        # Never built, so a packed model of ``data/`` is not picked up.
+        "binary_file": os.path.join(directory, "diagnosis_model.bin"),
+    }
+    for key, data in (
+        ("questions_file", questions),
+        ("diseases_file", diseases),
+        ("model_file", model),
+    ):
+        with open(paths[key], "w", encoding="utf-8") as f:
+            json.dump(data, f)
+    return paths
+
+
+def _base_dataset():
+    """Return the shipped ``(questions, diseases, model)`` as plain JSON data."""
+
+    with open(config.QUESTIONS_FILE, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    return questions, storage_json.load_diseases(), storage_json.load_model()
+
+
+def _load_compiled(paths):
+    # Measure the cold path: parse and compile without the storage caches.
+    storage_json.invalidate_cache(disk=False)
+    questions = storage_json.load_questions(paths["questions_file"])
+    diseases = storage_json.load_diseases(paths["diseases_file"])
+    model = storage_json.load_model(paths["model_file"])
+    validate_model(diseases, [q.qid for q in questions], model)
+    return compile_model(diseases, questions, model)
+
+
+def _best_answer(engine, question, target):
+    """Return the answer to ``question`` that most favours disease ``target``."""
+
+    compiled = engine.compiled
+    best = None
+    best_weight = None
+    for answer, f in zip(compiled.possible_answers(question), compiled.question_features(question)):
+        if f is None:
+            weight = 0
+        elif target in compiled.rules_out[f]:
+            weight = float("-inf")
+        else:
+            weight = dict(compiled.deltas[f]).get(target, 0)
+        if best_weight is None or weight > best_weight:
+            best, best_weight = answer, weight
+    return best
+
+
+def _run_session(compiled, target, undo_every=0):
+    """Answer questions for a patient with disease ``target`` until done.
+
+    With ``undo_every`` set, every ``undo_every``-th answer is taken back
+    and given again, as a user correcting mistakes would.
+    """
+
+    engine = DiagnosisEngine.from_compiled(compiled, question_cache=None)
+    answers = 0
+    while not engine.is_done():
+        qid = engine.select_best_question()
+        if qid is None:
+            break
+        answer = _best_answer(engine, qid, target)
+        engine.answer_question(qid, answer)
+        answers += 1
+        if undo_every and answers % undo_every == 0:
+            engine.undo_last_answer()
+            engine.answer_question(qid, answer)
+    return engine
+
+
+def _time(func, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(samples),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+        "repeat": repeat,
+    }
+
+
+def run_scale(factor: int, repeat: int = 5, seed: int = 0, paths=None) -> dict:
+    """Run every benchmark on the data files at ``paths``.
+
+    ``factor`` only labels the result; pass the paths of a scaled dataset
+    written by ``write_dataset`` to measure it.  Without ``paths`` the
+    shipped data is copied to a temporary directory first, so the on-disk
+    compiled cache is never written into ``data/``.
+    """
+
+    if paths is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            return run_scale(factor, repeat, seed, write_dataset(tmp, *_base_dataset()))
+    compiled = _load_compiled(paths)
+    results = {
+        "scale": factor,
+        "diseases": len(compiled.diseases),
+        "questions": len(compiled.askable),
+        "features": compiled.num_features,
+        "load": _time(lambda: _load_compiled(paths), repeat),
+    }
+    # Warm the on-disk compiled cache, then time a start that uses it.
+    storage_json.load_compiled_model(**paths)
+
+    def load_cached():
+        storage_json.invalidate_cache(disk=False)
+        storage_json.load_compiled_model(**paths)
+
+    results["load_cached"] = _time(load_cached, repeat)
+    storage_json.invalidate_cache(disk=False)
+    rng = random.Random(seed)
+    targets = [rng.randrange(len(compiled.diseases)) for _ in range(repeat)]
+    runs = iter(targets)
+    results["construct"] = _time(
+        lambda: DiagnosisEngine.from_compiled(compiled, question_cache=None), repeat
+    )
+    results["select"] = _time(
+        lambda: DiagnosisEngine.from_compiled(
+            compiled, question_cache=None
+        ).select_best_question(),
+        repeat,
+    )
+    results["session"] = _time(lambda: _run_session(compiled, next(runs)), repeat)
+    runs = iter(targets)
+    results["undo_session"] = _time(
+        lambda: _run_session(compiled, next(runs), undo_every=2), repeat
+    )
+    return results
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, repeat: int = 5, seed: int = 0) -> dict:
+    """Run the suite for each of ``scales`` and return the JSON report."""
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": {},
+    }
+    base = None
+    for factor in scales:
+        # Larger models are slow enough that fewer samples are stable.
+        reps = max(1, repeat if factor <= 10 else repeat // 2 if factor <= 100 else 1)
+        if base is None:
+            base = _base_dataset()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = write_dataset(tmp, *scale_dataset(*base, factor))
+            result = run_scale(factor, reps, seed, paths)
+        report["results"][str(factor)] = result
+    return report
+
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> List[dict]:
+    """Return the measurements of ``current`` slower than ``baseline``.
+
+    A measurement regresses when its median exceeds the baseline median by
+    more than ``threshold`` (relative) and by more than ``NOISE_FLOOR_MS``.
+    Scales or benchmarks missing from either report are ignored.
+    """
+
+    regressions = []
+    for scale, result in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(scale)
+        if base is None:
+            continue
+        for name in BENCHMARKS:
+            if name not in result or name not in base:
+                continue
+            new = result[name]["median_ms"]
+            old = base[name]["median_ms"]
+            if new - old > NOISE_FLOOR_MS and new > old * (1 + threshold):
+                regressions.append(
+                    {
+                        "scale": scale,
+                        "benchmark": name,
+                        "baseline_ms": old,
+                        "current_ms": new,
+                        "ratio": new / old if old else float("inf"),
+                    }
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark model loading and sessions")
+    parser.add_argument(
+        "--scales",
+        default=",".join(map(str, DEFAULT_SCALES)),
+        help="comma separated model scale factors",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="samples per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed for simulated patients")
+    parser.add_argument("-o", "--output", help="also write the report to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline report to check against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="tolerated relative slowdown when comparing",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    report = run_benchmarks(scales, args.repeat, args.seed)
+    status = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.threshold)
+        status = 1 if report["regressions"] else 0
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Headless front end for terminals without a display and for automation.
+
+Two modes are offered, both selected from ``main.py``:
+
+``--headless``
+    Interactive text questionnaire.  Answer with the option number or
+    its text, ``b`` to go back, ``q`` to stop.
+``--json``
+    Line protocol on stdin/stdout.  Every output line is a JSON object,
+    either ``{"question": {"id", "text", "answers"}, "answered": n}`` or,
+    once finished, ``{"done": true, "stop_reason": ..., "top": [[disease,
+    score], ...]}`` (``stop_reason`` is ``null`` when stopped by the user).
+    Input lines are ``{"answer": "Yes"}``, ``{"undo": true}`` or
+    ``{"stop": true}``.  Errors are reported as ``{"error": ...}`` and the
+    question is asked again.
+
+Only the compiled model and the engine are imported; Tk never is.  The
+time from process start to the first question is checked against
+``AIVO_FIRST_QUESTION_BUDGET_MS``.
+"""
+
+import json
+import logging
+import sys
+import time
+from typing import Optional, TextIO
+
+import config
+from instrumentation import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def create_engine(debug: bool = False):
+    """Return an engine on the shared compiled model and policy tree."""
+
+    from engine_rule import DiagnosisEngine
+    from lookahead import default_lookahead
+    from policy_tree import load_policy_tree
+    from storage_json import load_compiled_model
+
+    return DiagnosisEngine.from_compiled(
+        load_compiled_model(),
+        debug=debug,
+        policy=load_policy_tree(),
+        lookahead=default_lookahead(),
+    )
+
+
+def _question(engine, qid) -> dict:
+    q = engine.compiled.index.question(qid)
+    return {
+        "id": qid,
+        "text": q.text if q else qid,
+        "answers": engine.get_possible_answers(qid),
+    }
+
+
+def _next_question(engine):
+    if engine.is_done():
+        return None
+    return engine.select_best_question()
+
+
+def _record_startup(start: Optional[float]) -> Optional[float]:
+    """Check the time from ``start`` to the first question against the budget."""
+
+    if start is None:
+        return None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    metrics.observe("cli.first_question", elapsed_ms / 1000)
+    if elapsed_ms > config.FIRST_QUESTION_BUDGET_MS:
+        logger.warning(
+            "First question after %.0f ms, over the %d ms budget",
+            elapsed_ms,
+            config.FIRST_QUESTION_BUDGET_MS,
+        )
+    return elapsed_ms
+
+
+def run_json(engine, stdin: TextIO, stdout: TextIO, start: Optional[float] = None) -> int:
+    """Drive ``engine`` with the JSON line protocol; return an exit status."""
+
+    def emit(payload):
+        stdout.write(json.dumps(payload) + "\n")
+        stdout.flush()
+
+    qid = _next_question(engine)
+    first = True
+    while qid is not None:
+        payload = {"question": _question(engine, qid), "answered": len(engine.answered)}
+        if first:
+            payload["startup_ms"] = _record_startup(start)
+            first = False
+        emit(payload)
+        line = stdin.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise ValueError("expected an object")
+        except ValueError as exc:
+            emit({"error": f"Invalid JSON: {exc}"})
+            continue
+        if message.get("stop"):
+            break
+        if message.get("undo"):
+            engine.undo_last_answer()
+        elif message.get("answer") in engine.get_possible_answers(qid):
+            engine.answer_question(qid, message["answer"])
+        else:
+            emit({"error": f"Invalid answer: {message.get('answer')}"})
+            continue
+        qid = _next_question(engine)
+    emit(
+        {
+            "done": True,
+            "stop_reason": engine.stop_reason(),
+            "top": [[d, s] for d, s in engine.get_top_diseases()],
+        }
+    )
+    return 0
+
+
+def run_interactive(
+    engine, stdin: TextIO, stdout: TextIO, start: Optional[float] = None
+) -> int:
+    """Ask the questions on a text terminal; return an exit status."""
+
+    qid = _next_question(engine)
+    first = True
+    while qid is not None:
+        question = _question(engine, qid)
+        if first:
+            _record_startup(start)
+            first = False
+        stdout.write(f"\nQuestion {len(engine.answered) + 1}: {question['text']}\n")
+        for i, answer in enumerate(question["answers"], 1):
+            stdout.write(f"  {i}. {answer}\n")
+        stdout.write("Answer (number, b = back, q = quit): ")
+        stdout.flush()
+        line = stdin.readline()
+        if not line:
+            break
+        reply = line.strip()
+        if reply.lower() == "q":
+            break
+        if reply.lower() == "b":
+            engine.undo_last_answer()
+        elif reply.isdigit() and 1 <= int(reply) <= len(question["answers"]):
+            engine.answer_question(qid, question["answers"][int(reply) - 1])
+        elif reply in question["answers"]:
+            engine.answer_question(qid, reply)
+        else:
+            stdout.write("Please choose one of the listed answers.\n")
+            continue
+        qid = _next_question(engine)
+    stdout.write("\nMost likely diagnoses:\n")
+    for disease, score in engine.get_top_diseases():
+        stdout.write(f"  {disease}: {score:.2f}\n")
+    return 0
+
+
+def run(json_mode: bool = False, debug: bool = False, start: Optional[float] = None) -> int:
+    """Run a headless session on stdin/stdout."""
+
+    if debug:
+        logging.basicConfig(level=logging.DEBUG)
+    engine = create_engine(debug)
+    if json_mode:
+        return run_json(engine, sys.stdin, sys.stdout, start)
+    return run_interactive(engine, sys.stdin, sys.stdout, start)
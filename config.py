@@ -41,6 +41,77 @@ DISEASES_FILE = _get_env_or_default(
 DIAGNOSIS_MODEL_FILE = _get_env_or_default(
     "AIVO_DIAGNOSIS_MODEL_FILE", os.path.join(DATA_DIR, "diagnosis_model.json")
 )
+# Packed form of the three files above, built with ``model_binary.py`` and
+# used instead of them while it is newer than all of them.
+MODEL_BINARY_FILE = _get_env_or_default(
+    "AIVO_MODEL_BINARY_FILE", os.path.join(DATA_DIR, "diagnosis_model.bin")
+)
+POLICY_TREE_FILE = _get_env_or_default(
+    "AIVO_POLICY_TREE_FILE", os.path.join(DATA_DIR, "policy_tree.json")
+)
+
+# Number of next-question selections memoized across sessions and the
+# eviction policy ("lru" or "fifo") used once the cache is full.
+QUESTION_CACHE_SIZE = get_env_int("AIVO_QUESTION_CACHE_SIZE", 4096)
+QUESTION_CACHE_POLICY = _get_env_or_default("AIVO_QUESTION_CACHE_POLICY", "lru")
+
+# Questions looked ahead by the next-question selection (1 = greedy, see
+# ``lookahead.py``), questions expanded per step, nodes searched and the
+# time budget per selection in milliseconds before falling back to greedy.
+LOOKAHEAD_DEPTH = get_env_int("AIVO_LOOKAHEAD_DEPTH", 1)
+LOOKAHEAD_BEAM = get_env_int("AIVO_LOOKAHEAD_BEAM", 4)
+LOOKAHEAD_NODES = get_env_int("AIVO_LOOKAHEAD_NODES", 5000)
+LOOKAHEAD_BUDGET_MS = get_env_int("AIVO_LOOKAHEAD_BUDGET_MS", 200)
+
+# Stop a session early once no answer can change the order of the top
+# ``AIVO_STOP_TOP_K`` diseases; 0 only stops at the question limit.
+STOP_TOP_K = get_env_int("AIVO_STOP_TOP_K", 3)
+
+# Diseases that can no longer reach the top ``AIVO_PRUNE_TOP_K`` of the
+# ranking are left out of rankings of that size, and diseases that can no
+# longer affect the entropy out of the information gain loop; 0 disables.
+PRUNE_TOP_K = get_env_int("AIVO_PRUNE_TOP_K", 3)
+
+# Reuse parsed data files and compiled models while the files are
+# unchanged (same mtime and size, plus same SHA-1 with the hash option).
+# The compiled model is also cached on disk next to the data files.
+STORAGE_CACHE = get_env_bool("AIVO_STORAGE_CACHE", True)
+STORAGE_CACHE_HASH = get_env_bool("AIVO_STORAGE_CACHE_HASH")
+# Write the data files without indentation: smaller and faster to parse,
+# at the cost of readable diffs.
+STORAGE_COMPACT = get_env_bool("AIVO_STORAGE_COMPACT")
+
+# Storage backend of the admin panel: "json" (the files above) or
+# "sqlite" (``storage_sqlite.py``, stored in ``SQLITE_FILE``).
+STORAGE_BACKEND = _get_env_or_default("AIVO_STORAGE", "json")
+SQLITE_FILE = _get_env_or_default("AIVO_SQLITE_FILE", os.path.join(DATA_DIR, "aivo.db"))
+
+# Seconds between checks of the data files by ``ModelProvider``.
+MODEL_POLL_INTERVAL = get_env_int("AIVO_MODEL_POLL_INTERVAL", 2)
+
+# Budget in milliseconds from process start to the first question in the
+# headless modes (``main.py --headless``/``--json``); exceeding it logs a
+# warning.
+FIRST_QUESTION_BUDGET_MS = get_env_int("AIVO_FIRST_QUESTION_BUDGET_MS", 250)
+
+# Address of the HTTP diagnosis service (``service.py``).
+SERVICE_HOST = _get_env_or_default("AIVO_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = get_env_int("AIVO_SERVICE_PORT", 8080)
+
+# Bounds on the in-progress sessions held by the service.  Sessions idle
+# for longer than the TTL (seconds) or evicted for capacity are kept as
+# compact snapshots, on disk when a snapshot directory is configured.
+# Snapshots are deleted after their own TTL or beyond their own capacity.
+SESSION_CAPACITY = get_env_int("AIVO_SESSION_CAPACITY", 10000)
+SESSION_TTL = get_env_int("AIVO_SESSION_TTL", 1800)
+SESSION_SNAPSHOT_CAPACITY = get_env_int("AIVO_SESSION_SNAPSHOT_CAPACITY", 100000)
+SESSION_SNAPSHOT_TTL = get_env_int("AIVO_SESSION_SNAPSHOT_TTL", 86400)
+SESSION_SNAPSHOT_DIR = os.getenv("AIVO_SESSION_SNAPSHOT_DIR")
+
+# Collect engine latency histograms and counters (see instrumentation.py)
+# and optionally dump them as JSON to ``AIVO_METRICS_FILE`` on exit.
+METRICS_ENABLED = get_env_bool("AIVO_METRICS")
+METRICS_FILE = os.getenv("AIVO_METRICS_FILE")
 
 # Default UI configuration values.  AdminUI relies on these constants
 # when sizing and styling its windows.  They previously did not exist
@@ -1,58 +1,446 @@
 """Rule based diagnostic engine."""
 
+import heapq
 import logging
 import math
-from copy import deepcopy
+import struct
+from collections.abc import Mapping, Set
+
+import config
+from instrumentation import metrics, timed
+from model_compiled import compile_model, validate_model
+from question_cache import MISSING, answers_fingerprint, default_cache
+
+NEG_INF = float('-inf')
+
+# Default length limit of a session, see ``DiagnosisEngine.stop_reason``.
+MAX_QUESTIONS = 25
+
+# Binary session state: magic, format version, 20 byte model version digest,
+# then the answer ids of ``history`` as LEB128 varints.
+STATE_MAGIC = b"AIVS"
+STATE_FORMAT = 1
+_STATE_HEADER = struct.Struct("<4sB20s")
+
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varints(data, offset):
+    values = []
+    value = shift = 0
+    for byte in data[offset:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        value = shift = 0
+    if shift:
+        raise ValueError("Truncated session state")
+    return values
+
+
+def _entropy(scores):
+    """Return the Shannon entropy of a sequence of disease scores."""
+
+    active = [s for s in scores if s != NEG_INF]
+    values = [max(0, s) for s in active]
+    total = sum(values)
+    if total == 0 or not active:
+        return math.log2(len(active)) if len(active) else 0
+    probs = [v / total for v in values]
+    return -sum(p * math.log2(p) for p in probs if p > 0)
+
+
+def _entropy_sums(scores):
+    """Return ``(mass, mass_log_mass, active)`` running sums for ``scores``.
+
+    ``mass`` is the total positive score and ``mass_log_mass`` the sum of
+    ``s * log2(s)`` over positive scores, which is enough to derive the
+    entropy as ``log2(mass) - mass_log_mass / mass``.
+    """
+
+    mass = 0
+    mass_log_mass = 0.0
+    active = 0
+    for s in scores:
+        if s == NEG_INF:
+            continue
+        active += 1
+        if s > 0:
+            mass += s
+            mass_log_mass += s * math.log2(s)
+    return mass, mass_log_mass, active
+
+
+def _entropy_from_sums(mass, mass_log_mass, active):
+    """Return the entropy described by ``_entropy_sums`` style totals."""
+
+    if mass <= 0 or not active:
+        return math.log2(active) if active else 0
+    return math.log2(mass) - mass_log_mass / mass
+
+
+class DiseaseMapping(Mapping):
+    """Read-only ``disease -> value`` view over an engine vector."""
+
+    __slots__ = ("_index", "_lookup")
+
+    def __init__(self, index, lookup):
+        self._index = index
+        self._lookup = lookup
+
+    def __getitem__(self, disease):
+        return self._lookup(self._index[disease])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class RemainingQuestions(Set):
+    """Read-only set of the askable questions not answered yet."""
+
+    __slots__ = ("_compiled", "_answered")
+
+    def __init__(self, compiled, answered):
+        self._compiled = compiled
+        self._answered = answered
+
+    def __contains__(self, question):
+        return question in self._compiled.askable_set and question not in self._answered
+
+    def __iter__(self):
+        answered = self._answered
+        return (q for q in self._compiled.askable if q not in answered)
+
+    def __len__(self):
+        askable = self._compiled.askable_set
+        return len(askable) - sum(1 for q in self._answered if q in askable)
+
+
+class _FilteredRows:
+    """Rows of a compiled model restricted to the diseases in ``keep``.
+
+    Rows are filtered on first access and kept, so only the features a
+    session actually evaluates are ever copied.
+    """
+
+    __slots__ = ("_rows", "_keep", "_pairs", "_cache")
+
+    def __init__(self, rows, keep, pairs):
+        self._rows = rows
+        self._keep = keep
+        self._pairs = pairs
+        self._cache = {}
+
+    def __getitem__(self, f):
+        row = self._cache.get(f)
+        if row is None:
+            keep = self._keep
+            if self._pairs:
+                row = tuple(entry for entry in self._rows[f] if keep[entry[0]])
+            else:
+                row = tuple(i for i in self._rows[f] if keep[i])
+            self._cache[f] = row
+        return row
+
+
+class Candidates:
+    """Diseases that can still matter to a session, from its score bounds.
+
+    ``ranking`` lists, in model order, the diseases not ruled out whose
+    best case can still reach the worst case of the ``k``-th best disease;
+    any other disease stays below at least ``k`` others whatever the
+    remaining answers are.  ``deltas`` and ``rules_out`` are the compiled
+    rows without the diseases ruled out, and ``deltas`` also without those
+    that can no longer score above zero: neither changes the entropy.
+    The rows may be kept from an earlier answer of the same session, so
+    they can hold a few more diseases than ``live`` counts.  ``parent`` is
+    the instance built before this one, which undo returns to.
+
+    Until ``MAX_QUESTIONS`` answers the bounds only count the questions
+    still to be asked before that limit; ``until`` is then the number of
+    answers the rows hold for, ``None`` meaning any number.
+    """
+
+    __slots__ = ("history", "ranking", "deltas", "rules_out", "live", "until", "parent")
+
+    def __init__(self, history, ranking, deltas, rules_out, live, until=None, parent=None):
+        self.history = history
+        self.ranking = ranking
+        self.deltas = deltas
+        self.rules_out = rules_out
+        self.live = live
+        self.until = until
+        self.parent = parent
+
+    def rows_for(self, answered):
+        """Return ``self`` if the rows hold for one more answer after ``answered``."""
+
+        if self.until is None or answered < self.until:
+            return self
+        return None
+
+
+class DiagnosisSession:
+    """Per-case state of a diagnosis, kept apart from the shared model.
+
+    ``scores`` is indexed like ``CompiledModel.diseases`` and starts out as
+    the model's shared zero vector; it is only copied once the first answer
+    is applied, so a fresh session costs a few hundred bytes whatever the
+    model size.  ``eliminated`` maps the index of each ruled out disease to
+    ``(count, score before elimination)``.  ``sums`` holds the running
+    entropy sums and ``sums_history`` their value before each answer in
+    ``history`` so undo restores them exactly (``None`` entries, left by a
+    state restore, are recomputed on undo).  ``policy_nodes`` holds the
+    policy tree node per answer, ``None`` once the session left the tree.
+    ``bounds`` holds ``(upper, lower, pending)`` per disease over the
+    unanswered questions: the most and least the remaining answers can
+    still add to its score, and how many of them could rule it out.  It is
+    ``None`` until the stopping rule first needs it.  ``candidates`` holds
+    the ``Candidates`` derived from them, or ``None``.
+    """
+
+    __slots__ = (
+        "scores",
+        "eliminated",
+        "sums",
+        "sums_history",
+        "policy_nodes",
+        "answered",
+        "history",
+        "bounds",
+        "candidates",
+    )
+
+    def __init__(self, compiled, policy_root=None):
+        self.scores = compiled.zero_scores
+        self.eliminated = {}
+        self.sums = compiled.zero_sums
+        self.sums_history = []
+        self.policy_nodes = [policy_root]
+        self.answered = {}
+        self.history = []
+        self.bounds = None
+        self.candidates = None
+
+    def copy(self):
+        """Return an independent copy of this session."""
+
+        other = DiagnosisSession.__new__(DiagnosisSession)
+        other.scores = self.scores
+        other.eliminated = dict(self.eliminated)
+        other.sums = self.sums
+        other.sums_history = list(self.sums_history)
+        other.policy_nodes = list(self.policy_nodes)
+        other.answered = dict(self.answered)
+        other.history = list(self.history)
+        other.bounds = self.bounds
+        other.candidates = self.candidates
+        return other
 
 
 class DiagnosisEngine:
-    """Perform simple rule based disease ranking."""
+    """Perform simple rule based disease ranking.
 
-    def __init__(self, diseases, questions, model, *, debug: bool = False):
-        self.diseases = diseases
-        self.questions = questions
-        self.model = model
+    The engine pairs an immutable ``CompiledModel``, which may be shared by
+    any number of engines and threads, with one ``DiagnosisSession``.  Use
+    ``from_compiled`` to start sessions on an already loaded model without
+    validating or copying it again.  ``lookahead`` (see ``lookahead.py``)
+    replaces the greedy next-question selection, and the greedy policy
+    tree, with a multi-step search.
+    """
+
+    __slots__ = (
+        "compiled",
+        "session",
+        "question_cache",
+        "policy",
+        "lookahead",
+        "debug",
+        "logger",
+    )
+
+    def __init__(
+        self,
+        diseases,
+        questions,
+        model,
+        *,
+        debug: bool = False,
+        question_cache=default_cache,
+        policy=None,
+        index=None,
+        lookahead=None,
+    ):
+        validate_model(diseases, questions, model)
+        compiled = compile_model(diseases, questions, model, index)
+        self._setup(compiled, debug, question_cache, policy, lookahead)
+
+    @classmethod
+    def from_compiled(
+        cls,
+        compiled,
+        *,
+        debug: bool = False,
+        question_cache=default_cache,
+        policy=None,
+        lookahead=None,
+    ):
+        """Return an engine with a new session on the shared ``compiled`` model."""
+
+        engine = cls.__new__(cls)
+        engine._setup(compiled, debug, question_cache, policy, lookahead)
+        return engine
+
+    def _setup(self, compiled, debug, question_cache, policy, lookahead=None):
+        self.compiled = compiled
+        self.lookahead = lookahead
         self.debug = debug
+        # Shared across engines so sessions reuse each other's selections;
+        # pass ``None`` to always compute the next question live.
+        self.question_cache = question_cache
         self.logger = logging.getLogger(self.__class__.__name__)
         if self.debug and not logging.getLogger().handlers:
             logging.basicConfig(level=logging.DEBUG)
-        self.logger.debug("Engine initialised")
-        self.history = []
-        self._validate_model()
+        if policy is not None and policy.version != compiled.version:
+            self.logger.warning("Ignoring policy tree built for another model")
+            policy = None
+        self.policy = policy
         self.reset()
-
-    def _validate_model(self) -> None:
-        """Log a warning if ``model`` lacks weights for known questions."""
-
-        for d in self.diseases:
-            for q in self.questions:
-                if q not in self.model.get(d, {}):
-                    self.logger.warning("Model missing weights for %s/%s", d, q)
+        self.logger.debug("Engine initialised")
 
     def reset(self):
-        self.scores = {d: 0 for d in self.diseases}
-        self.answered = {}
-        self.remaining_questions = set(self.questions)
-        self.history = []
-        self.eliminated = {d: 0 for d in self.diseases}
-        self._prev_scores = {}
+        self.session = DiagnosisSession(
+            self.compiled, None if self.policy is None else 0
+        )
         self.logger.debug("State reset")
 
-    def answer_question(self, question, answer):
-        self.answered[question] = answer
-        self.remaining_questions.discard(question)
-        self.history.append(question)
-        for disease in self.diseases:
-            if question not in self.model[disease]:
+    @property
+    def diseases(self):
+        return self.compiled.diseases
+
+    @property
+    def questions(self):
+        return self.compiled.askable
+
+    @property
+    def model(self):
+        return self.compiled.model
+
+    @property
+    def answered(self):
+        return self.session.answered
+
+    @property
+    def history(self):
+        return self.session.history
+
+    @property
+    def remaining_questions(self):
+        """Set of the questions not answered yet."""
+
+        return RemainingQuestions(self.compiled, self.session.answered)
+
+    @property
+    def scores(self):
+        """Mapping of disease name to current score."""
+
+        session = self.session
+        return DiseaseMapping(
+            self.compiled.disease_index, lambda i: session.scores[i]
+        )
+
+    @property
+    def eliminated(self):
+        """Mapping of disease name to the number of answers ruling it out."""
+
+        eliminated = self.session.eliminated
+        return DiseaseMapping(
+            self.compiled.disease_index,
+            lambda i: eliminated[i][0] if i in eliminated else 0,
+        )
+
+    def _apply_feature(self, f):
+        """Add the weights of feature ``f`` and update eliminations."""
+
+        session = self.session
+        scores = list(session.scores)
+        # ``-inf`` absorbs the addition so eliminated diseases stay put.
+        for i, w in self.compiled.deltas[f]:
+            scores[i] += w
+        eliminated = session.eliminated
+        for i in self.compiled.rules_out[f]:
+            entry = eliminated.get(i)
+            if entry is None:
+                eliminated[i] = (1, scores[i])
+                scores[i] = NEG_INF
+            else:
+                eliminated[i] = (entry[0] + 1, entry[1])
+        session.scores = scores
+
+    def _revert_feature(self, f):
+        """Undo ``_apply_feature`` for feature ``f``."""
+
+        session = self.session
+        scores = list(session.scores)
+        for i, w in self.compiled.deltas[f]:
+            scores[i] -= w
+        eliminated = session.eliminated
+        for i in self.compiled.rules_out[f]:
+            entry = eliminated.get(i)
+            if entry is None:
                 continue
-            weight = self.model[disease][question].get(answer, 0)
-            if weight == -1:
-                if self.eliminated[disease] == 0:
-                    self._prev_scores[disease] = self.scores[disease]
-                    self.scores[disease] = float('-inf')
-                self.eliminated[disease] += 1
-            elif self.eliminated[disease] == 0:
-                self.scores[disease] += weight
+            if entry[0] == 1:
+                del eliminated[i]
+                # Score restored to value prior to elimination
+                scores[i] = entry[1]
+            else:
+                eliminated[i] = (entry[0] - 1, entry[1])
+        session.scores = scores
+
+    def _shift_bounds(self, bounds, question, sign=1):
+        """Return ``bounds`` without ``question`` (with it for ``sign=-1``).
+
+        Lists are copied, never updated in place, so sessions may share them.
+        """
+
+        entries = self.compiled.question_bounds.get(question)
+        if not entries:
+            return bounds
+        upper, lower, pending = (list(b) for b in bounds)
+        for i, low, high in entries:
+            upper[i] -= sign * high
+            if low == NEG_INF:
+                pending[i] -= sign
+            else:
+                lower[i] -= sign * low
+        return upper, lower, pending
+
+    @timed("engine.answer_question")
+    def answer_question(self, question, answer):
+        session = self.session
+        if session.bounds is not None and question not in session.answered:
+            session.bounds = self._shift_bounds(session.bounds, question)
+        session.answered[question] = answer
+        session.history.append(question)
+        session.sums_history.append(session.sums)
+        node = session.policy_nodes[-1]
+        if node is not None:
+            node = self.policy.child(node, question, answer)
+        session.policy_nodes.append(node)
+        f = self.compiled.feature_id(question, answer)
+        if f is not None:
+            session.sums = self._sums_after(f, session.sums)
+            self._apply_feature(f)
         self.logger.debug("Answered %s=%s", question, answer)
 
     def compute_entropy(self, scores=None):
@@ -62,118 +450,491 @@ class DiagnosisEngine:
         ----------
         scores: dict or None
             Mapping of disease name to numeric score. If ``None`` the current
-            engine scores are used.
+            engine scores are used and the entropy is read in constant time
+            from the sums maintained by ``answer_question``.
         """
 
-        scores = scores if scores is not None else self.scores
-        active = [s for s in scores.values() if not math.isinf(s)]
-        values = [max(0, s) for s in active]
-        total = sum(values)
-        if total == 0 or not active:
-            return math.log2(len(active)) if len(active) else 0
-        probs = [v / total for v in values]
-        ent = -sum(p * math.log2(p) for p in probs if p > 0)
+        if scores is None:
+            ent = _entropy_from_sums(*self.session.sums)
+        else:
+            ent = _entropy(scores.values())
         self.logger.debug("Entropy computed: %.4f", ent)
         return ent
 
     def get_possible_answers(self, question):
-        for d in self.diseases:
-            if question in self.model[d]:
-                return list(self.model[d][question].keys())
-        return ["Yes", "No"]
+        return list(self.compiled.possible_answers(question))
 
     def simulate_answer(self, scores, question, answer):
-        sim_scores = deepcopy(scores)
-        for disease in self.diseases:
-            if question not in self.model[disease]:
-                continue
-            weight = self.model[disease][question].get(answer, 0)
-            if weight == -1:
-                sim_scores[disease] = float('-inf')
-            elif not math.isinf(sim_scores[disease]):
-                sim_scores[disease] += weight
+        sim_scores = dict(scores)
+        f = self.compiled.feature_id(question, answer)
+        if f is None:
+            return sim_scores
+        diseases = self.compiled.diseases
+        for i, weight in self.compiled.deltas[f]:
+            d = diseases[i]
+            if not math.isinf(sim_scores[d]):
+                sim_scores[d] += weight
+        for i in self.compiled.rules_out[f]:
+            sim_scores[diseases[i]] = NEG_INF
         return sim_scores
 
+    def _sums_after(self, f, sums, rows=None):
+        """Return the entropy ``sums`` as they would be after feature ``f``.
+
+        Only the diseases touched by ``f`` are visited: their contribution
+        is swapped out of the running sums without copying the scores.
+        ``rows`` may be the session's ``Candidates`` to skip the diseases
+        that cannot change the sums.
+        """
+
+        if rows is None:
+            rows = self.compiled
+        mass, mass_log_mass, active = sums
+        scores = self.session.scores
+        log2 = math.log2
+        for i, w in rows.deltas[f]:
+            s = scores[i]
+            if s == NEG_INF:
+                continue
+            new = s + w
+            if s > 0:
+                mass -= s
+                mass_log_mass -= s * log2(s)
+            if new > 0:
+                mass += new
+                mass_log_mass += new * log2(new)
+        for i in rows.rules_out[f]:
+            s = scores[i]
+            if s == NEG_INF:
+                continue
+            active -= 1
+            if s > 0:
+                mass -= s
+                mass_log_mass -= s * log2(s)
+        return mass, mass_log_mass, active
+
+    def _branch_entropy(self, f, rows=None):
+        """Return the entropy after applying feature ``f`` hypothetically."""
+
+        sums = self.session.sums
+        if f is None:
+            return _entropy_from_sums(*sums)
+        return _entropy_from_sums(*self._sums_after(f, sums, rows))
+
+    def entropy_after(self, question, answer):
+        """Return the entropy the scores would have after ``answer``.
+
+        Equivalent to ``compute_entropy(simulate_answer(...))`` but works
+        from the sparse delta of the answer instead of a copied score map.
+        """
+
+        f = self.compiled.feature_id(question, answer)
+        return self._branch_entropy(f)
+
+    def information_gains(self, questions):
+        """Return ``{question: information gain}`` for ``questions``.
+
+        Every (question, answer) branch is evaluated from the sparse answer
+        deltas against the engine's running entropy sums, skipping the
+        diseases that cannot change them (see ``Candidates``).
+        """
+
+        current_entropy = _entropy_from_sums(*self.session.sums)
+        candidates = self._candidates()
+        answered = self.session.answered
+        if candidates is not None:
+            candidates = candidates.rows_for(len(answered))
+        gains = {}
+        for q in questions:
+            features = self.compiled.question_features(q)
+            # Candidates are derived from bounds over unanswered questions.
+            rows = candidates if q not in answered else None
+            total = 0
+            for f in features:
+                total += self._branch_entropy(f, rows)
+            expected_entropy = total / len(features) if features else 0
+            gains[q] = current_entropy - expected_entropy
+        return gains
+
     def information_gain_for_question(self, question):
         """Calculate expected information gain for ``question``."""
 
-        answers = self.get_possible_answers(question)
-        entropies = []
-        num_answers = len(answers)
-        for answer in answers:
-            sim_scores = self.simulate_answer(self.scores, question, answer)
-            ent = self.compute_entropy(sim_scores)
-            entropies.append(ent)
-        expected_entropy = sum(entropies) / num_answers if num_answers else 0
-        current_entropy = self.compute_entropy()
-        info_gain = current_entropy - expected_entropy
+        info_gain = self.information_gains([question])[question]
         self.logger.debug("Info gain for %s: %.4f", question, info_gain)
         return info_gain
 
+    @timed("engine.select_best_question")
     def select_best_question(self):
+        node = self.session.policy_nodes[-1]
+        if node is not None and self.lookahead is None:
+            best_q = self.policy.question(node)
+            metrics.incr("engine.select.policy")
+            self.logger.debug("Best next question (policy): %s", best_q)
+            return best_q
+        cache = self.question_cache
+        if cache is not None:
+            key = (self.compiled.version, answers_fingerprint(self.answered))
+            if self.lookahead is not None:
+                key += self.lookahead.key
+            cached = cache.get(key)
+            if cached is not MISSING:
+                metrics.incr("engine.select.cache_hit")
+                self.logger.debug("Best next question (cached): %s", cached)
+                return cached
+        metrics.incr("engine.select.live")
+        complete = True
+        if self.lookahead is not None:
+            best_q, complete = self.lookahead.select(self)
+        else:
+            best_q = self._select_best_question()
+        # A timed out lookahead returned the greedy question; don't keep it.
+        if cache is not None and complete:
+            cache.put(key, best_q)
+        return best_q
+
+    def _select_best_question(self):
+        # Candidates are scanned in model order so ties resolve the same way
+        # on every run instead of depending on set iteration order.
+        answered = self.session.answered
+        candidates = [q for q in self.compiled.askable if q not in answered]
+        gains = self.information_gains(candidates)
         best_q = None
         best_ig = -float('inf')
-        for q in self.remaining_questions:
-            ig = self.information_gain_for_question(q)
+        for q in candidates:
+            ig = gains[q]
             if ig > best_ig:
                 best_q = q
                 best_ig = ig
         self.logger.debug("Best next question: %s (IG=%.4f)", best_q, best_ig)
         return best_q
 
+    def _candidates(self):
+        """Return the session's ``Candidates``, or ``None`` without pruning.
+
+        Rebuilt once per answer; the rows are only filtered again when the
+        diseases that can still score above zero dropped by a tenth, and
+        not at all before that.
+        """
+
+        k = config.PRUNE_TOP_K
+        if k <= 0:
+            return None
+        session = self.session
+        candidates = session.candidates
+        history = len(session.history)
+        if candidates is not None and candidates.history == history:
+            return candidates
+        scores = session.scores
+        answered = len(session.answered)
+        until = MAX_QUESTIONS if answered < MAX_QUESTIONS else None
+        upper, lower, pending = self._bounds(None if until is None else until - answered)
+        worst = [
+            NEG_INF if p else s + low for s, low, p in zip(scores, lower, pending)
+        ]
+        threshold = heapq.nlargest(k, worst)[-1] if len(worst) >= k else NEG_INF
+        ranking = tuple(
+            i
+            for i, s in enumerate(scores)
+            if s != NEG_INF and s + upper[i] >= threshold
+        )
+        positive = [s + u > 0 for s, u in zip(scores, upper)]
+        live = sum(positive)
+        rows = None if candidates is None else candidates.rows_for(answered - 1)
+        previous = len(scores) if rows is None else rows.live
+        if live > previous * 0.9:
+            if rows is None:
+                rows = self.compiled
+            else:
+                until = rows.until
+            deltas, rules_out, live = rows.deltas, rows.rules_out, previous
+        else:
+            alive = [s != NEG_INF for s in scores]
+            deltas = _FilteredRows(self.compiled.deltas, positive, True)
+            rules_out = _FilteredRows(self.compiled.rules_out, alive, False)
+        candidates = Candidates(history, ranking, deltas, rules_out, live, until, candidates)
+        session.candidates = candidates
+        return candidates
+
+    @property
+    def active_candidates(self):
+        """Number of diseases that can still reach the top of the ranking."""
+
+        candidates = self._candidates()
+        if candidates is None:
+            return sum(1 for s in self.session.scores if s != NEG_INF)
+        return len(candidates.ranking)
+
     def get_top_diseases(self, n=3):
-        active = {d: s for d, s in self.scores.items() if not math.isinf(s)}
-        top = sorted(active.items(), key=lambda x: x[1], reverse=True)[:n]
+        candidates = self._candidates() if n <= config.PRUNE_TOP_K else None
+        if candidates is None:
+            active = self.get_scores().items()
+        else:
+            # Every other disease stays below at least ``n`` candidates.
+            scores = self.session.scores
+            diseases = self.compiled.diseases
+            active = [(diseases[i], scores[i]) for i in candidates.ranking]
+        top = sorted(active, key=lambda x: x[1], reverse=True)[:n]
         self.logger.debug("Top diseases: %s", top)
         return top
 
     def get_scores(self):
-        return {d: s for d, s in self.scores.items() if not math.isinf(s)}
+        return {
+            d: s
+            for d, s in zip(self.compiled.diseases, self.session.scores)
+            if s != NEG_INF
+        }
 
     def get_progress(self):
-        active = {d: s for d, s in self.scores.items() if not math.isinf(s)}
+        active = self.get_scores()
         max_score = max(active.values()) if active else 1
         return {d: (s / max_score if max_score else 0) for d, s in active.items()}
 
-    def is_done(self, max_questions=25):
-        done = len(self.answered) >= max_questions or not self.remaining_questions
-        self.logger.debug("Is done? %s", done)
-        return done
+    def _bounds(self, horizon=None):
+        """Return the session's ``(upper, lower, pending)`` bounds.
+
+        With ``horizon``, only that many more answers are counted: no
+        answer moves a score by more than the disease's largest swing.
+        """
+
+        session = self.session
+        if session.bounds is None:
+            bounds = self.compiled.zero_bounds
+            for q in session.answered:
+                bounds = self._shift_bounds(bounds, q)
+            session.bounds = bounds
+        upper, lower, pending = session.bounds
+        if horizon is not None:
+            highest, lowest = self.compiled.bound_extremes
+            upper = [min(u, horizon * h) for u, h in zip(upper, highest)]
+            lower = [max(b, horizon * w) for b, w in zip(lower, lowest)]
+        return upper, lower, pending
+
+    def ranking_fixed(self, k, horizon=None):
+        """Return whether the ordered top ``k`` can no longer change.
+
+        Each disease's final score lies between its score plus the lower
+        and upper bound of the unanswered questions, whichever of them are
+        asked.  When at most ``horizon`` more answers will be given, the
+        bounds are also capped at ``horizon`` times the disease's largest
+        per-question swing.  The ranking is fixed once every one of the
+        first ``k`` diseases cannot be ruled out and its worst case beats
+        the best case of every disease below it.
+        """
+
+        scores = self.session.scores
+        upper, lower, pending = self._bounds(horizon)
+        candidates = self._candidates() if k <= config.PRUNE_TOP_K else None
+        answered = len(self.answered)
+        if answered < MAX_QUESTIONS and (horizon is None or answered + horizon > MAX_QUESTIONS):
+            # The candidates only hold for answers up to MAX_QUESTIONS.
+            candidates = None
+        if candidates is None:
+            alive = (i for i, s in enumerate(scores) if s != NEG_INF)
+        else:
+            alive = candidates.ranking
+        ranked = sorted(alive, key=scores.__getitem__, reverse=True)
+        k = min(k, len(ranked))
+        # best[j]: highest final score reachable by any disease ranked >= j.
+        best = [NEG_INF] * (len(ranked) + 1)
+        for j in range(len(ranked) - 1, 0, -1):
+            i = ranked[j]
+            best[j] = max(best[j + 1], scores[i] + upper[i])
+        for j in range(k):
+            i = ranked[j]
+            if pending[i] or scores[i] + lower[i] <= best[j + 1]:
+                return False
+        return True
+
+    def stop_reason(self, max_questions=MAX_QUESTIONS, top_k=None):
+        """Return why the session should stop, or ``None`` to keep asking.
+
+        ``"max_questions"`` once ``max_questions`` are answered,
+        ``"no_questions"`` when none are left and ``"ranking_fixed"`` when
+        no answer can change the top ``top_k`` diseases (default
+        ``AIVO_STOP_TOP_K``, ``0`` never stops early).
+        """
+
+        if len(self.answered) >= max_questions:
+            return "max_questions"
+        if not self.remaining_questions:
+            return "no_questions"
+        if top_k is None:
+            top_k = config.STOP_TOP_K
+        if top_k > 0 and self.ranking_fixed(top_k, max_questions - len(self.answered)):
+            return "ranking_fixed"
+        return None
+
+    def is_done(self, max_questions=MAX_QUESTIONS, top_k=None):
+        reason = self.stop_reason(max_questions, top_k)
+        self.logger.debug("Is done? %s", reason)
+        return reason is not None
 
     def get_state(self):
+        """Return a JSON friendly snapshot of the session state.
+
+        The snapshot is complete: ``restore_state`` rebuilds the session
+        from it without replaying the answers.  Ruled out diseases score
+        ``None`` (JSON ``null``) rather than ``-inf``, which is not JSON.
+        """
+
+        session = self.session
+        diseases = self.compiled.diseases
         state = {
-            "scores": deepcopy(self.scores),
-            "answered": deepcopy(self.answered),
+            "version": self.compiled.version,
+            "scores": {
+                d: None if s == NEG_INF else s for d, s in zip(diseases, session.scores)
+            },
+            "answered": dict(session.answered),
             "remaining_questions": list(self.remaining_questions),
-            "history": list(self.history),
+            "history": list(session.history),
+            "eliminated": {diseases[i]: e[0] for i, e in session.eliminated.items()},
+            "prev_scores": {diseases[i]: e[1] for i, e in session.eliminated.items()},
         }
-        self.logger.debug("Current state: %s", state)
+        self.logger.debug("Current state: %d answers", len(session.history))
         return state
 
+    def _check_version(self, version):
+        if version != self.compiled.version:
+            raise ValueError("Session state was saved with another model version")
+
+    def _restore_session(self, history, answered, scores, eliminated):
+        session = DiagnosisSession(self.compiled, None if self.policy is None else 0)
+        session.history = history
+        session.answered = answered
+        session.scores = scores
+        session.eliminated = eliminated
+        session.sums = _entropy_sums(scores)
+        # Earlier sums are recomputed on undo, see ``undo_last_answer``.
+        session.sums_history = [None] * len(history)
+        node = session.policy_nodes[0]
+        for q in history:
+            if node is not None:
+                node = self.policy.child(node, q, answered.get(q))
+            session.policy_nodes.append(node)
+        self.session = session
+
+    def restore_state(self, state):
+        """Restore a session from a ``get_state`` snapshot."""
+
+        if "version" in state:
+            self._check_version(state["version"])
+        index = self.compiled.disease_index
+        scores = list(self.compiled.zero_scores)
+        for d, s in state["scores"].items():
+            scores[index[d]] = NEG_INF if s is None else s
+        prev = state.get("prev_scores", {})
+        eliminated = {
+            index[d]: (count, prev.get(d, 0))
+            for d, count in state.get("eliminated", {}).items()
+        }
+        self._restore_session(
+            list(state["history"]), dict(state["answered"]), scores, eliminated
+        )
+        self.logger.debug("Restored state with %d answers", len(state["history"]))
+
+    def dump_state(self):
+        """Return the session state in a compact binary form.
+
+        Only the answer ids of ``history`` are stored, so the result is a
+        few bytes per answer plus a 25 byte header.  An answer without
+        weights in the model has no id; it is stored as the sentinel id
+        ``num_features`` followed by the question's position in the index
+        and the answer's position in its domain.
+        """
+
+        session = self.session
+        compiled = self.compiled
+        out = bytearray(
+            _STATE_HEADER.pack(STATE_MAGIC, STATE_FORMAT, bytes.fromhex(compiled.version))
+        )
+        for q in session.history:
+            a = session.answered.get(q)
+            f = compiled.feature_id(q, a)
+            if f is not None:
+                _encode_varint(f, out)
+                continue
+            position = compiled.question_index.get(q)
+            answers = compiled.possible_answers(q)
+            if position is None or a not in answers:
+                raise ValueError(f"Cannot encode answer to {q}: not in the model")
+            for value in (compiled.num_features, position, answers.index(a)):
+                _encode_varint(value, out)
+        return bytes(out)
+
+    def load_state(self, data):
+        """Restore a session from ``dump_state`` output.
+
+        Scores are rebuilt directly from the sparse answer deltas in a
+        single pass, without going through ``answer_question``.
+        """
+
+        try:
+            magic, fmt, digest = _STATE_HEADER.unpack_from(data)
+        except struct.error as exc:
+            raise ValueError(f"Invalid session state: {exc}") from exc
+        if magic != STATE_MAGIC or fmt != STATE_FORMAT:
+            raise ValueError("Invalid session state header")
+        self._check_version(digest.hex())
+        compiled = self.compiled
+        values = iter(_decode_varints(data, _STATE_HEADER.size))
+        sentinel = compiled.num_features
+        question_ids = compiled.index.question_ids
+        pairs = compiled.index.answer_pairs
+        scores = list(compiled.zero_scores)
+        eliminated = {}
+        history = []
+        answered = {}
+        for f in values:
+            if f == sentinel:
+                try:
+                    q = question_ids[next(values)]
+                    a = compiled.possible_answers(q)[next(values)]
+                except (IndexError, StopIteration):
+                    raise ValueError("Invalid answer in session state") from None
+                history.append(q)
+                answered[q] = a
+                continue
+            if f > sentinel:
+                raise ValueError("Invalid answer id in session state")
+            q, a = pairs[f]
+            history.append(q)
+            answered[q] = a
+            # ``-inf`` absorbs the weights of diseases already ruled out.
+            for i, w in compiled.deltas[f]:
+                scores[i] += w
+            for i in compiled.rules_out[f]:
+                entry = eliminated.get(i)
+                if entry is None:
+                    eliminated[i] = (1, scores[i])
+                    scores[i] = NEG_INF
+                else:
+                    eliminated[i] = (entry[0] + 1, entry[1])
+        self._restore_session(history, answered, scores, eliminated)
+
+    @timed("engine.undo_last_answer")
     def undo_last_answer(self):
         """Revert the most recently answered question."""
 
         if not self.history:
             self.logger.debug("Undo called with empty history")
             return None
-        question = self.history.pop()
-        answer = self.answered.pop(question, None)
+        session = self.session
+        question = session.history.pop()
+        sums = session.sums_history.pop()
+        session.policy_nodes.pop()
+        answer = session.answered.pop(question, None)
         if answer is None:
             return None
-        for disease in self.diseases:
-            if question not in self.model[disease]:
-                continue
-            weight = self.model[disease][question].get(answer, 0)
-            if weight == -1:
-                if self.eliminated[disease] > 0:
-                    self.eliminated[disease] -= 1
-                    if self.eliminated[disease] == 0:
-                        self.scores[disease] = self._prev_scores.pop(disease, 0)
-                        # Score restored to value prior to elimination
-                    else:
-                        self.scores[disease] = float('-inf')
-            elif self.eliminated[disease] == 0:
-                self.scores[disease] -= weight
-        self.remaining_questions.add(question)
+        # Candidates built for this answer's ancestors still hold.
+        candidates = session.candidates
+        while candidates is not None and candidates.history > len(session.history):
+            candidates = candidates.parent
+        session.candidates = candidates
+        if session.bounds is not None:
+            session.bounds = self._shift_bounds(session.bounds, question, -1)
+        f = self.compiled.feature_id(question, answer)
+        if f is not None:
+            self._revert_feature(f)
+        session.sums = _entropy_sums(session.scores) if sums is None else sums
         self.logger.debug("Undid %s=%s", question, answer)
         return question
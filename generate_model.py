@@ -0,0 +1,190 @@
+"""Generate synthetic diagnosis models for scaling tests.
+
+Writes ``questions.json``, ``diseases.json`` and ``diagnosis_model.json``
+in the format read by ``storage_json``::
+
+    python generate_model.py /tmp/big --diseases 10000 --questions 50000 \\
+        --sparsity 0.99 --seed 1
+
+Output is streamed one question or disease at a time, so memory stays
+flat whatever the model size.  Every disease draws from its own random
+generator derived from the seed, which makes the output byte-for-byte
+reproducible.
+
+``sparsity`` is the fraction of questions each disease leaves unmapped
+(an unmapped question leaves the disease score unchanged) and
+``rule_out`` the probability that a mapped answer carries the ``-1``
+rule-out weight.
+"""
+
+import argparse
+import json
+import os
+import random
+from typing import List
+
+from model_compiled import RULE_OUT
+
+DEFAULTS = {
+    "diseases": 100,
+    "questions": 500,
+    "choices": 4,
+    "multichoice": 0.2,
+    "sparsity": 0.5,
+    "rule_out": 0.05,
+    "max_weight": 3,
+    "seed": 0,
+}
+
+
+def _rng(seed, kind: str, i: int) -> random.Random:
+    return random.Random(f"{seed}/{kind}/{i}")
+
+
+def question_id(j: int) -> str:
+    return f"q{j:05d}"
+
+
+def disease_name(i: int) -> str:
+    return f"Disease {i:05d}"
+
+
+def question_answers(seed, j: int, choices: int, multichoice: float) -> List[str]:
+    """Return the answer domain of question ``j``."""
+
+    if choices > 2 and _rng(seed, "question", j).random() < multichoice:
+        return [f"Option {k + 1}" for k in range(choices)]
+    return ["Yes", "No"]
+
+
+def _question_record(j: int, answers: List[str]) -> dict:
+    record = {"id": question_id(j), "text": f"Synthetic question {j}?"}
+    if answers == ["Yes", "No"]:
+        record["type"] = "yesno"
+    else:
+        record["type"] = "multichoice"
+        record["choices"] = answers
+    return record
+
+
+def disease_weights(
+    seed,
+    i: int,
+    domains: List[List[str]],
+    sparsity: float,
+    rule_out: float,
+    max_weight: int,
+) -> dict:
+    """Return the ``question -> answer -> weight`` mapping of disease ``i``."""
+
+    rng = _rng(seed, "disease", i)
+    num_questions = len(domains)
+    mapped = max(1, round(num_questions * (1 - sparsity))) if num_questions else 0
+    weights = {}
+    for j in sorted(rng.sample(range(num_questions), mapped)):
+        answers = {}
+        for a in domains[j]:
+            if rng.random() < rule_out:
+                answers[a] = RULE_OUT
+            else:
+                answers[a] = rng.randint(0, max_weight)
+        if all(w == RULE_OUT for w in answers.values()):
+            # Some answer must keep the disease in play.
+            answers[rng.choice(domains[j])] = 0
+        weights[question_id(j)] = answers
+    return weights
+
+
+def generate(
+    out_dir: str,
+    *,
+    diseases: int = DEFAULTS["diseases"],
+    questions: int = DEFAULTS["questions"],
+    choices: int = DEFAULTS["choices"],
+    multichoice: float = DEFAULTS["multichoice"],
+    sparsity: float = DEFAULTS["sparsity"],
+    rule_out: float = DEFAULTS["rule_out"],
+    max_weight: int = DEFAULTS["max_weight"],
+    seed=DEFAULTS["seed"],
+) -> None:
+    """Write a synthetic model into ``out_dir``."""
+
+    if not 0 <= sparsity < 1:
+        raise ValueError("sparsity must be in [0, 1)")
+    if not 0 <= rule_out <= 1:
+        raise ValueError("rule_out must be in [0, 1]")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Only the answer domains are kept: one short list per question.
+    domains = [question_answers(seed, j, choices, multichoice) for j in range(questions)]
+
+    with open(os.path.join(out_dir, "questions.json"), "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for j, answers in enumerate(domains):
+            f.write(",\n" if j else "")
+            f.write(json.dumps(_question_record(j, answers)))
+        f.write("\n]\n")
+
+    with open(os.path.join(out_dir, "diseases.json"), "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i in range(diseases):
+            f.write(",\n" if i else "")
+            f.write(json.dumps(disease_name(i)))
+        f.write("\n]\n")
+
+    with open(os.path.join(out_dir, "diagnosis_model.json"), "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for i in range(diseases):
+            weights = disease_weights(seed, i, domains, sparsity, rule_out, max_weight)
+            f.write(",\n" if i else "")
+            f.write(f"{json.dumps(disease_name(i))}: {json.dumps(weights)}")
+        f.write("\n}\n")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic diagnosis model")
+    parser.add_argument("out_dir", help="directory receiving the three JSON files")
+    parser.add_argument("--diseases", type=int, default=DEFAULTS["diseases"])
+    parser.add_argument("--questions", type=int, default=DEFAULTS["questions"])
+    parser.add_argument(
+        "--choices",
+        type=int,
+        default=DEFAULTS["choices"],
+        help="answers of multiple choice questions",
+    )
+    parser.add_argument(
+        "--multichoice",
+        type=float,
+        default=DEFAULTS["multichoice"],
+        help="fraction of multiple choice questions, the rest are yes/no",
+    )
+    parser.add_argument(
+        "--sparsity",
+        type=float,
+        default=DEFAULTS["sparsity"],
+        help="fraction of questions each disease leaves unmapped",
+    )
+    parser.add_argument(
+        "--rule-out",
+        type=float,
+        default=DEFAULTS["rule_out"],
+        help="probability of a -1 rule-out weight per answer",
+    )
+    parser.add_argument("--max-weight", type=int, default=DEFAULTS["max_weight"])
+    parser.add_argument("--seed", default=DEFAULTS["seed"], help="random seed")
+    args = parser.parse_args(argv)
+    generate(
+        args.out_dir,
+        diseases=args.diseases,
+        questions=args.questions,
+        choices=args.choices,
+        multichoice=args.multichoice,
+        sparsity=args.sparsity,
+        rule_out=args.rule_out,
+        max_weight=args.max_weight,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Low overhead timers, counters and latency histograms.
+
+Hot paths are wrapped with ``timed`` and counted with ``metrics.incr``
+guarded by ``metrics.enabled``.  While disabled, which is the default, a
+timed call costs one attribute check.  Enable collection with
+``AIVO_METRICS=1``; set ``AIVO_METRICS_FILE`` to dump a JSON report when
+the process exits, or query ``metrics.snapshot()`` at any time.
+
+Other sinks can subscribe with ``metrics.add_hook(callback)``; the
+callback receives ``(name, seconds)`` for every timed call.
+"""
+
+import atexit
+import functools
+import json
+import math
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List
+
+import config
+
+# Histogram buckets grow by 2 ** (1 / BUCKETS_PER_OCTAVE), bounding the
+# relative error of reported percentiles to about 9%.
+BUCKETS_PER_OCTAVE = 8
+# Smallest resolvable duration in seconds (100 ns).
+_RESOLUTION = 1e-7
+
+
+class Histogram:
+    """Log-bucketed latency histogram with percentile queries."""
+
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        ticks = seconds / _RESOLUTION
+        bucket = int(math.log2(ticks) * BUCKETS_PER_OCTAVE) if ticks > 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Return the ``pct`` percentile in seconds (bucket upper bound)."""
+
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE) * _RESOLUTION
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "min_ms": self.min * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class Instrumentation:
+    """Registry of named counters and latency histograms."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._hooks: List[Callable[[str, float], None]] = []
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.record(seconds)
+        for hook in self._hooks:
+            hook(name, seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time the enclosed block under ``name``."""
+
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def add_hook(self, hook: Callable[[str, float], None]) -> None:
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[str, float], None]) -> None:
+        self._hooks.remove(hook)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        """Return counters and histogram summaries as plain data."""
+
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "timers": {n: h.summary() for n, h in self._histograms.items()},
+            }
+
+    def dump(self, path: str) -> None:
+        """Write ``snapshot()`` to ``path`` as JSON."""
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+
+metrics = Instrumentation(enabled=config.METRICS_ENABLED)
+
+
+def timed(name: str):
+    """Decorator recording the duration of each call under ``name``."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+if config.METRICS_ENABLED and config.METRICS_FILE:
+    atexit.register(metrics.dump, config.METRICS_FILE)
@@ -0,0 +1,200 @@
+"""Multi-step lookahead question selection.
+
+The greedy selection of ``DiagnosisEngine`` picks the question with the
+best expected entropy after one answer.  ``Lookahead`` instead picks the
+question with the best expected entropy after ``depth`` answers, assuming
+the following questions are chosen the same way.  Answers are averaged
+uniformly, as in the greedy selection, so ``depth=1`` is the greedy
+choice.
+
+The search is kept interactive by:
+
+* a beam: only the ``beam`` greedily best questions of a node are expanded;
+* branch and bound: entropies are never negative, so a question is dropped
+  as soon as the answers evaluated so far already exceed the best
+  question's expected entropy;
+* memoization of subtrees by answer set, which also merges answer orders
+  leading to the same state;
+* a node budget, past which nodes are scored greedily instead of expanded;
+* a time budget, past which the greedy question is returned.
+
+The search runs on a copy of the engine's session, so the engine itself
+is never modified::
+
+    engine = DiagnosisEngine.from_compiled(compiled, lookahead=Lookahead(depth=2))
+"""
+
+import time
+
+import config
+from engine_rule import DiagnosisEngine, _entropy_from_sums
+from instrumentation import metrics
+from question_cache import answers_fingerprint
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class Lookahead:
+    """Settings of the lookahead search; see the module docstring.
+
+    ``budget_ms`` of ``0`` disables the time budget.
+    """
+
+    __slots__ = ("depth", "beam", "max_nodes", "budget_ms")
+
+    def __init__(
+        self,
+        depth: int = config.LOOKAHEAD_DEPTH,
+        beam: int = config.LOOKAHEAD_BEAM,
+        max_nodes: int = config.LOOKAHEAD_NODES,
+        budget_ms: float = config.LOOKAHEAD_BUDGET_MS,
+    ):
+        if depth < 1 or beam < 1:
+            raise ValueError("depth and beam must be at least 1")
+        self.depth = depth
+        self.beam = beam
+        self.max_nodes = max_nodes
+        self.budget_ms = budget_ms
+
+    def __repr__(self):
+        return (
+            f"Lookahead(depth={self.depth}, beam={self.beam}, "
+            f"max_nodes={self.max_nodes}, budget_ms={self.budget_ms})"
+        )
+
+    @property
+    def key(self) -> tuple:
+        """Settings that change the selected question, for cache keys."""
+
+        return ("lookahead", self.depth, self.beam, self.max_nodes)
+
+    def select(self, engine):
+        """Return ``(question, complete)`` for the session of ``engine``.
+
+        ``complete`` is false when the time budget ran out and the greedy
+        question was returned instead.
+        """
+
+        return _Search(engine, self).run()
+
+
+def default_lookahead():
+    """Return the configured ``Lookahead``, or ``None`` for greedy selection."""
+
+    if config.LOOKAHEAD_DEPTH <= 1:
+        return None
+    return Lookahead()
+
+
+class _Search:
+    """State of one lookahead search over a copied session."""
+
+    def __init__(self, engine, settings: Lookahead):
+        self.settings = settings
+        self.compiled = engine.compiled
+        self.probe = DiagnosisEngine.from_compiled(engine.compiled, question_cache=None)
+        self.probe.session = engine.session.copy()
+        self.session = self.probe.session
+        # Candidates of the root session stay valid below it.
+        self.rows = self.probe._candidates()
+        self.memo = {}
+        self.nodes = 0
+        self.deadline = (
+            time.perf_counter() + settings.budget_ms / 1000 if settings.budget_ms > 0 else None
+        )
+
+    def _ranked(self):
+        """Return the open questions greedy-best first and their expected entropies."""
+
+        answered = self.session.answered
+        candidates = [q for q in self.compiled.askable if q not in answered]
+        current = _entropy_from_sums(*self.session.sums)
+        gains = self.probe.information_gains(candidates)
+        # Stable sort: ties keep model order, like the greedy selection.
+        ranked = sorted(candidates, key=lambda q: -gains[q])
+        return ranked, {q: current - gains[q] for q in ranked}, current
+
+    def run(self):
+        ranked, expected, _ = self._ranked()
+        if not ranked:
+            return None, True
+        if self.settings.depth == 1:
+            return ranked[0], True
+        try:
+            best_q, _ = self._best(ranked[: self.settings.beam], self.settings.depth, float("inf"))
+        except _OutOfTime:
+            metrics.incr("engine.lookahead.timeout")
+            return ranked[0], False
+        metrics.incr("engine.lookahead.nodes", self.nodes)
+        return best_q, True
+
+    def _best(self, questions, depth, bound):
+        """Return the best of ``questions`` and its value if it is below ``bound``.
+
+        Otherwise ``(None, bound)`` is returned: ``bound`` is then a lower
+        bound of the value of every question.
+        """
+
+        best_q = None
+        best = bound
+        possible_answers = self.compiled.possible_answers
+        question_features = self.compiled.question_features
+        for q in questions:
+            features = question_features(q)
+            if not features:
+                continue
+            limit = best * len(features)
+            total = 0.0
+            for answer, f in zip(possible_answers(q), features):
+                total += self._child(q, answer, f, depth - 1, limit - total)
+                if total >= limit:
+                    break
+            else:
+                best_q = q
+                best = total / len(features)
+        return best_q, best
+
+    def _child(self, question, answer, f, depth, bound):
+        """Return the value of the session after ``question=answer``."""
+
+        session = self.session
+        scores, eliminated, sums = session.scores, session.eliminated, session.sums
+        session.answered[question] = answer
+        if f is not None:
+            session.eliminated = dict(eliminated)
+            rows = self.rows and self.rows.rows_for(len(session.answered) - 1)
+            session.sums = self.probe._sums_after(f, sums, rows)
+            self.probe._apply_feature(f)
+        try:
+            return self._value(depth, bound)
+        finally:
+            session.scores, session.eliminated, session.sums = scores, eliminated, sums
+            del session.answered[question]
+
+    def _value(self, depth, bound):
+        """Return the expected entropy after ``depth`` more questions.
+
+        Values at or above ``bound`` are only lower bounds.
+        """
+
+        key = (answers_fingerprint(self.session.answered), depth)
+        hit = self.memo.get(key)
+        if hit is not None and (hit[1] or hit[0] >= bound):
+            return hit[0]
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise _OutOfTime
+        self.nodes += 1
+        ranked, expected, current = self._ranked()
+        if not ranked:
+            value, exact = current, True
+        elif depth == 1 or self.nodes >= self.settings.max_nodes:
+            if depth > 1 and self.nodes == self.settings.max_nodes:
+                metrics.incr("engine.lookahead.node_budget")
+            value, exact = expected[ranked[0]], True
+        else:
+            best_q, value = self._best(ranked[: self.settings.beam], depth, bound)
+            exact = best_q is not None
+        self.memo[key] = (value, exact)
+        return value
@@ -1,20 +1,41 @@
-"""Entry point for the diagnosis UI."""
+"""Entry point for the diagnosis UI.
 
+``--headless`` and ``--json`` run the questionnaire without Tk; see
+``cli.py``.  Tk is only imported for the graphical UI.
+"""
 
-from tkinter import Tk, TclError
-import sys
-import os
-import argparse
-from ui import DiagnosisUI
+import time
 
+# Reference point for the time-to-first-question budget.
+_START = time.perf_counter()
 
-def main() -> None:
+import argparse  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+
+
+def main(argv=None) -> None:
     parser = argparse.ArgumentParser(description="Run the diagnosis UI")
     parser.add_argument("--debug", action="store_true", help="enable debug mode")
-    args = parser.parse_args()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--headless", action="store_true", help="ask the questions on the terminal"
+    )
+    mode.add_argument(
+        "--json", action="store_true", help="JSON line protocol on stdin/stdout"
+    )
+    args = parser.parse_args(argv)
+
+    if args.headless or args.json:
+        from cli import run
+
+        sys.exit(run(json_mode=args.json, debug=args.debug, start=_START))
 
     if os.name != "nt" and not os.getenv("DISPLAY"):
-        sys.exit("Error: no DISPLAY environment variable set")
+        sys.exit("Error: no DISPLAY environment variable set (use --headless)")
+    from tkinter import Tk, TclError
+    from ui import DiagnosisUI
+
     try:
         root = Tk()
     except TclError as exc:
@@ -0,0 +1,450 @@
+"""Packed binary form of the diagnosis model.
+
+The JSON files stay the editing format; ``diagnosis_model.bin`` is a
+build product that starts much faster.  It is opened with ``mmap`` and
+stays mapped for the life of the loaded model: the per-feature weight
+and rule-out rows are views sliced from the mapped tables on access, so
+processes loading the same file share one page-cache copy of them and a
+start only decodes the small string and index tables.
+
+Layout (little-endian)::
+
+    header      magic "AIVM", format, flags, table sizes, the 20 byte
+                model version digest and a CRC-32 of everything after
+                the header
+    strings     u32 offsets + UTF-8 blob, every name and text interned once
+    tables      fixed-width u32/i64/f64 arrays, each 8 byte aligned:
+                disease and question names, question metadata, the
+                features, the disease-major cells of the JSON model and
+                the feature-major (CSR) weights and rule-outs used by
+                the engine
+
+Convert in either direction with::
+
+    python model_binary.py build            # data/*.json -> .bin
+    python model_binary.py export out_dir   # .bin -> JSON files
+"""
+
+import argparse
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Sequence as SequenceABC
+from typing import Dict, List, Optional, Tuple
+
+import config
+from model_compiled import CompiledModel, compile_model
+from model_index import ModelIndex
+from questions import Question
+
+MODEL_MAGIC = b"AIVM"
+MODEL_FORMAT = 1
+# Set when every weight is an integer; weights are then stored as i64.
+FLAG_INT_WEIGHTS = 1
+NO_STRING = 0xFFFFFFFF
+
+_HEADER = struct.Struct("<4sHH10I20sI")
+_ALIGN = 8
+_LITTLE = sys.byteorder == "little"
+
+# (table, typecode, size key) in file order.  Size keys name a header
+# count; a trailing "+1" marks CSR pointer arrays.
+_TABLES = (
+    ("string_offsets", "I", "strings+1"),
+    ("string_data", "B", "string_bytes"),
+    ("disease_names", "I", "diseases"),
+    ("question_names", "I", "questions"),
+    ("question_texts", "I", "questions"),
+    ("question_types", "I", "questions"),
+    ("question_domains", "I", "questions"),
+    ("choice_ptr", "I", "questions+1"),
+    ("choices", "I", "choices"),
+    ("feature_questions", "I", "features"),
+    ("feature_answers", "I", "features"),
+    ("cell_ptr", "I", "diseases+1"),
+    ("cell_features", "I", "cells"),
+    ("cell_weights", "w", "cells"),
+    ("delta_ptr", "I", "features+1"),
+    ("delta_diseases", "I", "deltas"),
+    ("delta_weights", "w", "deltas"),
+    ("rule_ptr", "I", "features+1"),
+    ("rule_diseases", "I", "rule_outs"),
+)
+_COUNTS = (
+    "diseases",
+    "questions",
+    "listed",
+    "features",
+    "cells",
+    "deltas",
+    "rule_outs",
+    "choices",
+    "strings",
+    "string_bytes",
+)
+
+
+def _layout(counts: Dict[str, int], flags: int):
+    """Yield ``(table, typecode, length, offset)`` for every table."""
+
+    weight_code = "q" if flags & FLAG_INT_WEIGHTS else "d"
+    offset = _HEADER.size
+    for name, code, size in _TABLES:
+        if code == "w":
+            code = weight_code
+        key, _, extra = size.partition("+")
+        length = counts[key] + (1 if extra else 0)
+        yield name, code, length, offset
+        offset += length * array.array(code).itemsize
+        offset += -offset % _ALIGN
+
+
+def write_binary_model(
+    path: str, diseases, questions, model: dict, compiled: Optional[CompiledModel] = None
+) -> CompiledModel:
+    """Pack ``diseases``/``questions``/``model`` into the file at ``path``.
+
+    The file is written next to ``path`` and renamed into place, so
+    readers never see a partial model.  ``compiled`` may be passed when the
+    model was already compiled.  Returns the compiled model.
+    """
+
+    if compiled is None:
+        compiled = compile_model(diseases, questions, model)
+    index = compiled.index
+    strings: Dict[str, int] = {}
+
+    def sid(value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    tables = {name: [] for name, _, _ in _TABLES}
+    tables["disease_names"] = [sid(d) for d in index.diseases]
+    tables["choice_ptr"].append(0)
+    for qid in index.question_ids:
+        q = index.question(qid)
+        tables["question_names"].append(sid(qid))
+        tables["question_texts"].append(sid(q.text) if q else NO_STRING)
+        tables["question_types"].append(sid(q.qtype) if q else NO_STRING)
+        tables["question_domains"].append(len(index.answers.get(qid, ())))
+        if q and q.choices:
+            tables["choices"].extend(sid(c) for c in q.choices)
+        tables["choice_ptr"].append(len(tables["choices"]))
+    for qid, answer in index.answer_pairs:
+        tables["feature_questions"].append(index.question_index[qid])
+        tables["feature_answers"].append(sid(answer))
+
+    weights = tables["cell_weights"]
+    tables["cell_ptr"].append(0)
+    for d in index.diseases:
+        for qid, answers in model.get(d, {}).items():
+            for answer, w in answers.items():
+                tables["cell_features"].append(index.answer_ids[(qid, answer)])
+                weights.append(w)
+        tables["cell_ptr"].append(len(weights))
+
+    tables["delta_ptr"].append(0)
+    for row in compiled.deltas:
+        tables["delta_diseases"].extend(i for i, _ in row)
+        tables["delta_weights"].extend(w for _, w in row)
+        tables["delta_ptr"].append(len(tables["delta_diseases"]))
+    tables["rule_ptr"].append(0)
+    for row in compiled.rules_out:
+        tables["rule_diseases"].extend(row)
+        tables["rule_ptr"].append(len(tables["rule_diseases"]))
+
+    flags = 0
+    if all(type(w) is int for w in weights):
+        flags |= FLAG_INT_WEIGHTS
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    tables["string_offsets"] = offsets
+    tables["string_data"] = b"".join(encoded)
+
+    counts = {
+        "diseases": len(index.diseases),
+        "questions": len(index.question_ids),
+        "listed": len(index.listed_questions),
+        "features": compiled.num_features,
+        "cells": len(weights),
+        "deltas": len(tables["delta_diseases"]),
+        "rule_outs": len(tables["rule_diseases"]),
+        "choices": len(tables["choices"]),
+        "strings": len(encoded),
+        "string_bytes": len(tables["string_data"]),
+    }
+    payload = bytearray()
+    for name, code, length, offset in _layout(counts, flags):
+        payload.extend(b"\0" * (offset - _HEADER.size - len(payload)))
+        data = array.array(code, tables[name])
+        if not _LITTLE:
+            data.byteswap()
+        payload.extend(data.tobytes())
+    payload.extend(b"\0" * (-len(payload) % _ALIGN))
+    header = _HEADER.pack(
+        MODEL_MAGIC,
+        MODEL_FORMAT,
+        flags,
+        *(counts[k] for k in _COUNTS),
+        bytes.fromhex(compiled.version),
+        zlib.crc32(payload),
+    )
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(tmp, path)
+    return compiled
+
+
+class PackedRows(SequenceABC):
+    """Per-feature rows of a CSR table, sliced from the mapping on access.
+
+    ``rows[f]`` is the zero-copy slice ``ptr[f]:ptr[f + 1]`` of the single
+    column.  Only the row bounds are decoded.  The columns are views of
+    the mapped file (copies on big-endian hosts), which stays open as long
+    as they are referenced.
+    """
+
+    __slots__ = ("columns", "_bounds")
+
+    def __init__(self, ptr, *columns):
+        self.columns = columns
+        self._bounds = tuple(zip(ptr[:-1], ptr[1:]))
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def __getitem__(self, f):
+        if isinstance(f, slice):
+            return [self[i] for i in range(*f.indices(len(self)))]
+        a, b = self._bounds[f]
+        return self.columns[0][a:b]
+
+
+class PackedPairs(PackedRows):
+    """``PackedRows`` over two columns: rows are ``(disease index, weight)`` pairs."""
+
+    __slots__ = ()
+
+    def __getitem__(self, f):
+        if isinstance(f, slice):
+            return [self[i] for i in range(*f.indices(len(self)))]
+        a, b = self._bounds[f]
+        first, second = self.columns
+        return tuple(zip(first[a:b], second[a:b]))
+
+
+class BinaryModel:
+    """Read-only view of a packed model file mapped into memory.
+
+    ``verify`` checks the payload against the header checksum.  Use as a
+    context manager, or call ``close``, to release the mapping; a model
+    returned by ``compile`` keeps it open instead.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self._tables = {}
+        try:
+            self._open(path, verify)
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self, path: str, verify: bool) -> None:
+        if len(self._view) < _HEADER.size:
+            raise ValueError(f"Not a binary model: {path}")
+        magic, fmt, flags, *rest = _HEADER.unpack_from(self._view)
+        if magic != MODEL_MAGIC:
+            raise ValueError(f"Not a binary model: {path}")
+        if fmt != MODEL_FORMAT:
+            raise ValueError(f"Unsupported binary model format {fmt}: {path}")
+        self.flags = flags
+        self.counts = dict(zip(_COUNTS, rest[: len(_COUNTS)]))
+        digest, checksum = rest[len(_COUNTS):]
+        self.version = digest.hex()
+        if verify and zlib.crc32(self._view[_HEADER.size:]) != checksum:
+            raise ValueError(f"Binary model checksum mismatch: {path}")
+        for name, code, length, offset in _layout(self.counts, flags):
+            end = offset + length * array.array(code).itemsize
+            if end > len(self._view):
+                raise ValueError(f"Truncated binary model: {path}")
+            if _LITTLE:
+                table = self._view[offset:end].cast(code)
+            else:
+                table = array.array(code, self._view[offset:end].tobytes())
+                table.byteswap()
+            self._tables[name] = table
+
+    def close(self) -> None:
+        for table in self._tables.values():
+            if isinstance(table, memoryview):
+                table.release()
+        self._tables.clear()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def string(self, sid: int) -> Optional[str]:
+        if sid == NO_STRING:
+            return None
+        offsets = self._tables["string_offsets"]
+        data = self._tables["string_data"]
+        return bytes(data[offsets[sid]:offsets[sid + 1]]).decode("utf-8")
+
+    def _strings(self, table: str) -> List[Optional[str]]:
+        return [self.string(s) for s in self._tables[table]]
+
+    @property
+    def diseases(self) -> Tuple[str, ...]:
+        return tuple(self._strings("disease_names"))
+
+    def question_ids(self) -> Tuple[str, ...]:
+        return tuple(self._strings("question_names"))
+
+    def questions(self) -> List[Question]:
+        """Return the ``Question`` objects of the listed questions."""
+
+        t = self._tables
+        result = []
+        for j, qid in enumerate(self.question_ids()[: self.counts["listed"]]):
+            text = self.string(t["question_texts"][j])
+            if text is None:
+                continue
+            choices = [
+                self.string(c) for c in t["choices"][t["choice_ptr"][j]:t["choice_ptr"][j + 1]]
+            ]
+            result.append(
+                Question(qid, text, self.string(t["question_types"][j]), choices or None)
+            )
+        return result
+
+    def model(self) -> dict:
+        """Rebuild the nested ``disease -> question -> answer`` mapping."""
+
+        t = self._tables
+        question_ids = self.question_ids()
+        features = [
+            (question_ids[q], self.string(a))
+            for q, a in zip(t["feature_questions"], t["feature_answers"])
+        ]
+        ptr = t["cell_ptr"]
+        cell_features = t["cell_features"]
+        cell_weights = t["cell_weights"]
+        model = {}
+        for i, d in enumerate(self.diseases):
+            mapping = model[d] = {}
+            for c in range(ptr[i], ptr[i + 1]):
+                qid, answer = features[cell_features[c]]
+                mapping.setdefault(qid, {})[answer] = cell_weights[c]
+        return model
+
+    def compile(self, model=None) -> CompiledModel:
+        """Return a ``CompiledModel`` backed by the packed tables.
+
+        Only the names and the index are decoded; ``deltas`` and
+        ``rules_out`` are ``PackedPairs``/``PackedRows`` over the mapping, which must not
+        be closed while the model is in use.  The nested JSON mapping is
+        not rebuilt here; ``model`` is passed on to ``CompiledModel`` as
+        is.
+        """
+
+        t = self._tables
+        question_ids = self.question_ids()
+        answer_pairs = tuple(
+            (question_ids[q], self.string(a))
+            for q, a in zip(t["feature_questions"], t["feature_answers"])
+        )
+        # A question's domain is its first answers in feature order: the
+        # answers of the first disease that maps it.
+        grouped: Dict[str, List[str]] = {}
+        for qid, answer in answer_pairs:
+            grouped.setdefault(qid, []).append(answer)
+        answers = {}
+        for j, qid in enumerate(question_ids):
+            size = t["question_domains"][j]
+            if size:
+                answers[qid] = tuple(grouped[qid][:size])
+        index = ModelIndex.from_tables(
+            self.diseases,
+            self.questions(),
+            question_ids,
+            self.counts["listed"],
+            answers,
+            answer_pairs,
+        )
+        deltas = PackedPairs(t["delta_ptr"], t["delta_diseases"], t["delta_weights"])
+        rules_out = PackedRows(t["rule_ptr"], t["rule_diseases"])
+        return CompiledModel(index, deltas, rules_out, self.version, model)
+
+
+def load_binary_model(path: str, verify: bool = True) -> CompiledModel:
+    """Map the packed model at ``path`` and return it compiled.
+
+    The mapping stays open for the life of the model, which shares the
+    weight tables with every other process mapping the same file.
+    ``CompiledModel.model`` rebuilds the nested mapping from it on first
+    access.
+    """
+
+    packed = BinaryModel(path, verify)
+    try:
+        return packed.compile(packed.model)
+    except Exception:
+        packed.close()
+        raise
+
+
+def read_binary_model(path: str):
+    """Return ``(diseases, questions, model)`` as stored at ``path``."""
+
+    with BinaryModel(path) as packed:
+        return list(packed.diseases), packed.questions(), packed.model()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Convert the model to and from binary")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="pack the JSON data files")
+    build.add_argument("-o", "--output", default=config.MODEL_BINARY_FILE)
+    export = sub.add_parser("export", help="write JSON data files from a binary model")
+    export.add_argument("out_dir")
+    export.add_argument("-i", "--input", default=config.MODEL_BINARY_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from storage_json import load_diseases, load_model, load_questions
+
+        write_binary_model(args.output, load_diseases(), load_questions(), load_model())
+        return
+    diseases, questions, model = read_binary_model(args.input)
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, data in (
+        ("questions.json", [q.to_dict() for q in questions]),
+        ("diseases.json", diseases),
+        ("diagnosis_model.json", model),
+    ):
+        with open(os.path.join(args.out_dir, name), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Compiled, integer indexed form of the diagnosis model.
+
+``diagnosis_model.json`` is a nested ``disease -> question -> answer ->
+weight`` mapping which is convenient to edit but slow to evaluate because
+every answer requires a dictionary lookup per disease.  ``compile_model``
+flattens it once into sparse per-answer weight rows so the engine can keep
+its scores as a single list indexed by disease.
+"""
+
+import hashlib
+import json
+import logging
+from collections.abc import Sequence as SequenceABC
+from functools import cached_property
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from instrumentation import timed
+from model_index import DEFAULT_ANSWERS, ModelIndex
+
+# Weight value used in the model to rule a disease out entirely.
+RULE_OUT = -1
+
+NEG_INF = float("-inf")
+
+logger = logging.getLogger(__name__)
+
+
+class DenseRows(SequenceABC):
+    """Read-only dense view of sparse weight rows.
+
+    ``rows[f]`` expands ``deltas[f]`` to a tuple with one weight per
+    disease.  Rows are built on access and not kept, so large models never
+    pay for a dense features x diseases matrix.
+    """
+
+    __slots__ = ("_deltas", "_width")
+
+    def __init__(self, deltas, width: int):
+        self._deltas = deltas
+        self._width = width
+
+    def __len__(self):
+        return len(self._deltas)
+
+    def __getitem__(self, f):
+        if isinstance(f, slice):
+            return [self[i] for i in range(*f.indices(len(self)))]
+        row = [0] * self._width
+        for i, w in self._deltas[f]:
+            row[i] = w
+        return tuple(row)
+
+
+class CompiledModel:
+    """Sparse disease x (question, answer) weight matrix.
+
+    Every ``(question, answer)`` pair found in the model is identified by
+    its answer id in ``index``, called a *feature* here.  ``deltas[f]``
+    holds the additive weights of feature ``f`` as ``(disease index,
+    weight)`` pairs for the non-zero weights only, and ``rules_out[f]``
+    lists the indices of the diseases eliminated by that answer.  Weights
+    of ``-1`` are never stored in ``deltas`` so applying an answer touches
+    only the diseases the answer mentions, followed by an update of the
+    elimination mask.  ``rows[f]`` is the dense form of ``deltas[f]``,
+    indexed like ``diseases``.
+
+    Instances are frozen once built so one compiled model can be shared by
+    every session and thread of a process.  ``model`` keeps a reference to
+    the mapping it was compiled from; it is not copied.  It may also be a
+    callable returning that mapping, e.g. for models loaded from the
+    packed file, which is then only called on the first access.
+    """
+
+    def __init__(
+        self,
+        index: ModelIndex,
+        deltas: List[Tuple[Tuple[int, float], ...]],
+        rules_out: List[Tuple[int, ...]],
+        version: str = "",
+        model=None,
+    ):
+        self.index = index
+        self._model_source = model
+        self.version = version
+        self.diseases = index.diseases
+        self.disease_index = index.disease_ids
+        self.questions = index.question_ids
+        self.askable = index.listed_questions
+        self.askable_set = frozenset(self.askable)
+        self.question_index = index.question_index
+        self.answers = index.answers
+        self.feature_index = index.answer_ids
+        # Feature ids of every answer in a question's domain, in domain
+        # order, so a question's branches can be evaluated without lookups.
+        self.answer_features = {
+            q: tuple(self.feature_index[(q, a)] for a in domain)
+            for q, domain in self.answers.items()
+        }
+        # Lists are frozen; other sequences, such as the views of a packed
+        # model, are kept as they are.
+        self.deltas = tuple(deltas) if isinstance(deltas, list) else deltas
+        self.rules_out = tuple(rules_out) if isinstance(rules_out, list) else rules_out
+        self.rows = DenseRows(self.deltas, len(self.diseases))
+        self.zero_scores = (0,) * len(self.diseases)
+        # Entropy sums (mass, mass * log2 mass, active) of ``zero_scores``.
+        self.zero_sums = (0, 0.0, len(self.diseases))
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"CompiledModel is read-only: {name}")
+        super().__setattr__(name, value)
+
+    @cached_property
+    def model(self) -> Optional[dict]:
+        """The ``disease -> question -> answer`` mapping, or ``None``."""
+
+        source = self._model_source
+        return source() if callable(source) else source
+
+    @property
+    def num_features(self) -> int:
+        return len(self.deltas)
+
+    def feature_id(self, question: str, answer: str) -> Optional[int]:
+        """Return the feature id for ``question``/``answer`` or ``None``."""
+
+        return self.feature_index.get((question, answer))
+
+    def question_features(self, question: str) -> Tuple[Optional[int], ...]:
+        """Return the feature id of each answer ``question`` can take.
+
+        Questions absent from the model yield ``None`` for each default
+        answer, meaning the answer leaves every score unchanged.
+        """
+
+        features = self.answer_features.get(question)
+        if features is None:
+            return (None,) * len(DEFAULT_ANSWERS)
+        return features
+
+    def possible_answers(self, question: str) -> Tuple[str, ...]:
+        """Return the answer domain used when scoring ``question``."""
+
+        return self.index.possible_answers(question)
+
+    # Built on first use only: the stopping rule is the only reader.  A
+    # cached_property writes the instance dict directly, past the freeze.
+    @cached_property
+    def question_bounds(self) -> dict:
+        """Return ``{question: ((disease, low, high), ...)}`` for askable questions.
+
+        ``low`` and ``high`` are the smallest and largest weight the
+        question can add to the disease's score, counting ``0`` for leaving
+        it unasked; ``low`` is ``-inf`` when an answer rules the disease
+        out.  Diseases with bounds ``(0, 0)`` are left out.
+        """
+
+        bounds = {}
+        for q in self.askable:
+            features = self.question_features(q)
+            touched = {}
+            for k, f in enumerate(features):
+                if f is None:
+                    continue
+                for i, w in self.deltas[f]:
+                    touched.setdefault(i, {})[k] = w
+                for i in self.rules_out[f]:
+                    touched.setdefault(i, {})[k] = NEG_INF
+            entries = []
+            for i, weights in touched.items():
+                low = min(0, *weights.values())
+                high = max(0, *weights.values())
+                if low or high:
+                    entries.append((i, low, high))
+            bounds[q] = tuple(sorted(entries))
+        return bounds
+
+    @cached_property
+    def zero_bounds(self) -> tuple:
+        """Score bounds over every askable question, see ``DiagnosisSession``."""
+
+        upper = [0] * len(self.diseases)
+        lower = [0] * len(self.diseases)
+        pending = [0] * len(self.diseases)
+        for entries in self.question_bounds.values():
+            for i, low, high in entries:
+                upper[i] += high
+                if low == NEG_INF:
+                    pending[i] += 1
+                else:
+                    lower[i] += low
+        return tuple(upper), tuple(lower), tuple(pending)
+
+    @cached_property
+    def bound_extremes(self) -> tuple:
+        """Return the largest ``high`` and smallest finite ``low`` per disease.
+
+        Over all askable questions, so ``n`` more answers change a score by
+        at most ``n`` times these, see ``question_bounds``.
+        """
+
+        highest = [0] * len(self.diseases)
+        lowest = [0] * len(self.diseases)
+        for entries in self.question_bounds.values():
+            for i, low, high in entries:
+                if high > highest[i]:
+                    highest[i] = high
+                if low != NEG_INF and low < lowest[i]:
+                    lowest[i] = low
+        return tuple(highest), tuple(lowest)
+
+
+def validate_model(diseases: Iterable[str], questions: Iterable[str], model: dict) -> None:
+    """Log a warning if ``model`` lacks weights for known questions."""
+
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+    questions = list(questions)
+    question_set = set(questions)
+    for d in diseases:
+        weights = model.get(d, {})
+        # Set difference first: most diseases map every question.
+        if not question_set.difference(weights):
+            continue
+        for q in questions:
+            if q not in weights:
+                logger.warning("Model missing weights for %s/%s", d, q)
+
+
+def model_version(diseases: Sequence[str], questions: Sequence[str], model: dict) -> str:
+    """Return a stable content hash identifying a model revision."""
+
+    payload = json.dumps(
+        [list(diseases), list(questions), model],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+@timed("model.compile")
+def compile_model(
+    diseases: Iterable[str],
+    questions: Iterable,
+    model: dict,
+    index: Optional[ModelIndex] = None,
+) -> CompiledModel:
+    """Compile the nested ``model`` mapping into a ``CompiledModel``.
+
+    ``questions`` fixes the order of the question ids, see ``ModelIndex``.
+    An ``index`` already built for the same data may be passed to avoid
+    building it twice.
+    """
+
+    if index is None:
+        index = ModelIndex(diseases, questions, model)
+    feature_index = index.answer_ids
+    num_diseases = len(index.diseases)
+    deltas: List[List[Tuple[int, float]]] = [[] for _ in feature_index]
+    rules_out: List[List[int]] = [[] for _ in feature_index]
+    for i, d in enumerate(index.diseases):
+        for q, weights in model.get(d, {}).items():
+            for a, w in weights.items():
+                f = feature_index[(q, a)]
+                if w == RULE_OUT:
+                    rules_out[f].append(i)
+                elif w:
+                    deltas[f].append((i, w))
+
+    compiled = CompiledModel(
+        index,
+        [tuple(r) for r in deltas],
+        [tuple(r) for r in rules_out],
+        model_version(index.diseases, index.question_ids, model),
+        model,
+    )
+    logger.debug(
+        "Compiled model: %d diseases, %d questions, %d features",
+        num_diseases,
+        len(index.question_ids),
+        compiled.num_features,
+    )
+    return compiled
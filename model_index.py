@@ -0,0 +1,109 @@
+"""Lookup tables over the loaded questions, diseases and model.
+
+The engine and both Tkinter interfaces repeatedly need to find a question
+by id, the answers a question can take and the integer position of a
+disease or answer.  ``ModelIndex`` builds those mappings once at load time
+so none of these lookups needs to scan a list.
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+from questions import Question
+
+DEFAULT_ANSWERS = ("Yes", "No")
+
+
+class ModelIndex:
+    """Integer ids and dictionaries for diseases, questions and answers.
+
+    ``questions`` may hold ``Question`` objects or plain question ids.
+    Question ids that only appear inside ``model`` are appended after them.
+    The answer domain of a question is taken from the first disease mapping
+    it, matching ``DiagnosisEngine.get_possible_answers``, and every
+    ``(question, answer)`` pair found in the model gets an answer id.
+    """
+
+    def __init__(self, diseases: Iterable[str], questions: Iterable, model: dict):
+        self.diseases = tuple(diseases)
+        self.disease_ids = {d: i for i, d in enumerate(self.diseases)}
+
+        self._questions: Dict[str, Question] = {}
+        question_ids = []
+        seen = set()
+        for q in questions:
+            if isinstance(q, Question):
+                self._questions[q.qid] = q
+                q = q.qid
+            if q not in seen:
+                seen.add(q)
+                question_ids.append(q)
+        # Only the questions passed in are asked; model-only ids are indexed
+        # so their answers can still be scored.
+        self.listed_questions = tuple(question_ids)
+        for d in self.diseases:
+            for q in model.get(d, {}):
+                if q not in seen:
+                    seen.add(q)
+                    question_ids.append(q)
+        self.question_ids = tuple(question_ids)
+        self.question_index = {q: i for i, q in enumerate(self.question_ids)}
+
+        self.answers: Dict[str, Tuple[str, ...]] = {}
+        self.answer_ids: Dict[Tuple[str, str], int] = {}
+        for d in self.diseases:
+            for q, weights in model.get(d, {}).items():
+                if q not in self.answers:
+                    self.answers[q] = tuple(weights)
+                for a in weights:
+                    if (q, a) not in self.answer_ids:
+                        self.answer_ids[(q, a)] = len(self.answer_ids)
+        # ``answer_pairs[id]`` is the ``(question, answer)`` of an answer id.
+        self.answer_pairs = tuple(self.answer_ids)
+
+    @classmethod
+    def from_tables(
+        cls,
+        diseases: Iterable[str],
+        questions: Iterable[Question],
+        question_ids: Iterable[str],
+        listed: int,
+        answers: Dict[str, Tuple[str, ...]],
+        answer_pairs: Iterable[Tuple[str, str]],
+    ) -> "ModelIndex":
+        """Return an index from tables already built, e.g. by ``model_binary``.
+
+        ``question_ids`` holds every indexed question, the first ``listed``
+        being the askable ones, and ``answer_pairs[id]`` the ``(question,
+        answer)`` of each answer id.
+        """
+
+        index = cls.__new__(cls)
+        index.diseases = tuple(diseases)
+        index.disease_ids = {d: i for i, d in enumerate(index.diseases)}
+        index._questions = {q.qid: q for q in questions}
+        index.question_ids = tuple(question_ids)
+        index.listed_questions = index.question_ids[:listed]
+        index.question_index = {q: i for i, q in enumerate(index.question_ids)}
+        index.answers = dict(answers)
+        index.answer_pairs = tuple(answer_pairs)
+        index.answer_ids = {pair: i for i, pair in enumerate(index.answer_pairs)}
+        return index
+
+    def question(self, qid: str) -> Optional[Question]:
+        """Return the ``Question`` with id ``qid`` or ``None``."""
+
+        return self._questions.get(qid)
+
+    def possible_answers(self, qid: str) -> Tuple[str, ...]:
+        """Return the answer domain used when scoring ``qid``."""
+
+        return self.answers.get(qid, DEFAULT_ANSWERS)
+
+    def disease_id(self, disease: str) -> Optional[int]:
+        return self.disease_ids.get(disease)
+
+    def question_id(self, qid: str) -> Optional[int]:
+        return self.question_index.get(qid)
+
+    def answer_id(self, qid: str, answer: str) -> Optional[int]:
+        return self.answer_ids.get((qid, answer))
@@ -0,0 +1,295 @@
+"""Hot reloading of the compiled model for long-lived processes.
+
+``ModelProvider`` polls the data files and, when they change, recompiles
+the model on its own thread and swaps it in with one attribute store.
+Engines hold on to the ``CompiledModel`` they were created with, so
+sessions in progress stay pinned to their version while new sessions get
+the new one.  Versions that snapshotted sessions still refer to are kept
+through ``retain``/``release``, so those sessions are restored on the
+version they started with::
+
+    provider = ModelProvider()
+    provider.start()
+    engine = provider.new_engine()
+
+Only the standard library is used, so change detection polls file stats
+(mtime and size) every ``AIVO_MODEL_POLL_INTERVAL`` seconds.  With
+``AIVO_STORAGE=sqlite`` the model is compiled from the database instead,
+and its ``data_version`` is polled along with the policy tree file.
+``status()`` reports the active version and the last reload time.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import config
+from instrumentation import metrics
+from question_cache import default_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _default_paths() -> List[str]:
+    import storage_json
+
+    if config.STORAGE_BACKEND == "sqlite":
+        return [config.POLICY_TREE_FILE]
+    return [
+        storage_json.QUESTIONS_FILE,
+        storage_json.DISEASES_FILE,
+        storage_json.DIAGNOSIS_MODEL_FILE,
+        storage_json.MODEL_BINARY_FILE,
+        config.POLICY_TREE_FILE,
+    ]
+
+
+def _default_loader():
+    from storage_json import load_compiled_model
+
+    return load_compiled_model()
+
+
+def _default_source() -> tuple:
+    """Return the default ``(loader, data_version)`` of ``AIVO_STORAGE``."""
+
+    if config.STORAGE_BACKEND == "sqlite":
+        from storage_sqlite import SQLiteStorage
+
+        storage = SQLiteStorage(config.SQLITE_FILE)
+        return storage.load_compiled_model, storage.data_version
+    return _default_loader, None
+
+
+class ModelProvider:
+    """Serve the current ``CompiledModel`` and reload it when files change.
+
+    ``loader`` returns a compiled model (default: the data files through
+    ``storage_json``, or the database with ``AIVO_STORAGE=sqlite``) and
+    ``policy_loader`` an optional policy tree, which is dropped when it was
+    built for another model version.  ``paths`` are the files watched for
+    changes and ``data_version`` an optional callable whose result changes
+    with the data, such as ``SQLiteStorage.data_version``.  Entries of a
+    replaced version are dropped from ``question_cache`` once no retained
+    session needs them.
+    """
+
+    def __init__(
+        self,
+        loader: Optional[Callable] = None,
+        *,
+        policy_loader: Optional[Callable] = None,
+        paths: Optional[Sequence[str]] = None,
+        data_version: Optional[Callable] = None,
+        interval: float = config.MODEL_POLL_INTERVAL,
+        clock: Callable[[], float] = time.time,
+        question_cache=default_cache,
+    ):
+        if loader is None:
+            loader, default_version = _default_source()
+            if data_version is None:
+                data_version = default_version
+        self.loader = loader
+        self.data_version = data_version
+        self.policy_loader = policy_loader
+        self.paths = list(_default_paths() if paths is None else paths)
+        self.interval = interval
+        self.clock = clock
+        self.question_cache = question_cache
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners: List[Callable] = []
+        # version -> [(compiled, policy), snapshot count]
+        self._retained: Dict[str, list] = {}
+        self._retained_lock = threading.Lock()
+        self.reloads = 0
+        self.errors = 0
+        self.last_error = None
+        self.reload_ms = 0.0
+        self.loaded_at = None
+        self._signature = self._stat()
+        start = time.perf_counter()
+        # (compiled, policy), replaced as a whole so readers never see a
+        # model paired with another model's policy.
+        self._active = self._load()
+        self.reload_ms = (time.perf_counter() - start) * 1000
+        self.loaded_at = self.clock()
+
+    # -- access ----------------------------------------------------------
+
+    @property
+    def current(self):
+        """The ``CompiledModel`` new sessions should use."""
+
+        return self._active[0]
+
+    @property
+    def policy(self):
+        """Policy tree matching ``current``, or ``None``."""
+
+        return self._active[1]
+
+    @property
+    def version(self) -> str:
+        return self._active[0].version
+
+    def new_engine(self, version: Optional[str] = None, **kwargs):
+        """Return a ``DiagnosisEngine`` pinned to the current model.
+
+        With ``version``, the engine uses that model version instead; a
+        version that is neither current nor retained raises
+        ``LookupError``.
+        """
+
+        from engine_rule import DiagnosisEngine
+        from lookahead import default_lookahead
+
+        active = self._active
+        if version is not None and version != active[0].version:
+            with self._retained_lock:
+                entry = self._retained.get(version)
+            if entry is None:
+                raise LookupError(f"Model version {version} is no longer available")
+            active = entry[0]
+        compiled, policy = active
+        kwargs.setdefault("policy", policy)
+        kwargs.setdefault("lookahead", default_lookahead())
+        return DiagnosisEngine.from_compiled(compiled, **kwargs)
+
+    def retain(self, compiled, policy=None) -> None:
+        """Keep ``compiled`` available to ``new_engine`` until released."""
+
+        with self._retained_lock:
+            entry = self._retained.get(compiled.version)
+            if entry is None:
+                entry = self._retained[compiled.version] = [(compiled, policy), 0]
+            entry[1] += 1
+
+    def release(self, version: str) -> None:
+        """Drop one ``retain`` of ``version``."""
+
+        with self._retained_lock:
+            entry = self._retained.get(version)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._retained[version]
+                    if version != self.version:
+                        self._drop_cached(version)
+
+    def _drop_cached(self, version: str) -> None:
+        if self.question_cache is not None:
+            self.question_cache.invalidate(version)
+
+    def add_listener(self, callback: Callable) -> None:
+        """Call ``callback(compiled)`` whenever a new model version is loaded."""
+
+        self._listeners.append(callback)
+
+    def status(self) -> dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "reload_ms": self.reload_ms,
+            "reloads": self.reloads,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "retained_versions": sorted(self._retained),
+        }
+
+    # -- reloading -------------------------------------------------------
+
+    def _stat(self) -> tuple:
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        if self.data_version is not None:
+            try:
+                signature.append(self.data_version())
+            except Exception as exc:  # retried on the next poll
+                logger.warning("Could not read the data version: %s", exc)
+                signature.append(None)
+        return tuple(signature)
+
+    def _load(self) -> tuple:
+        compiled = self.loader()
+        policy = self.policy_loader() if self.policy_loader else None
+        if policy is not None and policy.version != compiled.version:
+            logger.info("Policy tree is stale for model %s; not using it", compiled.version)
+            policy = None
+        return compiled, policy
+
+    def check(self) -> bool:
+        """Reload if a watched file changed; return whether the model changed."""
+
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        return self.reload(signature)
+
+    def reload(self, signature: Optional[tuple] = None) -> bool:
+        """Recompile now; return whether a new version was swapped in.
+
+        A failing load is logged and counted; the previous model stays
+        active.
+        """
+
+        with self._lock:
+            start = time.perf_counter()
+            if signature is None:
+                signature = self._stat()
+            try:
+                active = self._load()
+            except Exception as exc:  # keep serving the old model
+                self.errors += 1
+                self.last_error = str(exc)
+                logger.error("Model reload failed: %s", exc)
+                return False
+            finally:
+                # Retry only once the files change again.
+                self._signature = signature
+            elapsed = time.perf_counter() - start
+            metrics.observe("model.reload", elapsed)
+            previous = self.version
+            changed = active[0].version != previous
+            # Swapped even for the same version: the policy may be new.
+            self._active = active
+            self.reload_ms = elapsed * 1000
+            self.loaded_at = self.clock()
+            self.last_error = None
+            if not changed:
+                return False
+            self.reloads += 1
+        with self._retained_lock:
+            if previous not in self._retained:
+                self._drop_cached(previous)
+        logger.info("Model %s loaded in %.1f ms", self.version, self.reload_ms)
+        for callback in self._listeners:
+            callback(active[0])
+        return True
+
+    def start(self) -> None:
+        """Start polling for changes on a daemon thread."""
+
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-provider", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
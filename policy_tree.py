@@ -0,0 +1,173 @@
+"""Offline compiled greedy question policy.
+
+``select_best_question`` is deterministic for a given model, so the
+questions it asks can be computed ahead of time for every answer sequence
+up to a depth or node budget.  ``build_policy_tree`` walks those sequences
+breadth first and records the chosen question per node; the engine then
+follows the tree in constant time and computes live once a session leaves
+it.
+
+Build the tree for the data files with::
+
+    python policy_tree.py --depth 6 --max-nodes 20000
+"""
+
+import argparse
+import json
+import logging
+import os
+from collections import deque
+from typing import List, Optional, Sequence
+
+import config
+
+FORMAT_VERSION = 1
+# Marker for a node without a question or an unexpanded child slot.
+NO_NODE = -1
+
+logger = logging.getLogger(__name__)
+
+
+class PolicyTree:
+    """Greedy questionnaire keyed by answer sequence.
+
+    ``nodes[n]`` is ``[question index, child for answer 0, child for answer
+    1, ...]`` with children aligned with ``answers[question index]``.  Leaf
+    nodes only carry the question.  Node ``0`` is the root.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        questions: Sequence[str],
+        answers: Sequence[Sequence[str]],
+        nodes: List[List[int]],
+    ):
+        self.version = version
+        self.questions = list(questions)
+        self.answers = [list(a) for a in answers]
+        self.nodes = nodes
+        self._answer_slots = [
+            {a: k + 1 for k, a in enumerate(domain)} for domain in self.answers
+        ]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def question(self, node: int) -> Optional[str]:
+        """Return the question asked at ``node`` (``None`` when finished)."""
+
+        qi = self.nodes[node][0]
+        return None if qi == NO_NODE else self.questions[qi]
+
+    def child(self, node: int, question: str, answer: str) -> Optional[int]:
+        """Return the node reached by answering ``question`` at ``node``."""
+
+        entry = self.nodes[node]
+        qi = entry[0]
+        if qi == NO_NODE or self.questions[qi] != question:
+            return None
+        slot = self._answer_slots[qi].get(answer)
+        if slot is None or slot >= len(entry) or entry[slot] == NO_NODE:
+            return None
+        return entry[slot]
+
+    def to_dict(self) -> dict:
+        return {
+            "format": FORMAT_VERSION,
+            "version": self.version,
+            "questions": self.questions,
+            "answers": self.answers,
+            "nodes": self.nodes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported policy tree format: {data.get('format')}")
+        return cls(data["version"], data["questions"], data["answers"], data["nodes"])
+
+
+def build_policy_tree(engine, max_depth: int = 6, max_nodes: int = 20000) -> PolicyTree:
+    """Return the greedy policy of ``engine`` expanded breadth first.
+
+    Sessions are expanded until ``max_depth`` answers or ``max_nodes`` nodes
+    have been reached, whichever comes first.  ``engine`` is reset during
+    the build.
+    """
+
+    compiled = engine.compiled
+    questions: List[str] = []
+    answers: List[List[str]] = []
+    q_slots = {}
+    nodes: List[List[int]] = []
+    queue = deque([((), None, 0)])
+    while queue and len(nodes) < max_nodes:
+        path, parent, slot = queue.popleft()
+        engine.reset()
+        for q, a in path:
+            engine.answer_question(q, a)
+        question = engine._select_best_question()
+        node = len(nodes)
+        if parent is not None:
+            nodes[parent][slot] = node
+        if question is None:
+            nodes.append([NO_NODE])
+            continue
+        if question not in q_slots:
+            q_slots[question] = len(questions)
+            questions.append(question)
+            answers.append(list(compiled.possible_answers(question)))
+        qi = q_slots[question]
+        entry = [qi]
+        if len(path) < max_depth:
+            domain = answers[qi]
+            entry.extend([NO_NODE] * len(domain))
+            for k, a in enumerate(domain):
+                queue.append((path + ((question, a),), node, k + 1))
+        nodes.append(entry)
+    engine.reset()
+    logger.info("Built policy tree with %d nodes", len(nodes))
+    return PolicyTree(compiled.version, questions, answers, nodes)
+
+
+def save_policy_tree(tree: PolicyTree, path: str = config.POLICY_TREE_FILE) -> None:
+    """Write ``tree`` to ``path`` in compact JSON form."""
+
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(tree.to_dict(), f, separators=(",", ":"))
+    except OSError as exc:
+        raise RuntimeError(f"Failed to save policy tree: {exc}") from exc
+
+
+def load_policy_tree(path: str = config.POLICY_TREE_FILE) -> Optional[PolicyTree]:
+    """Return the policy tree stored at ``path`` or ``None`` if absent."""
+
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return PolicyTree.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError) as exc:
+        raise RuntimeError(f"Failed to load policy tree: {exc}") from exc
+
+
+def main(argv=None) -> None:
+    from engine_rule import DiagnosisEngine
+    from storage_json import load_compiled_model
+
+    parser = argparse.ArgumentParser(description="Compile the greedy question policy")
+    parser.add_argument("--depth", type=int, default=6, help="maximum answers per path")
+    parser.add_argument("--max-nodes", type=int, default=20000, help="node budget")
+    parser.add_argument("--output", default=config.POLICY_TREE_FILE, help="output file")
+    args = parser.parse_args(argv)
+
+    engine = DiagnosisEngine.from_compiled(load_compiled_model(), question_cache=None)
+    tree = build_policy_tree(engine, args.depth, args.max_nodes)
+    save_policy_tree(tree, args.output)
+    print(f"Wrote {len(tree)} nodes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Process wide memoization of next-question selections.
+
+``DiagnosisEngine.select_best_question`` is deterministic for a given model
+and set of answers, so sessions following the same answer path can share
+the result.  Entries are keyed by the model version hash and a canonical
+fingerprint of the answered set.
+"""
+
+import threading
+from collections import OrderedDict
+
+import config
+
+# Returned by ``QuestionCache.get`` when ``key`` is not cached; ``None`` is
+# a legitimate cached value meaning no question is left to ask.
+MISSING = object()
+
+EVICTION_POLICIES = ("lru", "fifo")
+
+
+def answers_fingerprint(answered) -> frozenset:
+    """Return an order independent fingerprint of ``answered``."""
+
+    return frozenset(answered.items())
+
+
+class QuestionCache:
+    """Bounded thread-safe cache of ``(version, fingerprint) -> question``.
+
+    ``policy`` controls eviction once ``maxsize`` entries are stored:
+    ``"lru"`` drops the least recently used entry and ``"fifo"`` the oldest
+    one.  A ``maxsize`` of ``0`` disables caching.
+    """
+
+    def __init__(self, maxsize: int = 4096, policy: str = "lru"):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.maxsize = max(0, maxsize)
+        self.policy = policy
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.policy == "lru":
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version=None) -> None:
+        """Drop the entries of model ``version``, or everything if ``None``."""
+
+        with self._lock:
+            if version is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == version]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        """Return counters describing cache effectiveness."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+default_cache = QuestionCache(
+    config.QUESTION_CACHE_SIZE, config.QUESTION_CACHE_POLICY
+)
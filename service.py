@@ -0,0 +1,403 @@
+"""Asyncio HTTP/JSON front end for ``DiagnosisEngine``.
+
+The service loads the compiled model once and keeps one lightweight
+engine session per client case.  Information gain scans run in a thread
+pool so the event loop keeps serving other sessions meanwhile.  Only the
+standard library is used, so it can run on an isolated intranet host::
+
+    python service.py --host 0.0.0.0 --port 8080
+
+Endpoints (all bodies and responses are JSON):
+
+``POST /sessions``
+    Start a session and return its id with the first question.
+``GET /sessions/<id>/question``
+    Return the next question, or ``done`` with the ``stop_reason`` once
+    the questionnaire ends.
+``POST /sessions/<id>/answer``
+    Record ``{"question": ..., "answer": ...}``.
+``POST /sessions/<id>/undo``
+    Revert the most recent answer.
+``GET /sessions/<id>/ranking?n=3``
+    Return the top ``n`` diseases.
+``DELETE /sessions/<id>``
+    Discard a session.
+``GET /metrics``
+    Report session store occupancy, evictions and restore latency, plus
+    the engine latency histograms when ``AIVO_METRICS`` is enabled.
+
+Idle and least recently used sessions are snapshotted by ``SessionStore``
+and rebuilt transparently when the client comes back.
+
+When started from the command line the service watches the data files
+through ``ModelProvider``: new sessions use the latest model while
+sessions in progress keep the version they started with, also across
+snapshots.  A snapshot whose version is no longer loaded, e.g. after a
+restart, answers ``410 Gone``.  ``GET /health`` reports the active
+version and the last reload.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import config
+from engine_rule import DiagnosisEngine
+from instrumentation import metrics
+from lookahead import default_lookahead
+from session_store import SessionStore
+
+MAX_BODY_BYTES = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """Raised by request handlers to produce an error response."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DiagnosisService:
+    """Route JSON requests to per-session ``DiagnosisEngine`` instances."""
+
+    def __init__(
+        self,
+        compiled=None,
+        *,
+        policy=None,
+        provider=None,
+        workers: int = 4,
+        capacity: int = config.SESSION_CAPACITY,
+        ttl: float = config.SESSION_TTL,
+        snapshot_capacity: int = config.SESSION_SNAPSHOT_CAPACITY,
+        snapshot_ttl: float = config.SESSION_SNAPSHOT_TTL,
+        snapshot_dir=config.SESSION_SNAPSHOT_DIR,
+    ):
+        if compiled is None and provider is None:
+            from storage_json import load_compiled_model
+
+            compiled = load_compiled_model()
+        self._compiled = compiled
+        self.policy = policy
+        # Supplies the current model for new sessions when hot reloading.
+        self.provider = provider
+        self.sessions = SessionStore(
+            self._restore_engine,
+            retain=self._retain_model,
+            release=provider.release if provider is not None else None,
+            capacity=capacity,
+            ttl=ttl,
+            snapshot_capacity=snapshot_capacity,
+            snapshot_ttl=snapshot_ttl,
+            snapshot_dir=snapshot_dir,
+        )
+        # Serializes requests touching the same session; entries vanish
+        # once no request holds the lock.
+        self._locks = weakref.WeakValueDictionary()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def compiled(self):
+        """Model used for new sessions."""
+
+        if self.provider is not None:
+            return self.provider.current
+        return self._compiled
+
+    def close(self) -> None:
+        """Stop the worker threads and snapshot the live sessions."""
+
+        self._executor.shutdown(wait=False)
+        if self.sessions.snapshot_dir:
+            self.sessions.flush()
+
+    # -- session helpers -------------------------------------------------
+
+    def _lock(self, sid: str) -> asyncio.Lock:
+        lock = self._locks.get(sid)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[sid] = lock
+        return lock
+
+    def _engine(self, sid: str) -> DiagnosisEngine:
+        try:
+            engine = self.sessions.get(sid)
+        except LookupError as exc:
+            raise HTTPError(HTTPStatus.GONE, f"Session {sid} cannot be restored: {exc}")
+        if engine is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session: {sid}")
+        return engine
+
+    def _new_engine(self) -> DiagnosisEngine:
+        if self.provider is not None:
+            return self.provider.new_engine()
+        return DiagnosisEngine.from_compiled(
+            self.compiled, policy=self.policy, lookahead=default_lookahead()
+        )
+
+    def _restore_engine(self, version: str) -> DiagnosisEngine:
+        if self.provider is not None:
+            return self.provider.new_engine(version)
+        if version != self.compiled.version:
+            raise LookupError(f"Model version {version} is no longer available")
+        return self._new_engine()
+
+    def _retain_model(self, engine: DiagnosisEngine) -> None:
+        if self.provider is not None:
+            self.provider.retain(engine.compiled, engine.policy)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _advance(engine: DiagnosisEngine):
+        reason = engine.stop_reason()
+        return None if reason is not None else engine.select_best_question(), reason
+
+    @staticmethod
+    def _apply_answer(engine: DiagnosisEngine, question: str, answer: str):
+        engine.answer_question(question, answer)
+        return engine.stop_reason()
+
+    @staticmethod
+    def _rank(engine: DiagnosisEngine, n: int):
+        return engine.get_top_diseases(n), engine.stop_reason()
+
+    async def _next_question(self, engine: DiagnosisEngine):
+        """Return ``(question id, stop reason)`` computed off the event loop."""
+
+        return await self._run(self._advance, engine)
+
+    def _question_payload(self, sid: str, engine: DiagnosisEngine, qid, reason) -> dict:
+        question = None
+        if qid is not None:
+            q = engine.compiled.index.question(qid)
+            question = {
+                "id": qid,
+                "text": q.text if q else qid,
+                "answers": engine.get_possible_answers(qid),
+            }
+        return {
+            "session_id": sid,
+            "done": qid is None,
+            "stop_reason": reason,
+            "question": question,
+            "answered": len(engine.answered),
+        }
+
+    # -- handlers --------------------------------------------------------
+
+    async def create_session(self, body: dict) -> dict:
+        sid = uuid.uuid4().hex
+        engine = self._new_engine()
+        self.sessions[sid] = engine
+        async with self._lock(sid):
+            qid, reason = await self._next_question(engine)
+            return self._question_payload(sid, engine, qid, reason)
+
+    async def get_question(self, sid: str) -> dict:
+        async with self._lock(sid):
+            engine = self._engine(sid)
+            qid, reason = await self._next_question(engine)
+            return self._question_payload(sid, engine, qid, reason)
+
+    async def answer(self, sid: str, body: dict) -> dict:
+        question = body.get("question")
+        answer = body.get("answer")
+        if not isinstance(question, str) or not isinstance(answer, str):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "question and answer must be strings")
+        async with self._lock(sid):
+            engine = self._engine(sid)
+            if question not in engine.remaining_questions:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Question not available: {question}")
+            if answer not in engine.get_possible_answers(question):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid answer: {answer}")
+            reason = await self._run(self._apply_answer, engine, question, answer)
+            return {
+                "session_id": sid,
+                "answered": len(engine.answered),
+                "done": reason is not None,
+                "stop_reason": reason,
+            }
+
+    async def undo(self, sid: str) -> dict:
+        async with self._lock(sid):
+            engine = self._engine(sid)
+            qid = engine.undo_last_answer()
+            return {
+                "session_id": sid,
+                "undone": qid,
+                "answered": len(engine.answered),
+            }
+
+    async def ranking(self, sid: str, n: int) -> dict:
+        async with self._lock(sid):
+            engine = self._engine(sid)
+            top, reason = await self._run(self._rank, engine, n)
+            return {
+                "session_id": sid,
+                "top": [[d, s] for d, s in top],
+                "answered": len(engine.answered),
+                "done": reason is not None,
+                "stop_reason": reason,
+            }
+
+    async def delete_session(self, sid: str) -> dict:
+        async with self._lock(sid):
+            if not self.sessions.discard(sid):
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Unknown session: {sid}")
+            return {"session_id": sid, "deleted": True}
+
+    # -- routing ---------------------------------------------------------
+
+    async def dispatch(self, method: str, target: str, body: bytes = b""):
+        """Return ``(status, payload)`` for one request."""
+
+        try:
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError as exc:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {exc}")
+            if not isinstance(data, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Request body must be an object")
+            parts = [p for p in url.path.split("/") if p]
+            payload = await self._route(method, parts, query, data)
+            return HTTPStatus.OK, payload
+        except HTTPError as exc:
+            return exc.status, {"error": exc.message}
+        except Exception:
+            logger.exception("Failed to handle %s %s", method, target)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+
+    async def _route(self, method, parts, query, data):
+        if parts == ["health"] and method == "GET":
+            payload = {"status": "ok", "model_version": self.compiled.version}
+            if self.provider is not None:
+                payload["model"] = self.provider.status()
+            return payload
+        if parts == ["metrics"] and method == "GET":
+            return {"sessions": self.sessions.metrics(), "engine": metrics.snapshot()}
+        if parts == ["sessions"] and method == "POST":
+            return await self.create_session(data)
+        if len(parts) in (2, 3) and parts[0] == "sessions":
+            sid = parts[1]
+            action = parts[2] if len(parts) == 3 else ""
+            if action == "" and method == "DELETE":
+                return await self.delete_session(sid)
+            if action == "question" and method == "GET":
+                return await self.get_question(sid)
+            if action == "answer" and method == "POST":
+                return await self.answer(sid, data)
+            if action == "undo" and method == "POST":
+                return await self.undo(sid)
+            if action == "ranking" and method == "GET":
+                try:
+                    n = int(query.get("n", ["3"])[0])
+                except ValueError:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "n must be an integer")
+                if n < 1:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "n must be at least 1")
+                return await self.ranking(sid, n)
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No route for {method} /{'/'.join(parts)}")
+
+    # -- HTTP transport --------------------------------------------------
+
+    async def handle_connection(self, reader, writer) -> None:
+        """Serve HTTP/1.1 requests on one connection until it closes."""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {
+                        "error": "Request body too large"
+                    }
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self.dispatch(method, target, body)
+                    keep_alive = (
+                        version == "HTTP/1.1"
+                        and headers.get("connection", "").lower() != "close"
+                    )
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as exc:
+            logger.debug("Connection closed: %s", exc)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = config.SERVICE_HOST, port: int = config.SERVICE_PORT):
+        """Return a started ``asyncio`` server bound to ``host``/``port``."""
+
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def _run(host: str, port: int) -> None:
+    from model_provider import ModelProvider
+    from policy_tree import load_policy_tree
+
+    provider = ModelProvider(policy_loader=load_policy_tree)
+    provider.start()
+    service = DiagnosisService(provider=provider)
+    server = await service.serve(host, port)
+    logger.info("Serving model %s on %s:%d", provider.version, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        provider.stop()
+        service.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run the diagnosis HTTP service")
+    parser.add_argument("--host", default=config.SERVICE_HOST, help="bind address")
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT, help="bind port")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Bounded storage for in-progress diagnosis sessions.
+
+``SessionStore`` keeps at most ``capacity`` live engines in least recently
+used order.  Sessions idle for longer than ``ttl`` seconds, or pushed out
+by newer ones, are reduced to a compact snapshot (the answer sequence and
+the model version) and rebuilt on demand by replaying the answers on that
+same version.  With a ``snapshot_dir`` the snapshots are files, so
+sessions also survive a restart of the process.
+
+Snapshots are bounded in turn: those older than ``snapshot_ttl`` seconds,
+or the oldest ones beyond ``snapshot_capacity``, are deleted for good.
+The bounds apply to the snapshots written by the running process; files
+left by an earlier one are only removed when their session is restored
+or discarded.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Number of recent restore timings kept for the latency percentiles.
+LATENCY_SAMPLES = 1000
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+class SessionStore:
+    """LRU/TTL bounded ``session id -> DiagnosisEngine`` mapping.
+
+    ``factory(version)`` returns a fresh engine on model ``version`` and is
+    used to rebuild sessions from their snapshots; it raises
+    ``LookupError`` when that version is no longer available, which
+    ``get`` passes on.  ``retain(engine)`` is called when a snapshot of
+    ``engine`` is written and ``release(version)`` when it is dropped, so
+    the owner of the models can keep the versions snapshots still refer
+    to.  ``clock`` may be replaced in tests.
+    """
+
+    def __init__(
+        self,
+        factory: Callable,
+        *,
+        retain: Optional[Callable] = None,
+        release: Optional[Callable] = None,
+        capacity: int = 10000,
+        ttl: float = 1800,
+        snapshot_capacity: int = 100000,
+        snapshot_ttl: float = 86400,
+        snapshot_dir: Optional[str] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.factory = factory
+        self.retain = retain
+        self.release = release
+        self.capacity = max(1, capacity)
+        self.ttl = ttl
+        self.snapshot_capacity = max(1, snapshot_capacity)
+        self.snapshot_ttl = snapshot_ttl
+        self.snapshot_dir = snapshot_dir
+        # Snapshot files on disk, counted once here and then kept up to date.
+        self._snapshot_files = 0
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            self._snapshot_files = sum(
+                1 for n in os.listdir(snapshot_dir) if n.endswith(".snap")
+            )
+        self.clock = clock
+        self._live = OrderedDict()
+        self._snapshots = {}
+        # Model version of every snapshot passed to ``retain``.
+        self._retained = {}
+        # Write time of the snapshots written by this process, oldest first.
+        self._written = OrderedDict()
+        self._lock = threading.RLock()
+        self.evictions = 0
+        self.expirations = 0
+        self.snapshot_expirations = 0
+        self.restores = 0
+        self._restore_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    # -- mapping interface ----------------------------------------------
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, sid):
+        with self._lock:
+            return sid in self._live or self._has_snapshot(sid)
+
+    def __setitem__(self, sid, engine) -> None:
+        self._check_id(sid)
+        with self._lock:
+            self._expire()
+            self._live[sid] = [engine, self.clock()]
+            self._live.move_to_end(sid)
+            self._drop_snapshot(sid)
+            while len(self._live) > self.capacity:
+                old_sid, (old_engine, _) = self._live.popitem(last=False)
+                self._write_snapshot(old_sid, old_engine)
+                self.evictions += 1
+
+    def get(self, sid, default=None):
+        """Return the engine for ``sid``, restoring it from its snapshot.
+
+        A snapshot whose model version is gone raises ``LookupError`` and
+        is kept.
+        """
+
+        with self._lock:
+            self._expire()
+            entry = self._live.get(sid)
+            if entry is not None:
+                entry[1] = self.clock()
+                self._live.move_to_end(sid)
+                return entry[0]
+            data = self._read_snapshot(sid)
+            if data is None:
+                return default
+            start = time.perf_counter()
+            engine = self._restore(data)
+            self._restore_ms.append((time.perf_counter() - start) * 1000)
+            self.restores += 1
+            self[sid] = engine
+            return engine
+
+    def discard(self, sid) -> bool:
+        """Forget ``sid`` and its snapshot; return whether it existed."""
+
+        with self._lock:
+            existed = self._live.pop(sid, None) is not None or self._has_snapshot(sid)
+            self._drop_snapshot(sid)
+            return existed
+
+    # -- maintenance ----------------------------------------------------
+
+    def _expire(self) -> None:
+        if self.ttl is None or self.ttl <= 0:
+            self._expire_snapshots()
+            return
+        deadline = self.clock() - self.ttl
+        while self._live:
+            sid, (engine, last_used) = next(iter(self._live.items()))
+            if last_used > deadline:
+                break
+            del self._live[sid]
+            self._write_snapshot(sid, engine)
+            self.expirations += 1
+        self._expire_snapshots()
+
+    def _expire_snapshots(self) -> None:
+        if self.snapshot_ttl is None or self.snapshot_ttl <= 0:
+            return
+        deadline = self.clock() - self.snapshot_ttl
+        while self._written:
+            sid, written = next(iter(self._written.items()))
+            if written > deadline:
+                break
+            self._drop_snapshot(sid)
+            self.snapshot_expirations += 1
+
+    def expire_idle(self) -> None:
+        """Snapshot and drop every session idle for longer than ``ttl``.
+
+        Snapshots older than ``snapshot_ttl`` are deleted as well.
+        """
+
+        with self._lock:
+            self._expire()
+
+    def flush(self) -> None:
+        """Snapshot every live session, e.g. before shutting down."""
+
+        with self._lock:
+            while self._live:
+                sid, (engine, _) = self._live.popitem(last=False)
+                self._write_snapshot(sid, engine)
+
+    def metrics(self) -> dict:
+        """Return occupancy, eviction and restore latency figures."""
+
+        with self._lock:
+            snapshots = self._snapshot_files if self.snapshot_dir else len(self._snapshots)
+            samples = list(self._restore_ms)
+            return {
+                "live": len(self._live),
+                "capacity": self.capacity,
+                "occupancy": len(self._live) / self.capacity,
+                "snapshots": snapshots,
+                "snapshot_capacity": self.snapshot_capacity,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "snapshot_expirations": self.snapshot_expirations,
+                "restores": self.restores,
+                "restore_ms": {
+                    "p50": _percentile(samples, 50),
+                    "p95": _percentile(samples, 95),
+                    "p99": _percentile(samples, 99),
+                    "max": max(samples) if samples else 0.0,
+                },
+            }
+
+    # -- snapshots ------------------------------------------------------
+
+    @staticmethod
+    def _check_id(sid) -> None:
+        if not isinstance(sid, str) or not _SAFE_ID.match(sid):
+            raise ValueError(f"Invalid session id: {sid!r}")
+
+    def _path(self, sid: str) -> str:
+        return os.path.join(self.snapshot_dir, f"{sid}.snap")
+
+    @staticmethod
+    def snapshot(engine) -> bytes:
+        """Return the compact snapshot of ``engine``'s session."""
+
+        answered = engine.answered
+        payload = {
+            "version": engine.compiled.version,
+            "answers": [[q, answered[q]] for q in engine.history if q in answered],
+        }
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    def _restore(self, data: bytes):
+        payload = json.loads(data)
+        engine = self.factory(payload["version"])
+        for q, a in payload["answers"]:
+            engine.answer_question(q, a)
+        return engine
+
+    def _write_snapshot(self, sid: str, engine) -> None:
+        data = self.snapshot(engine)
+        self._release(sid)
+        if self.retain is not None:
+            self.retain(engine)
+            self._retained[sid] = engine.compiled.version
+        self._written[sid] = self.clock()
+        self._written.move_to_end(sid)
+        if not self.snapshot_dir:
+            self._snapshots[sid] = data
+        else:
+            path = self._path(sid)
+            existed = os.path.exists(path)
+            try:
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            except OSError as exc:
+                logger.error("Failed to write snapshot for %s: %s", sid, exc)
+            else:
+                if not existed:
+                    self._snapshot_files += 1
+        while len(self._written) > self.snapshot_capacity:
+            self._drop_snapshot(next(iter(self._written)))
+            self.snapshot_expirations += 1
+
+    def _read_snapshot(self, sid) -> Optional[bytes]:
+        if not self.snapshot_dir:
+            return self._snapshots.get(sid)
+        if not isinstance(sid, str) or not _SAFE_ID.match(sid):
+            return None
+        try:
+            with open(self._path(sid), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _has_snapshot(self, sid) -> bool:
+        if not self.snapshot_dir:
+            return sid in self._snapshots
+        return (
+            isinstance(sid, str)
+            and bool(_SAFE_ID.match(sid))
+            and os.path.exists(self._path(sid))
+        )
+
+    def _release(self, sid) -> None:
+        version = self._retained.pop(sid, None)
+        if version is not None and self.release is not None:
+            self.release(version)
+
+    def _drop_snapshot(self, sid) -> None:
+        self._release(sid)
+        self._written.pop(sid, None)
+        if not self.snapshot_dir:
+            self._snapshots.pop(sid, None)
+            return
+        if isinstance(sid, str) and _SAFE_ID.match(sid):
+            try:
+                os.remove(self._path(sid))
+            except FileNotFoundError:
+                return
+            self._snapshot_files -= 1
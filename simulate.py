@@ -0,0 +1,291 @@
+"""Simulate diagnosis sessions with synthetic patients.
+
+Every run picks a disease and answers the engine's questions as a
+patient with that disease would: an answer weighted ``w`` for the disease
+is chosen with probability proportional to ``2 ** w``, answers that rule
+the disease out are never chosen, and questions the disease does not map
+are answered uniformly.  With probability ``noise`` an answer is replaced
+by a uniformly random one, as a mistaken observation would be.
+
+The report gives top-1/top-3 accuracy, how many questions each disease
+needs to reach the top spot alone, the distribution of questionnaire lengths
+with the reasons sessions stopped, the number of diseases still able to
+reach the top after each answer and the per-step latency::
+
+    python simulate.py --runs-per-disease 200 --noise 0.05 --workers 4
+
+Runs are seeded individually from ``--seed``, so everything except the
+latency figures is identical between invocations, whatever the number of
+workers.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from instrumentation import Histogram
+
+_worker = None
+
+
+class Patient:
+    """Answers questions for a patient with disease ``disease``."""
+
+    def __init__(self, compiled, disease: int, rng: random.Random, noise: float, profiles):
+        self.compiled = compiled
+        self.disease = disease
+        self.rng = rng
+        self.noise = noise
+        self.weights, self.rule_outs = profiles
+
+    def answer(self, question: str) -> str:
+        answers = self.compiled.possible_answers(question)
+        if self.rng.random() < self.noise:
+            return self.rng.choice(answers)
+        odds = []
+        for f in self.compiled.question_features(question):
+            if f is None:
+                odds.append(1.0)
+            elif self.disease in self.rule_outs[f]:
+                odds.append(0.0)
+            else:
+                odds.append(2.0 ** self.weights[f].get(self.disease, 0))
+        if not any(odds):
+            return self.rng.choice(answers)
+        return self.rng.choices(answers, weights=odds)[0]
+
+
+def profiles(compiled):
+    """Return per-feature ``{disease: weight}`` maps and rule-out sets."""
+
+    return (
+        [dict(row) for row in compiled.deltas],
+        [frozenset(row) for row in compiled.rules_out],
+    )
+
+
+def _leads(top, target) -> bool:
+    # A tie for first place, which the ranking breaks by model order, does
+    # not count as reaching the top.
+    return bool(top) and top[0][0] == target and (len(top) == 1 or top[0][1] > top[1][1])
+
+
+def simulate_run(engine, disease: int, seed, run: int, noise: float, patient_profiles) -> dict:
+    """Run one session for ``disease`` and return its outcome."""
+
+    rng = random.Random(f"{seed}/{disease}/{run}")
+    patient = Patient(engine.compiled, disease, rng, noise, patient_profiles)
+    target = engine.compiled.diseases[disease]
+    engine.reset()
+    latencies = []
+    candidates = []
+    reached_top = None
+    reason = engine.stop_reason()
+    while reason is None:
+        start = time.perf_counter()
+        qid = engine.select_best_question()
+        if qid is None:
+            break
+        engine.answer_question(qid, patient.answer(qid))
+        latencies.append(time.perf_counter() - start)
+        candidates.append(engine.active_candidates)
+        if reached_top is None and _leads(engine.get_top_diseases(2), target):
+            reached_top = len(engine.answered)
+        reason = engine.stop_reason()
+    top = [d for d, _ in engine.get_top_diseases(3)]
+    return {
+        "disease": target,
+        "questions": len(engine.answered),
+        "reached_top": reached_top,
+        "top1": bool(top) and top[0] == target,
+        "top3": target in top,
+        "stop_reason": reason,
+        "latencies": latencies,
+        "candidates": candidates,
+    }
+
+
+def _simulate_jobs(compiled, jobs, seed, noise, patient_profiles, lookahead=None) -> List[dict]:
+    from engine_rule import DiagnosisEngine
+
+    engine = DiagnosisEngine.from_compiled(compiled, lookahead=lookahead)
+    return [
+        simulate_run(engine, disease, seed, run, noise, patient_profiles)
+        for disease, run in jobs
+    ]
+
+
+def _init_worker(paths: Optional[dict], version: str) -> None:
+    global _worker
+    from storage_json import load_compiled_model
+
+    compiled = load_compiled_model(**(paths or {}))
+    if compiled.version != version:
+        raise ValueError(f"Worker loaded model {compiled.version}, expected {version}")
+    _worker = (compiled, profiles(compiled))
+
+
+def _worker_jobs(jobs, seed, noise, lookahead) -> List[dict]:
+    compiled, patient_profiles = _worker
+    return _simulate_jobs(compiled, jobs, seed, noise, patient_profiles, lookahead)
+
+
+def _summary(values: Sequence[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "median": statistics.median(ordered),
+        "p90": ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))],
+        "max": ordered[-1],
+    }
+
+
+def build_report(results: List[dict], meta: dict) -> dict:
+    """Aggregate run outcomes into the simulation report."""
+
+    latency = Histogram()
+    by_disease: Dict[str, List[dict]] = {}
+    for r in results:
+        by_disease.setdefault(r["disease"], []).append(r)
+        for seconds in r["latencies"]:
+            latency.record(seconds)
+    diseases = {}
+    for disease, runs in by_disease.items():
+        reached = [r["reached_top"] for r in runs if r["reached_top"] is not None]
+        diseases[disease] = {
+            "runs": len(runs),
+            "top1": sum(r["top1"] for r in runs) / len(runs),
+            "top3": sum(r["top3"] for r in runs) / len(runs),
+            "questions_to_top": _summary(reached),
+            "never_top": len(runs) - len(reached),
+        }
+    by_step: Dict[int, List[int]] = {}
+    for r in results:
+        for step, count in enumerate(r["candidates"], 1):
+            by_step.setdefault(step, []).append(count)
+    total = len(results) or 1
+    lengths = Counter(r["questions"] for r in results)
+    return {
+        "meta": meta,
+        "runs": len(results),
+        "top1": sum(r["top1"] for r in results) / total,
+        "top3": sum(r["top3"] for r in results) / total,
+        "questions": _summary([r["questions"] for r in results]),
+        "question_counts": {str(k): lengths[k] for k in sorted(lengths)},
+        "stop_reasons": dict(Counter(str(r["stop_reason"]) for r in results)),
+        "step_latency": latency.summary(),
+        "active_candidates": {
+            str(step): statistics.fmean(counts) for step, counts in sorted(by_step.items())
+        },
+        "diseases": diseases,
+    }
+
+
+def simulate(
+    compiled=None,
+    *,
+    paths: Optional[dict] = None,
+    runs_per_disease: int = 100,
+    noise: float = 0.05,
+    seed=0,
+    workers: int = 1,
+    chunk_size: int = 50,
+    diseases: Optional[Sequence[str]] = None,
+    lookahead=None,
+) -> dict:
+    """Simulate ``runs_per_disease`` sessions per disease and return the report.
+
+    The model is ``compiled``, or else loaded from ``paths``, the keyword
+    arguments of ``storage_json.load_compiled_model`` (default: the
+    configured data files).  ``lookahead`` is passed to the engines (see
+    ``lookahead.py``).  With ``workers`` above one the runs are spread over
+    a process pool whose workers load the model from ``paths`` and check
+    it has the same version, so a ``compiled`` model needs its ``paths``.
+    """
+
+    if compiled is None:
+        from storage_json import load_compiled_model
+
+        compiled = load_compiled_model(**(paths or {}))
+    elif workers > 1 and paths is None:
+        raise ValueError("workers need the paths the given model was loaded from")
+    indices = (
+        range(len(compiled.diseases))
+        if diseases is None
+        else [compiled.disease_index[d] for d in diseases]
+    )
+    jobs: List[Tuple[int, int]] = [(i, run) for i in indices for run in range(runs_per_disease)]
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    meta = {
+        "model_version": compiled.version,
+        "runs_per_disease": runs_per_disease,
+        "noise": noise,
+        "seed": seed,
+        "lookahead": None if lookahead is None else repr(lookahead),
+    }
+    results: List[dict] = []
+    if workers <= 1:
+        patient_profiles = profiles(compiled)
+        for chunk in chunks:
+            results.extend(
+                _simulate_jobs(compiled, chunk, seed, noise, patient_profiles, lookahead)
+            )
+    else:
+        n = len(chunks)
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(paths, compiled.version)
+        ) as pool:
+            for chunk_results in pool.map(
+                _worker_jobs, chunks, [seed] * n, [noise] * n, [lookahead] * n
+            ):
+                results.extend(chunk_results)
+    return build_report(results, meta)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Simulate diagnosis sessions")
+    parser.add_argument("--runs-per-disease", type=int, default=100)
+    parser.add_argument("--noise", type=float, default=0.05, help="probability of a random answer")
+    parser.add_argument("--seed", default="0", help="random seed")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=50, help="runs per task")
+    parser.add_argument(
+        "--lookahead", type=int, default=1, help="questions looked ahead (1 = greedy)"
+    )
+    parser.add_argument("--beam", type=int, default=4, help="lookahead beam width")
+    parser.add_argument("-o", "--output", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    lookahead = None
+    if args.lookahead > 1:
+        from lookahead import Lookahead
+
+        # No time budget: the outcome must not depend on machine load.
+        lookahead = Lookahead(depth=args.lookahead, beam=args.beam, budget_ms=0)
+    report = simulate(
+        runs_per_disease=args.runs_per_disease,
+        noise=args.noise,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        lookahead=lookahead,
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,469 @@
+"""JSON persistence of the questions, diseases and diagnosis model.
+
+Parsed files are cached in memory keyed by path, mtime and size (plus a
+SHA-1 of the contents with ``AIVO_STORAGE_CACHE_HASH``), so repeated
+loads of unchanged files skip JSON parsing.  Every ``load_*`` call still
+returns a fresh mutable copy.  The compiled model is additionally cached
+on disk next to ``diagnosis_model.json`` so a cold start skips parsing
+too.  ``invalidate_cache()`` drops both caches; ``AIVO_STORAGE_CACHE=0``
+disables them, though the compiled model is still only rebuilt once a
+data file or the packed model changed.
+
+Saves skip collections whose file already holds the same data and replace
+files atomically.  ``AIVO_STORAGE_COMPACT=1`` writes compact JSON instead
+of the indented form.
+"""
+
+import argparse
+import hashlib
 import json
-from typing import Iterable, List
+import logging
+import os
+import stat
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
-from config import QUESTIONS_FILE, DISEASES_FILE, DIAGNOSIS_MODEL_FILE
+from config import (
+    QUESTIONS_FILE,
+    DISEASES_FILE,
+    DIAGNOSIS_MODEL_FILE,
+    MODEL_BINARY_FILE,
+    STORAGE_CACHE,
+    STORAGE_CACHE_HASH,
+    STORAGE_COMPACT,
+)
+from instrumentation import metrics, timed
+from model_compiled import CompiledModel, compile_model, validate_model
 from questions import Question
 
+_compiled_model = None
+_compiled_key = None
+_compiled_lock = threading.Lock()
+
+# path -> (file key, parsed data)
+_parsed: Dict[str, Tuple[tuple, object]] = {}
+_parsed_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _file_key(path: str) -> tuple:
+    """Return the cache key of ``path``: mtime, size and optional hash."""
+
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    if STORAGE_CACHE_HASH:
+        with open(path, "rb") as f:
+            key += (hashlib.sha1(f.read()).hexdigest(),)
+    return key
+
+
+def _load_cached(path: str, parse: Callable[[str], object]):
+    """Return ``parse(path)``, reusing the last result while ``path`` is unchanged."""
+
+    if not STORAGE_CACHE:
+        return parse(path)
+    key = _file_key(path)
+    with _parsed_lock:
+        entry = _parsed.get(path)
+    if entry is not None and entry[0] == key:
+        metrics.incr("storage.cache_hit")
+        return entry[1]
+    metrics.incr("storage.cache_miss")
+    data = parse(path)
+    with _parsed_lock:
+        _parsed[path] = (key, data)
+    return data
+
+
+def _read_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _parse_questions(path: str) -> List[Question]:
+    return [Question.from_dict(q) for q in _read_json(path)]
+
+
+def _copy_question(q: Question) -> Question:
+    choices = list(q.choices) if q.choices is not None else None
+    return Question(q.qid, q.text, q.qtype, choices)
+
+
+def _copy_model(model: dict) -> dict:
+    return {
+        d: {q: dict(weights) for q, weights in mapping.items()}
+        for d, mapping in model.items()
+    }
+
 
-def load_questions() -> List[Question]:
-    """Load questions from disk and return ``Question`` objects."""
+@timed("storage.load_questions")
+def load_questions(path: Optional[str] = None) -> List[Question]:
+    """Load questions from ``path`` (default ``QUESTIONS_FILE``) as ``Question`` objects."""
 
     try:
-        with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        questions = _load_cached(path or QUESTIONS_FILE, _parse_questions)
     except (OSError, json.JSONDecodeError) as exc:
         raise RuntimeError(f"Failed to load questions: {exc}") from exc
-    return [Question.from_dict(q) for q in data]
+    return [_copy_question(q) for q in questions]
 
 
-def load_diseases() -> List[str]:
-    """Return the list of diseases from disk."""
+@timed("storage.load_diseases")
+def load_diseases(path: Optional[str] = None) -> List[str]:
+    """Return the list of diseases from ``path`` (default ``DISEASES_FILE``)."""
 
     try:
-        with open(DISEASES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return list(_load_cached(path or DISEASES_FILE, _read_json))
     except (OSError, json.JSONDecodeError) as exc:
         raise RuntimeError(f"Failed to load diseases: {exc}") from exc
 
 
-def load_model() -> dict:
-    """Return the diagnosis model mapping."""
+@timed("storage.load_model")
+def load_model(path: Optional[str] = None) -> dict:
+    """Return the diagnosis model mapping from ``path`` (default ``DIAGNOSIS_MODEL_FILE``)."""
 
     try:
-        with open(DIAGNOSIS_MODEL_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return _copy_model(_load_cached(path or DIAGNOSIS_MODEL_FILE, _read_json))
     except (OSError, json.JSONDecodeError) as exc:
         raise RuntimeError(f"Failed to load model: {exc}") from exc
 
 
-def save_questions(questions: Iterable[Question]) -> None:
-    """Persist questions to ``QUESTIONS_FILE``."""
+def _data_paths(
+    questions_file: Optional[str] = None,
+    diseases_file: Optional[str] = None,
+    model_file: Optional[str] = None,
+    binary_file: Optional[str] = None,
+) -> Tuple[str, str, str, str]:
+    """Return the given data file paths, defaulting to the configured ones."""
+
+    return (
+        questions_file or QUESTIONS_FILE,
+        diseases_file or DISEASES_FILE,
+        model_file or DIAGNOSIS_MODEL_FILE,
+        binary_file or MODEL_BINARY_FILE,
+    )
+
+
+def _source_key(paths) -> Optional[list]:
+    """Return the cache key of the three data files, ``None`` if one is missing."""
+
+    try:
+        return [list(_file_key(p)) for p in paths[:3]]
+    except OSError:
+        return None
+
+
+def _binary_key(paths) -> Optional[tuple]:
+    """Return the cache key of the packed model file, ``None`` if it is missing."""
+
+    try:
+        return _file_key(paths[3])
+    except OSError:
+        return None
+
+
+def _disk_cache_paths(model_file: Optional[str] = None) -> Tuple[str, str]:
+    """Return the compiled cache file and its key file."""
+
+    base = os.path.splitext(model_file or DIAGNOSIS_MODEL_FILE)[0]
+    return f"{base}.cache", f"{base}.cache.key"
+
+
+@timed("storage.load_compiled_model")
+def load_compiled_model(
+    questions_file: Optional[str] = None,
+    diseases_file: Optional[str] = None,
+    model_file: Optional[str] = None,
+    binary_file: Optional[str] = None,
+) -> CompiledModel:
+    """Return the process wide ``CompiledModel`` for the data files.
+
+    The model is loaded, validated and compiled on first use and again
+    only after a data file changed; otherwise calls from any thread return
+    the same frozen instance.  A packed ``MODEL_BINARY_FILE`` newer than
+    the JSON files is used instead of them, then the on-disk compiled
+    cache when its key matches the data files.  The ``*_file`` arguments
+    replace the configured paths; the cached instance is then the one of
+    the last paths loaded.
+    """
+
+    global _compiled_model, _compiled_key
+    paths = _data_paths(questions_file, diseases_file, model_file, binary_file)
+    with _compiled_lock:
+        key = _source_key(paths)
+        memory_key = None if key is None else (paths, key, _binary_key(paths))
+        if _compiled_model is not None and memory_key == _compiled_key is not None:
+            return _compiled_model
+        if not STORAGE_CACHE:
+            key = None
+        compiled = _load_binary_model(paths)
+        if compiled is None and key is not None:
+            compiled = _load_disk_cache(paths, key)
+        if compiled is None:
+            questions = load_questions(paths[0])
+            diseases = load_diseases(paths[1])
+            model = load_model(paths[2])
+            q_ids = [q.qid for q in questions]
+            validate_model(diseases, q_ids, model)
+            compiled = compile_model(diseases, questions, model)
+            if key is not None:
+                _write_disk_cache(paths, key, diseases, questions, model, compiled)
+            # The compiled model keeps its own copy; don't hold the raw JSON too.
+            for path in paths[:3]:
+                _forget(path)
+        _compiled_model = compiled
+        _compiled_key = memory_key
+        return compiled
+
+
+def _load_binary_model(paths):
+    """Return the compiled packed model file or ``None`` if unusable."""
+
+    from model_binary import load_binary_model
+
+    binary_file = paths[3]
+    try:
+        built = os.path.getmtime(binary_file)
+        if any(os.path.getmtime(p) > built for p in paths[:3]):
+            logger.info("Ignoring %s: older than the JSON data", binary_file)
+            return None
+        return load_binary_model(binary_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring %s: %s", binary_file, exc)
+        return None
+
+
+def _load_disk_cache(paths, key: list) -> Optional[CompiledModel]:
+    from model_binary import load_binary_model
+
+    cache_file, key_file = _disk_cache_paths(paths[2])
+    try:
+        with open(key_file, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("sources") != key:
+            return None
+        compiled = load_binary_model(cache_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring compiled cache %s: %s", cache_file, exc)
+        return None
+    if compiled.version != stored.get("version"):
+        return None
+    metrics.incr("storage.disk_cache_hit")
+    return compiled
+
+
+def _write_disk_cache(paths, key, diseases, questions, model, compiled) -> None:
+    from model_binary import write_binary_model
+
+    cache_file, key_file = _disk_cache_paths(paths[2])
+    try:
+        write_binary_model(cache_file, diseases, questions, model, compiled)
+        tmp = f"{key_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"sources": key, "version": compiled.version}, f)
+        os.replace(tmp, key_file)
+    except OSError as exc:
+        # A read-only data directory only costs the next cold start.
+        logger.debug("Could not write compiled cache %s: %s", cache_file, exc)
+
+
+def invalidate_cache(disk: bool = True, model_file: Optional[str] = None) -> None:
+    """Drop the cached data files and compiled model.
+
+    With ``disk`` the on-disk compiled cache of ``model_file`` is deleted
+    as well, forcing the next ``load_compiled_model`` of it to parse and
+    compile the JSON files.  Without ``model_file`` that is the cache of
+    the configured model file and of the one last loaded.
+    """
+
+    global _compiled_model, _compiled_key
+    with _parsed_lock:
+        _parsed.clear()
+    with _compiled_lock:
+        model_files = {model_file or DIAGNOSIS_MODEL_FILE}
+        if model_file is None and _compiled_key is not None:
+            model_files.add(_compiled_key[0][2])
+        _compiled_model = None
+        _compiled_key = None
+        if disk:
+            for path in [p for f in sorted(model_files) for p in _disk_cache_paths(f)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _forget(path: str) -> None:
+    with _parsed_lock:
+        _parsed.pop(path, None)
+
+
+def _remember(path: str, data) -> None:
+    """Cache ``data`` as the parsed contents ``path`` was just written with."""
+
+    if not STORAGE_CACHE:
+        return
+    try:
+        key = _file_key(path)
+    except OSError:
+        return
+    with _parsed_lock:
+        _parsed[path] = (key, data)
 
-    data = [q.to_dict() for q in questions]
+
+def _unchanged(path: str, data) -> bool:
+    """Return whether ``path`` already holds ``data`` and was not edited since."""
+
+    if not STORAGE_CACHE:
+        return False
+    with _parsed_lock:
+        entry = _parsed.get(path)
+    if entry is None:
+        return False
+    try:
+        return entry[0] == _file_key(path) and entry[1] == data
+    except OSError:
+        return False
+
+
+def _write_json(path: str, data, compact: Optional[bool] = None) -> None:
+    """Atomically replace ``path`` with ``data`` serialized as JSON.
+
+    The data goes to a temporary file in the same directory which is
+    flushed to disk and renamed over ``path``, so a crash leaves either
+    the old or the new file, never a truncated one.
+    """
+
+    if compact is None:
+        compact = STORAGE_COMPACT
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if compact:
+                json.dump(data, f, separators=(",", ":"))
+            else:
+                json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if os.name == "posix":
+        # Persist the rename itself.
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def save_questions(questions: Iterable[Question], compact: Optional[bool] = None) -> bool:
+    """Persist questions to ``QUESTIONS_FILE``.
+
+    Returns ``False`` without touching the file when it already holds
+    ``questions``.  ``compact`` overrides ``AIVO_STORAGE_COMPACT``.
+    """
+
+    questions = list(questions)
+    if _unchanged(QUESTIONS_FILE, questions):
+        return False
+    _forget(QUESTIONS_FILE)
     try:
-        with open(QUESTIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+        _write_json(QUESTIONS_FILE, [q.to_dict() for q in questions], compact)
     except OSError as exc:
         raise RuntimeError(f"Failed to save questions: {exc}") from exc
+    _remember(QUESTIONS_FILE, [_copy_question(q) for q in questions])
+    return True
 
 
-def save_diseases(diseases: Iterable[str]) -> None:
-    """Write the diseases list back to disk."""
+def save_diseases(diseases: Iterable[str], compact: Optional[bool] = None) -> bool:
+    """Write the diseases list back to disk, unless it is unchanged."""
 
+    diseases = list(diseases)
+    if _unchanged(DISEASES_FILE, diseases):
+        return False
+    _forget(DISEASES_FILE)
     try:
-        with open(DISEASES_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(diseases), f, indent=2)
+        _write_json(DISEASES_FILE, diseases, compact)
     except OSError as exc:
         raise RuntimeError(f"Failed to save diseases: {exc}") from exc
+    _remember(DISEASES_FILE, diseases)
+    return True
 
 
-def save_model(model: dict) -> None:
-    """Persist the diagnosis model mapping."""
+def save_model(model: dict, compact: Optional[bool] = None) -> bool:
+    """Persist the diagnosis model mapping, unless it is unchanged."""
 
+    if _unchanged(DIAGNOSIS_MODEL_FILE, model):
+        return False
+    _forget(DIAGNOSIS_MODEL_FILE)
     try:
-        with open(DIAGNOSIS_MODEL_FILE, "w", encoding="utf-8") as f:
-            json.dump(model, f, indent=2)
+        _write_json(DIAGNOSIS_MODEL_FILE, model, compact)
     except OSError as exc:
         raise RuntimeError(f"Failed to save model: {exc}") from exc
+    _remember(DIAGNOSIS_MODEL_FILE, _copy_model(model))
+    return True
+
+
+def save_all(
+    questions=None,
+    diseases=None,
+    model=None,
+    *,
+    dirty: Optional[Iterable[str]] = None,
+    compact: Optional[bool] = None,
+) -> List[str]:
+    """Save the collections named in ``dirty`` and return those written.
+
+    ``dirty`` holds ``"questions"``, ``"diseases"`` and/or ``"model"``;
+    by default every collection passed in is considered.
+    """
+
+    collections = {
+        "questions": (questions, save_questions),
+        "diseases": (diseases, save_diseases),
+        "model": (model, save_model),
+    }
+    if dirty is None:
+        dirty = [name for name, (data, _) in collections.items() if data is not None]
+    written = []
+    for name, (data, save) in collections.items():
+        if name in dirty and save(data, compact):
+            written.append(name)
+    return written
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Manage the storage caches")
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="delete the on-disk compiled model cache",
+    )
+    parser.add_argument(
+        "--model-file",
+        help="model file whose cache --clear-cache deletes (default: the configured one)",
+    )
+    args = parser.parse_args(argv)
+    if args.clear_cache:
+        invalidate_cache(model_file=args.model_file)
+
+
+if __name__ == "__main__":
+    main()
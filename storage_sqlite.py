@@ -0,0 +1,257 @@
+"""SQLite storage backend with the same interface as ``storage_json``.
+
+Questions, choices, diseases and weights live in indexed tables of one
+database file, so changing a weight is a single-row upsert instead of a
+rewrite of ``diagnosis_model.json``.  The database runs in WAL mode: the
+diagnosis service and other readers keep working while an admin writes.
+
+Select it for the admin panel and the diagnosis side with
+``AIVO_STORAGE=sqlite``; ``ModelProvider`` then polls ``data_version`` to
+pick up admin writes.  Move data
+between the JSON files and the database with::
+
+    python storage_sqlite.py import     # data/*.json -> AIVO_SQLITE_FILE
+    python storage_sqlite.py export     # AIVO_SQLITE_FILE -> data/*.json
+"""
+
+import argparse
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+import config
+from instrumentation import timed
+from model_compiled import CompiledModel, compile_model, validate_model
+from questions import Question
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS diseases (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    qid TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    qtype TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS choices (
+    question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    choice TEXT NOT NULL,
+    PRIMARY KEY (question_id, position)
+);
+-- Weights are keyed by name: the model may mention questions that are not
+-- listed.  ``weight`` has no declared type so integers stay integers, and
+-- rowid order preserves the key order of the JSON mapping.
+CREATE TABLE IF NOT EXISTS weights (
+    disease TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    weight NOT NULL,
+    UNIQUE (disease, question, answer)
+);
+CREATE INDEX IF NOT EXISTS weights_question ON weights (question);
+CREATE INDEX IF NOT EXISTS diseases_position ON diseases (position);
+CREATE INDEX IF NOT EXISTS questions_position ON questions (position);
+"""
+
+
+class SQLiteStorage:
+    """``load_*``/``save_*`` storage backed by the database at ``path``.
+
+    Each thread gets its own connection.  Saves replace a whole collection
+    in one transaction; ``set_weight`` updates a single cell.
+    """
+
+    def __init__(self, path: str = config.SQLITE_FILE):
+        self.path = path
+        self._local = threading.local()
+        # ``data_version`` is only comparable on one connection, so it gets
+        # its own, shared by every thread.
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Close the calling thread's connection and the version connection."""
+
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
+    # -- loading ---------------------------------------------------------
+
+    @timed("sqlite.load_questions")
+    def load_questions(self) -> List[Question]:
+        """Return the questions as ``Question`` objects, in list order."""
+
+        conn = self._connection()
+        choices = {}
+        for question_id, choice in conn.execute(
+            "SELECT question_id, choice FROM choices ORDER BY question_id, position"
+        ):
+            choices.setdefault(question_id, []).append(choice)
+        return [
+            Question(qid, text, qtype, choices.get(question_id))
+            for question_id, qid, text, qtype in conn.execute(
+                "SELECT id, qid, text, qtype FROM questions ORDER BY position"
+            )
+        ]
+
+    @timed("sqlite.load_diseases")
+    def load_diseases(self) -> List[str]:
+        """Return the disease names in list order."""
+
+        rows = self._connection().execute("SELECT name FROM diseases ORDER BY position")
+        return [name for (name,) in rows]
+
+    @timed("sqlite.load_model")
+    def load_model(self) -> dict:
+        """Return the nested ``disease -> question -> answer`` mapping."""
+
+        model = {}
+        for disease, question, answer, weight in self._connection().execute(
+            "SELECT disease, question, answer, weight FROM weights ORDER BY rowid"
+        ):
+            model.setdefault(disease, {}).setdefault(question, {})[answer] = weight
+        return model
+
+    def load_compiled_model(self) -> CompiledModel:
+        """Return a ``CompiledModel`` of the current database contents."""
+
+        questions = self.load_questions()
+        diseases = self.load_diseases()
+        model = self.load_model()
+        validate_model(diseases, [q.qid for q in questions], model)
+        return compile_model(diseases, questions, model)
+
+    def data_version(self) -> int:
+        """Return a counter that changes whenever the database is committed to.
+
+        Commits from any thread or process count, including those made
+        through this instance.
+        """
+
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.path, check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # -- saving ----------------------------------------------------------
+
+    def save_questions(self, questions: Iterable[Question], compact: Optional[bool] = None) -> bool:
+        """Replace the stored questions and their choices.
+
+        ``compact`` is accepted for compatibility with ``storage_json``.
+        """
+
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM questions")
+            for position, q in enumerate(questions):
+                cur = conn.execute(
+                    "INSERT INTO questions (qid, text, qtype, position) VALUES (?, ?, ?, ?)",
+                    (q.qid, q.text, q.qtype, position),
+                )
+                conn.executemany(
+                    "INSERT INTO choices (question_id, position, choice) VALUES (?, ?, ?)",
+                    [(cur.lastrowid, i, c) for i, c in enumerate(q.choices or [])],
+                )
+        return True
+
+    def save_diseases(self, diseases: Iterable[str], compact: Optional[bool] = None) -> bool:
+        """Replace the stored disease list."""
+
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM diseases")
+            conn.executemany(
+                "INSERT INTO diseases (name, position) VALUES (?, ?)",
+                [(d, i) for i, d in enumerate(diseases)],
+            )
+        return True
+
+    def save_model(self, model: dict, compact: Optional[bool] = None) -> bool:
+        """Replace every stored weight with those of ``model``."""
+
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM weights")
+            conn.executemany(
+                "INSERT INTO weights (disease, question, answer, weight) VALUES (?, ?, ?, ?)",
+                (
+                    (d, q, a, w)
+                    for d, mapping in model.items()
+                    for q, answers in mapping.items()
+                    for a, w in answers.items()
+                ),
+            )
+        return True
+
+    def set_weight(self, disease: str, question: str, answer: str, weight) -> None:
+        """Insert or update the weight of one ``(disease, question, answer)``."""
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO weights (disease, question, answer, weight) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (disease, question, answer) DO UPDATE SET weight = excluded.weight",
+                (disease, question, answer, weight),
+            )
+
+    # -- conversion ------------------------------------------------------
+
+    def import_from(self, storage) -> None:
+        """Replace the database contents with those of another storage."""
+
+        self.save_questions(storage.load_questions())
+        self.save_diseases(storage.load_diseases())
+        self.save_model(storage.load_model())
+
+    def export_to(self, storage) -> None:
+        """Write the database contents through another storage's ``save_*``."""
+
+        storage.save_questions(self.load_questions())
+        storage.save_diseases(self.load_diseases())
+        storage.save_model(self.load_model())
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Convert between JSON files and SQLite")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--db", default=config.SQLITE_FILE, help="database file")
+    args = parser.parse_args(argv)
+
+    import storage_json
+
+    storage = SQLiteStorage(args.db)
+    try:
+        if args.command == "import":
+            storage.import_from(storage_json)
+        else:
+            storage.export_to(storage_json)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+import config  # noqa: E402
+import storage_json  # noqa: E402
+from generate_model import generate  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def data_copy(monkeypatch, tmp_path_factory):
+    """Point storage_json at a copy of the data files.
+
+    Loading the compiled model writes its disk cache next to the model
+    file, which must not land in the repository's data directory.
+    """
+
+    directory = tmp_path_factory.mktemp('data')
+    for name, src in (
+        ('QUESTIONS_FILE', config.QUESTIONS_FILE),
+        ('DISEASES_FILE', config.DISEASES_FILE),
+        ('DIAGNOSIS_MODEL_FILE', config.DIAGNOSIS_MODEL_FILE),
+    ):
+        dst = directory / os.path.basename(src)
+        shutil.copy(src, dst)
+        monkeypatch.setattr(storage_json, name, str(dst))
+    monkeypatch.setattr(storage_json, 'MODEL_BINARY_FILE', str(directory / 'none.bin'))
+    storage_json.invalidate_cache(disk=False)
+    yield directory
+    storage_json.invalidate_cache(disk=False)
+
+
+@pytest.fixture
+def synthetic_model(tmp_path_factory):
+    """Return a factory writing a generated model to a fresh directory.
+
+    The factory takes ``generate_model.generate`` options and returns the
+    ``load_compiled_model`` keyword arguments for the written files.
+    """
+
+    def make(**options):
+        directory = tmp_path_factory.mktemp('synthetic')
+        generate(str(directory), **options)
+        return {
+            'questions_file': str(directory / 'questions.json'),
+            'diseases_file': str(directory / 'diseases.json'),
+            'model_file': str(directory / 'diagnosis_model.json'),
+            'binary_file': str(directory / 'none.bin'),
+        }
+
+    return make
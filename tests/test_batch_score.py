@@ -0,0 +1,54 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_compiled_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from batch_score import iter_results  # noqa: E402
+
+
+CASES = [
+    {"id": 1, "answers": {"red_eye": "Yes", "discharge": "Mucopurulent"}},
+    {"id": 2, "answers": {"red_eye": "No", "pain": "Yes", "vision_loss": "Yes"}},
+    {"id": 3, "answers": [["photophobia", "Yes"], ["corneal_opacity", "Yes"]]},
+]
+
+
+def test_batch_scores_match_engine():
+    compiled = load_compiled_model()
+    lines = [json.dumps(c) for c in CASES] + ['not json']
+    results = list(iter_results(lines, compiled, top_k=3, chunk_size=2))
+    assert [r.get('id') for r in results[:3]] == [1, 2, 3]
+    assert 'error' in results[3]
+    for case, result in zip(CASES, results):
+        engine = DiagnosisEngine.from_compiled(compiled, question_cache=None)
+        answers = case['answers']
+        for q, a in (answers.items() if isinstance(answers, dict) else answers):
+            engine.answer_question(q, a)
+        expected = [list(p) for p in engine.get_top_diseases(3)]
+        assert result['top'] == expected
+
+
+def test_batch_scores_with_process_pool():
+    lines = [json.dumps(c) for c in CASES * 4]
+    serial = list(iter_results(lines, load_compiled_model(), chunk_size=3))
+    parallel = list(iter_results(lines, workers=2, chunk_size=3))
+    assert parallel == serial
+
+
+def test_process_pool_scores_the_given_model(tmp_path):
+    import pytest
+    from bench import scale_dataset, write_dataset, _base_dataset
+
+    paths = write_dataset(str(tmp_path), *scale_dataset(*_base_dataset(), 2))
+    compiled = load_compiled_model(**paths)
+    assert compiled.version != load_compiled_model().version
+    cases = CASES + [{"id": 4, "answers": {"red_eye#1": "Yes", "pain#1": "Yes"}}]
+    lines = [json.dumps(c) for c in cases * 3]
+    serial = list(iter_results(lines, compiled, chunk_size=2))
+    parallel = list(iter_results(lines, compiled, paths=paths, workers=2, chunk_size=2))
+    assert parallel == serial
+    assert any(d.endswith('#1') for d, _ in serial[3]['top'])
+    with pytest.raises(ValueError):
+        list(iter_results(lines, compiled, workers=2))
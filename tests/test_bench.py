@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import config  # noqa: E402
+from storage_json import load_diseases, load_model  # noqa: E402
+from bench import BENCHMARKS, compare, run_scale, scale_dataset, write_dataset  # noqa: E402
+
+
+def _base():
+    with open(config.QUESTIONS_FILE, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    return questions, load_diseases(), load_model()
+
+
+def test_scale_dataset_replicates_blocks():
+    questions, diseases, model = _base()
+    q2, d2, m2 = scale_dataset(questions, diseases, model, 3)
+    assert len(q2) == 3 * len(questions)
+    assert len(d2) == 3 * len(diseases)
+    assert d2[:len(diseases)] == diseases
+    d = diseases[0]
+    assert m2[f'{d}#2'] == {f'{q}#2': w for q, w in model[d].items()}
+
+
+def test_run_scale_on_synthetic_model(tmp_path):
+    paths = write_dataset(str(tmp_path), *scale_dataset(*_base(), 2))
+    result = run_scale(2, repeat=1, paths=paths)
+    assert result['diseases'] == 2 * len(load_diseases())
+    for name in BENCHMARKS:
+        assert result[name]['median_ms'] >= 0
+
+
+def test_run_scale_leaves_data_directory_alone(data_copy):
+    before = sorted(os.listdir(data_copy))
+    result = run_scale(1, repeat=1)
+    assert result['diseases'] == len(load_diseases())
+    assert sorted(os.listdir(data_copy)) == before
+
+
+def test_compare_flags_regressions():
+    def report(**medians):
+        return {'results': {'1': {n: {'median_ms': v} for n, v in medians.items()}}}
+
+    baseline = report(load=10.0, select=0.01, session=5.0)
+    current = report(load=14.0, select=0.03, session=5.5)
+    regressions = compare(current, baseline, threshold=0.25)
+    assert [r['benchmark'] for r in regressions] == ['load']
+    assert compare(current, {'results': {}}) == []
@@ -0,0 +1,63 @@
+import os
+import sys
+import io
+import json
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import config  # noqa: E402
+from storage_json import load_compiled_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from cli import run_interactive, run_json  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _engine():
+    return DiagnosisEngine.from_compiled(load_compiled_model(), question_cache=None)
+
+
+def test_json_protocol():
+    stdin = io.StringIO(
+        '{"answer": "Yes"}\nnot json\n{"answer": "Maybe"}\n{"undo": true}\n{"stop": true}\n'
+    )
+    stdout = io.StringIO()
+    assert run_json(_engine(), stdin, stdout) == 0
+    messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert messages[0]['question']['id'] == 'red_eye'
+    assert messages[1]['answered'] == 1
+    # Errors are followed by the same question again.
+    assert 'error' in messages[2] and 'error' in messages[4]
+    assert messages[3] == messages[5] == messages[1]
+    assert messages[6]['answered'] == 0
+    assert messages[-1]['done'] is True
+
+
+def test_interactive_answers_by_number_or_text():
+    stdin = io.StringIO('1\nNo\nq\n')
+    stdout = io.StringIO()
+    engine = _engine()
+    run_interactive(engine, stdin, stdout)
+    assert engine.answered['red_eye'] == 'Yes'
+    assert len(engine.answered) == 2
+    assert 'Most likely diagnoses' in stdout.getvalue()
+
+
+def test_headless_start_avoids_tk_and_meets_budget(data_copy):
+    code = (
+        "import sys; sys.argv = ['main.py', '--json']; import main\n"
+        "try:\n    main.main()\nexcept SystemExit:\n    pass\n"
+        "assert 'tkinter' not in sys.modules\n"
+    )
+    env = dict(os.environ)
+    env.pop('DISPLAY', None)
+    for name in ('questions', 'diseases', 'diagnosis_model'):
+        env[f'AIVO_{name.upper()}_FILE'] = str(data_copy / f'{name}.json')
+    env['AIVO_MODEL_BINARY_FILE'] = str(data_copy / 'none.bin')
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, env=env,
+        input='{"stop": true}\n', capture_output=True, text=True, check=True,
+    )
+    first = json.loads(result.stdout.splitlines()[0])
+    assert first['question']['id'] == 'red_eye'
+    assert first['startup_ms'] < config.FIRST_QUESTION_BUDGET_MS
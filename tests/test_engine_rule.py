@@ -82,3 +82,268 @@ def test_negative_weight_rules_out_disease(engine):
     assert 'Conjunctivitis' not in top
     engine.undo_last_answer()
     assert engine.scores['Conjunctivitis'] == 0
+
+
+def test_information_gains_match_per_question_simulation(engine):
+    engine.answer_question('red_eye', 'Yes')
+    engine.answer_question('pain', 'No')
+    current = engine.compute_entropy(dict(engine.scores))
+    candidates = sorted(engine.remaining_questions)
+    gains = engine.information_gains(candidates)
+    for q in candidates:
+        answers = engine.get_possible_answers(q)
+        entropies = [
+            engine.compute_entropy(engine.simulate_answer(engine.scores, q, a))
+            for a in answers
+        ]
+        expected = current - sum(entropies) / len(answers)
+        assert gains[q] == pytest.approx(expected)
+    best = engine.select_best_question()
+    assert gains[best] == max(gains.values())
+
+
+def test_entropy_after_matches_simulated_scores(engine):
+    engine.answer_question('red_eye', 'Yes')
+    engine.answer_question('discharge', 'Serous')
+    for q in ('vision_loss', 'pain', 'discharge_amount'):
+        for a in engine.get_possible_answers(q):
+            sim = engine.simulate_answer(engine.scores, q, a)
+            assert engine.entropy_after(q, a) == pytest.approx(
+                engine.compute_entropy(sim)
+            )
+
+
+def test_incremental_entropy_tracks_scores(engine):
+    for q, a in [('red_eye', 'No'), ('pain', 'Yes'), ('discharge', 'Bloody')]:
+        engine.answer_question(q, a)
+        assert engine.compute_entropy() == pytest.approx(
+            engine.compute_entropy(dict(engine.scores))
+        )
+    while engine.history:
+        engine.undo_last_answer()
+        assert engine.compute_entropy() == pytest.approx(
+            engine.compute_entropy(dict(engine.scores))
+        )
+    assert engine.compute_entropy() == pytest.approx(math.log2(len(engine.diseases)))
+
+
+def test_sessions_share_compiled_model(caplog):
+    from storage_json import load_compiled_model
+
+    compiled = load_compiled_model()
+    assert load_compiled_model() is compiled
+    caplog.set_level(logging.WARNING)
+    first = DiagnosisEngine.from_compiled(compiled)
+    second = DiagnosisEngine.from_compiled(compiled)
+    assert not caplog.records
+    assert first.session.scores is compiled.zero_scores
+    first.answer_question('red_eye', 'Yes')
+    assert first.scores['Conjunctivitis'] == 3
+    assert second.scores['Conjunctivitis'] == 0
+    assert 'red_eye' in second.remaining_questions
+    with pytest.raises(AttributeError):
+        compiled.version = 'changed'
+
+
+def _answer_path(engine):
+    for q, a in [('red_eye', 'No'), ('pain', 'Yes'), ('discharge', 'Bloody')]:
+        engine.answer_question(q, a)
+
+
+def test_state_round_trip_dict_and_binary(engine):
+    _answer_path(engine)
+    state = engine.get_state()
+    assert state['eliminated']['Conjunctivitis'] == 1
+    data = engine.dump_state()
+    assert len(data) < 40
+
+    for restore in (lambda e: e.restore_state(state), lambda e: e.load_state(data)):
+        other = DiagnosisEngine.from_compiled(engine.compiled)
+        restore(other)
+        assert dict(other.scores) == dict(engine.scores)
+        assert other.history == engine.history
+        assert other.answered == engine.answered
+        assert other.compute_entropy() == pytest.approx(engine.compute_entropy())
+        other.undo_last_answer()
+        other.undo_last_answer()
+        other.undo_last_answer()
+        assert all(v == 0 for v in other.scores.values())
+        assert other.compute_entropy() == pytest.approx(
+            math.log2(len(other.diseases))
+        )
+
+
+def test_load_state_rejects_other_model(engine):
+    _answer_path(engine)
+    data = engine.dump_state()
+    other = DiagnosisEngine(['D1'], ['q1'], {'D1': {'q1': {'Yes': 1}}})
+    with pytest.raises(ValueError):
+        other.load_state(data)
+    with pytest.raises(ValueError):
+        engine.load_state(b'junk')
+
+
+def test_state_is_strict_json_with_ruled_out_diseases(engine):
+    import json
+
+    _answer_path(engine)
+    assert engine.scores['Conjunctivitis'] == float('-inf')
+    state = json.loads(json.dumps(engine.get_state(), allow_nan=False))
+    assert state['scores']['Conjunctivitis'] is None
+    other = DiagnosisEngine.from_compiled(engine.compiled)
+    other.restore_state(state)
+    assert dict(other.scores) == dict(engine.scores)
+
+
+def test_dump_state_keeps_answers_without_weights():
+    eng = DiagnosisEngine(
+        ['D1', 'D2'], ['q1', 'q2', 'q3'], {'D1': {'q1': {'Yes': 1}}, 'D2': {'q3': {'No': 2}}},
+        question_cache=None,
+    )
+    for q, a in [('q2', 'No'), ('q1', 'Yes'), ('q3', 'No')]:
+        eng.answer_question(q, a)
+    data = eng.dump_state()
+    other = DiagnosisEngine.from_compiled(eng.compiled, question_cache=None)
+    other.load_state(data)
+    assert other.history == ['q2', 'q1', 'q3']
+    assert other.answered == eng.answered
+    assert dict(other.scores) == dict(eng.scores)
+    with pytest.raises(ValueError):
+        other.load_state(data[:-3])
+    eng.answer_question('q2', 'Maybe')
+    with pytest.raises(ValueError):
+        eng.dump_state()
+
+
+def test_bounds_follow_answers_and_undo(engine):
+    engine.is_done()
+    for q, a in [('red_eye', 'Yes'), ('vision_loss', 'No'), ('red_eye', 'Yes')]:
+        engine.answer_question(q, a)
+    engine.undo_last_answer()
+    tracked = engine.session.bounds
+    engine.session.bounds = None
+    assert [list(b) for b in tracked] == [list(b) for b in engine._bounds()]
+
+
+def test_stop_reason_when_ranking_is_fixed():
+    eng = DiagnosisEngine(
+        ['D1', 'D2'],
+        ['q1', 'q2'],
+        {
+            'D1': {'q1': {'Yes': 5, 'No': 0}, 'q2': {'Yes': 1, 'No': 0}},
+            'D2': {'q1': {'Yes': 0, 'No': 1}, 'q2': {'Yes': 2, 'No': 0}},
+        },
+    )
+    assert eng.stop_reason(top_k=2) is None
+    eng.answer_question('q1', 'Yes')
+    assert eng.stop_reason(top_k=0) is None
+    assert eng.stop_reason(top_k=2) == 'ranking_fixed'
+    assert eng.is_done(top_k=2)
+    eng.undo_last_answer()
+    assert not eng.is_done(top_k=2)
+    assert eng.stop_reason(max_questions=0) == 'max_questions'
+
+
+def test_possible_rule_out_keeps_ranking_open():
+    eng = DiagnosisEngine(
+        ['D1', 'D2'],
+        ['q1', 'q2'],
+        {
+            'D1': {'q1': {'Yes': 5, 'No': 0}, 'q2': {'Yes': -1, 'No': 0}},
+            'D2': {'q1': {'Yes': 0, 'No': 1}, 'q2': {'Yes': 0, 'No': 0}},
+        },
+    )
+    eng.answer_question('q1', 'Yes')
+    assert eng.stop_reason(top_k=1) is None
+    eng.answer_question('q2', 'No')
+    assert eng.stop_reason(top_k=1) == 'no_questions'
+
+
+def test_fixed_ranking_survives_any_completion(tmp_path):
+    import json
+    import random
+    from generate_model import generate
+
+    generate(str(tmp_path), diseases=8, questions=12, choices=3, sparsity=0.3, seed=4)
+    data = {
+        name: json.loads((tmp_path / f'{name}.json').read_text())
+        for name in ('questions', 'diseases', 'diagnosis_model')
+    }
+    qids = [q['id'] for q in data['questions']]
+    rng = random.Random(0)
+    stopped = 0
+    for _ in range(300):
+        eng = DiagnosisEngine(data['diseases'], qids, data['diagnosis_model'], question_cache=None)
+        cap, k = rng.randint(2, 12), rng.choice([1, 2, 3])
+        top = None
+        for q in rng.sample(qids, cap):
+            if top is None and eng.stop_reason(max_questions=cap, top_k=k) == 'ranking_fixed':
+                top = eng.get_top_diseases(k)
+            eng.answer_question(q, rng.choice(eng.get_possible_answers(q)))
+        if top is not None:
+            stopped += 1
+            assert [d for d, _ in eng.get_top_diseases(k)] == [d for d, _ in top]
+    assert stopped
+
+
+def test_pruning_keeps_gains_and_rankings_exact(tmp_path, monkeypatch):
+    import json
+    import random
+    import config
+    from generate_model import generate
+
+    generate(
+        str(tmp_path), diseases=40, questions=30, choices=3, sparsity=0.5, rule_out=0.1, seed=1
+    )
+    data = {
+        name: json.loads((tmp_path / f'{name}.json').read_text())
+        for name in ('questions', 'diseases', 'diagnosis_model')
+    }
+    qids = [q['id'] for q in data['questions']]
+    pruned = DiagnosisEngine(data['diseases'], qids, data['diagnosis_model'], question_cache=None)
+    full = DiagnosisEngine.from_compiled(pruned.compiled, question_cache=None)
+    rng = random.Random(0)
+    sizes = []
+    for step in range(28):
+        monkeypatch.setattr(config, 'PRUNE_TOP_K', 3)
+        expected = (
+            pruned.information_gains(qids),
+            pruned.get_top_diseases(3),
+            pruned.stop_reason(max_questions=40),
+        )
+        sizes.append(pruned.active_candidates)
+        monkeypatch.setattr(config, 'PRUNE_TOP_K', 0)
+        assert expected == (
+            full.information_gains(qids),
+            full.get_top_diseases(3),
+            full.stop_reason(max_questions=40),
+        )
+        q = rng.choice(sorted(full.remaining_questions))
+        answer = rng.choice(full.get_possible_answers(q))
+        for eng in (pruned, full):
+            eng.answer_question(q, answer)
+            if step % 7 == 6:
+                eng.undo_last_answer()
+        assert pruned.session.sums == full.session.sums
+    assert min(sizes) < len(data['diseases'])
+
+
+def test_pruned_ranking_respects_longer_horizons(monkeypatch):
+    import config
+
+    qids = ['q0'] + [f'q{i}' for i in range(1, 32)]
+    model = {
+        'T1': {'q0': {'Yes': 90, 'No': 0}},
+        'T2': {'q0': {'Yes': 60, 'No': 0}},
+        'T3': {'q0': {'Yes': 30, 'No': 0}},
+        'X': {q: {'Yes': 1, 'No': 0} for q in qids[1:]},
+    }
+    reasons = []
+    for k in (3, 0):
+        monkeypatch.setattr(config, 'PRUNE_TOP_K', k)
+        eng = DiagnosisEngine(['T1', 'T2', 'T3', 'X'], qids, model, question_cache=None)
+        eng.answer_question('q0', 'Yes')
+        # X can only pass T3 with more than 25 questions.
+        assert eng.stop_reason(top_k=3) == 'ranking_fixed'
+        reasons.append(eng.stop_reason(max_questions=40, top_k=3))
+    assert reasons == [None, None]
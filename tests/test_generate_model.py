@@ -0,0 +1,38 @@
+import os
+import sys
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from questions import Question  # noqa: E402
+from model_compiled import RULE_OUT, compile_model  # noqa: E402
+from generate_model import generate  # noqa: E402
+
+
+def _read(path, name):
+    with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_generated_model_compiles(tmp_path):
+    generate(str(tmp_path), diseases=30, questions=40, choices=3,
+             sparsity=0.5, rule_out=0.1, seed=7)
+    questions = [Question.from_dict(q) for q in json.loads(_read(tmp_path, 'questions.json'))]
+    diseases = json.loads(_read(tmp_path, 'diseases.json'))
+    model = json.loads(_read(tmp_path, 'diagnosis_model.json'))
+    assert len(questions) == 40 and len(diseases) == 30
+    assert all(len(model[d]) == 20 for d in diseases)
+    weights = [w for d in diseases for a in model[d].values() for w in a.values()]
+    assert RULE_OUT in weights
+    compiled = compile_model(diseases, questions, model)
+    assert len(compiled.askable) == 40
+    for q in questions:
+        if q.choices:
+            assert compiled.possible_answers(q.qid) == tuple(q.choices)
+
+
+def test_generation_is_reproducible(tmp_path):
+    for name, seed in (('a', 1), ('b', 1), ('c', 2)):
+        generate(str(tmp_path / name), diseases=5, questions=10, seed=seed)
+    model = 'diagnosis_model.json'
+    assert _read(tmp_path / 'a', model) == _read(tmp_path / 'b', model)
+    assert _read(tmp_path / 'a', model) != _read(tmp_path / 'c', model)
@@ -0,0 +1,59 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+from instrumentation import Histogram, metrics  # noqa: E402
+from storage_json import load_compiled_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.enabled = True
+    yield metrics
+    metrics.enabled = False
+    metrics.reset()
+
+
+def test_histogram_percentiles():
+    hist = Histogram()
+    for ms in range(1, 101):
+        hist.record(ms / 1000)
+    assert hist.count == 100
+    assert hist.percentile(50) == pytest.approx(0.050, rel=0.1)
+    assert hist.percentile(99) == pytest.approx(0.099, rel=0.1)
+    assert hist.percentile(100) == pytest.approx(0.100)
+
+
+def test_engine_hot_paths_are_timed(enabled_metrics):
+    seen = []
+
+    def hook(name, secs):
+        seen.append(name)
+
+    enabled_metrics.add_hook(hook)
+    engine = DiagnosisEngine.from_compiled(load_compiled_model(), question_cache=None)
+    engine.select_best_question()
+    engine.answer_question('red_eye', 'Yes')
+    engine.undo_last_answer()
+    snap = enabled_metrics.snapshot()
+    for name in (
+        'engine.select_best_question',
+        'engine.answer_question',
+        'engine.undo_last_answer',
+    ):
+        assert snap['timers'][name]['count'] == 1
+        assert name in seen
+    assert snap['counters']['engine.select.live'] == 1
+    enabled_metrics.remove_hook(hook)
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.reset()
+    engine = DiagnosisEngine.from_compiled(load_compiled_model(), question_cache=None)
+    engine.answer_question('red_eye', 'Yes')
+    with metrics.timer('block'):
+        pass
+    assert metrics.snapshot() == {'counters': {}, 'timers': {}}
@@ -0,0 +1,89 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from lookahead import Lookahead  # noqa: E402
+from question_cache import QuestionCache  # noqa: E402
+from storage_json import load_compiled_model  # noqa: E402
+
+
+def _exhaustive(engine, depth):
+    """Expected entropy after ``depth`` questions, searching every question."""
+
+    if depth == 0 or not engine.remaining_questions:
+        return engine.compute_entropy()
+    best = float('inf')
+    for q in [q for q in engine.compiled.askable if q not in engine.answered]:
+        answers = engine.get_possible_answers(q)
+        total = 0.0
+        for a in answers:
+            engine.answer_question(q, a)
+            total += _exhaustive(engine, depth - 1)
+            engine.undo_last_answer()
+        best = min(best, total / len(answers))
+    return best
+
+
+def _value_of(engine, question, depth):
+    answers = engine.get_possible_answers(question)
+    total = 0.0
+    for a in answers:
+        engine.answer_question(question, a)
+        total += _exhaustive(engine, depth - 1)
+        engine.undo_last_answer()
+    return total / len(answers)
+
+
+def test_depth_one_is_greedy():
+    compiled = load_compiled_model()
+    greedy = DiagnosisEngine.from_compiled(compiled, question_cache=None)
+    ahead = DiagnosisEngine.from_compiled(
+        compiled, question_cache=None, lookahead=Lookahead(depth=1)
+    )
+    for _ in range(5):
+        q = greedy.select_best_question()
+        assert ahead.select_best_question() == q
+        answer = greedy.get_possible_answers(q)[0]
+        greedy.answer_question(q, answer)
+        ahead.answer_question(q, answer)
+
+
+@pytest.mark.parametrize('depth', [2, 3])
+def test_full_beam_matches_exhaustive_search(synthetic_model, depth):
+    paths = synthetic_model(diseases=12, questions=10, choices=3, sparsity=0.5, seed=3)
+    compiled = load_compiled_model(**paths)
+    settings = Lookahead(depth=depth, beam=len(compiled.askable), max_nodes=10 ** 6, budget_ms=0)
+    engine = DiagnosisEngine.from_compiled(compiled, question_cache=None, lookahead=settings)
+    engine.answer_question(compiled.askable[0], compiled.possible_answers(compiled.askable[0])[0])
+    scores = list(engine.session.scores)
+    chosen = engine.select_best_question()
+    assert engine.history == [compiled.askable[0]]
+    assert list(engine.session.scores) == scores
+    assert _value_of(engine, chosen, depth) == pytest.approx(_exhaustive(engine, depth))
+
+
+def test_time_budget_falls_back_to_greedy():
+    compiled = load_compiled_model()
+    cache = QuestionCache(16)
+    engine = DiagnosisEngine.from_compiled(
+        compiled,
+        question_cache=cache,
+        lookahead=Lookahead(depth=3, beam=8, budget_ms=1e-6),
+    )
+    greedy = DiagnosisEngine.from_compiled(compiled, question_cache=None)
+    assert engine.select_best_question() == greedy.select_best_question()
+    assert len(cache) == 0
+
+
+def test_lookahead_is_cached_apart_from_greedy():
+    compiled = load_compiled_model()
+    cache = QuestionCache(16)
+    greedy = DiagnosisEngine.from_compiled(compiled, question_cache=cache)
+    ahead = DiagnosisEngine.from_compiled(
+        compiled, question_cache=cache, lookahead=Lookahead(depth=2, budget_ms=0)
+    )
+    greedy.select_best_question()
+    ahead.select_best_question()
+    assert len(cache) == 2
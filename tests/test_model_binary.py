@@ -0,0 +1,72 @@
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_questions, load_diseases, load_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from model_binary import (  # noqa: E402
+    load_binary_model,
+    read_binary_model,
+    write_binary_model,
+)
+
+
+def test_binary_model_round_trip(tmp_path):
+    path = str(tmp_path / 'model.bin')
+    questions, diseases, model = load_questions(), load_diseases(), load_model()
+    compiled = write_binary_model(path, diseases, questions, model)
+
+    d2, q2, m2 = read_binary_model(path)
+    assert d2 == diseases
+    assert q2 == questions
+    assert m2 == model
+
+    packed = load_binary_model(path)
+    assert packed.version == compiled.version
+    assert packed.askable == compiled.askable
+    assert packed.answers == compiled.answers
+    assert packed.feature_index == compiled.feature_index
+    assert list(packed.deltas) == list(compiled.deltas)
+    assert [tuple(r) for r in packed.rules_out] == list(compiled.rules_out)
+    assert packed.index.question('red_eye').text == 'Is the eye red?'
+
+    a = DiagnosisEngine.from_compiled(compiled, question_cache=None)
+    b = DiagnosisEngine.from_compiled(packed, question_cache=None)
+    for q, ans in [('red_eye', 'Yes'), ('pain', 'No')]:
+        a.answer_question(q, ans)
+        b.answer_question(q, ans)
+    assert b.select_best_question() == a.select_best_question()
+    assert b.get_top_diseases(5) == a.get_top_diseases(5)
+
+
+def test_binary_model_rejects_corruption(tmp_path):
+    path = tmp_path / 'model.bin'
+    write_binary_model(str(path), ['D'], ['q'], {'D': {'q': {'Yes': 1, 'No': -1}}})
+    data = bytearray(path.read_bytes())
+    data[-9] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match='checksum'):
+        load_binary_model(str(path))
+    path.write_bytes(b'JUNK' + bytes(data[4:]))
+    with pytest.raises(ValueError, match='Not a binary model'):
+        load_binary_model(str(path))
+
+
+def test_loaded_rows_are_backed_by_the_mapping(tmp_path):
+    import mmap
+
+    if sys.byteorder != 'little':
+        pytest.skip('tables are byte-swapped copies on big-endian hosts')
+    path = str(tmp_path / 'model.bin')
+    compiled = write_binary_model(path, load_diseases(), load_questions(), load_model())
+    packed = load_binary_model(path)
+    for column in packed.deltas.columns + packed.rules_out.columns:
+        assert isinstance(column, memoryview)
+        assert isinstance(column.obj, mmap.mmap)
+    f = next(f for f, row in enumerate(compiled.rules_out) if row)
+    row = packed.rules_out[f]
+    assert isinstance(row, memoryview) and isinstance(row.obj, mmap.mmap)
+    assert list(row) == list(compiled.rules_out[f])
+    # The mapping outlives the loader and still serves the lazy mapping.
+    assert packed.model == load_model()
@@ -0,0 +1,59 @@
+import os
+import sys
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_questions, load_diseases, load_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from model_compiled import compile_model  # noqa: E402
+
+
+def _reference_scores(diseases, model, answers):
+    """Score ``answers`` with the nested-dict rules the engine implements."""
+
+    scores = {d: 0 for d in diseases}
+    for q, a in answers:
+        for d in diseases:
+            if q not in model[d]:
+                continue
+            w = model[d][q].get(a, 0)
+            if w == -1:
+                scores[d] = float('-inf')
+            elif scores[d] != float('-inf'):
+                scores[d] += w
+    return scores
+
+
+def test_compile_model_indexes_features():
+    model = {
+        'D1': {'q1': {'Yes': 2, 'No': -1}},
+        'D2': {'q1': {'Yes': 0, 'No': 1}, 'q2': {'A': 3}},
+    }
+    compiled = compile_model(['D1', 'D2'], ['q1'], model)
+    assert compiled.questions == ('q1', 'q2')
+    yes = compiled.feature_id('q1', 'Yes')
+    no = compiled.feature_id('q1', 'No')
+    assert compiled.rows[yes] == (2, 0)
+    assert compiled.rows[no] == (0, 1)
+    assert compiled.rules_out[no] == (0,)
+    assert compiled.possible_answers('q2') == ('A',)
+    assert compiled.possible_answers('missing') == ('Yes', 'No')
+
+
+def test_compiled_engine_matches_dict_rules():
+    questions = [q.qid for q in load_questions()]
+    diseases = load_diseases()
+    model = load_model()
+    engine = DiagnosisEngine(diseases, questions, model)
+    rng = random.Random(1234)
+    for _ in range(20):
+        engine.reset()
+        picked = rng.sample(questions, 12)
+        answers = [(q, rng.choice(engine.get_possible_answers(q))) for q in picked]
+        for q, a in answers:
+            engine.answer_question(q, a)
+        assert dict(engine.scores) == _reference_scores(diseases, model, answers)
+        for depth in range(len(answers), 0, -1):
+            engine.undo_last_answer()
+            expected = _reference_scores(diseases, model, answers[:depth - 1])
+            assert dict(engine.scores) == expected
@@ -0,0 +1,34 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_questions, load_diseases, load_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from model_index import ModelIndex  # noqa: E402
+
+
+def test_index_lookups():
+    questions = load_questions()
+    diseases = load_diseases()
+    index = ModelIndex(diseases, questions, load_model())
+    assert index.question('red_eye').text == questions[0].text
+    assert index.question('missing') is None
+    assert index.possible_answers('discharge') == (
+        'None', 'Serous', 'Mucopurulent', 'Bloody'
+    )
+    assert index.possible_answers('missing') == ('Yes', 'No')
+    assert index.disease_id(diseases[2]) == 2
+    assert index.question_id('red_eye') == 0
+    assert index.answer_id('red_eye', 'Yes') != index.answer_id('red_eye', 'No')
+
+
+def test_engine_shares_index():
+    questions = load_questions()
+    diseases = load_diseases()
+    model = load_model()
+    index = ModelIndex(diseases, questions, model)
+    engine = DiagnosisEngine(
+        diseases, [q.qid for q in questions], model, index=index
+    )
+    assert engine.compiled.index is index
+    assert engine.get_possible_answers('red_eye') == ['Yes', 'No']
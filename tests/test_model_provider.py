@@ -0,0 +1,139 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import config  # noqa: E402
+import storage_json  # noqa: E402
+from model_provider import ModelProvider  # noqa: E402
+
+
+def _watched(data_copy):
+    return sorted(str(p) for p in data_copy.glob('*.json'))
+
+
+def test_provider_swaps_model_and_pins_sessions(data_copy):
+    provider = ModelProvider(paths=_watched(data_copy))
+    old_version = provider.version
+    pinned = provider.new_engine(question_cache=None)
+    pinned.answer_question('red_eye', 'Yes')
+    assert provider.check() is False
+
+    swapped = []
+    provider.add_listener(swapped.append)
+    model = storage_json.load_model()
+    for weights in model.values():
+        weights['red_eye']['Yes'] = 0
+    storage_json.save_model(model)
+    assert provider.check() is True
+
+    assert provider.version != old_version
+    assert [c.version for c in swapped] == [provider.version]
+    assert pinned.compiled.version == old_version
+    assert provider.new_engine().compiled.version == provider.version
+    status = provider.status()
+    assert status['version'] == provider.version
+    assert status['reloads'] == 1
+    assert status['reload_ms'] > 0
+
+
+def test_failed_reload_keeps_current_model(data_copy):
+    provider = ModelProvider(paths=_watched(data_copy))
+    version = provider.version
+    with open(storage_json.DIAGNOSIS_MODEL_FILE, 'w', encoding='utf-8') as f:
+        f.write('{broken')
+    assert provider.check() is False
+    assert provider.version == version
+    assert provider.status()['errors'] == 1
+    assert provider.check() is False
+    assert provider.status()['errors'] == 1
+
+
+def test_snapshots_restore_on_their_version(data_copy):
+    import asyncio
+    import json
+    from service import DiagnosisService
+
+    def call(method, target, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        return asyncio.run(service.dispatch(method, target, data))
+
+    provider = ModelProvider(paths=_watched(data_copy))
+    old_version = provider.version
+    service = DiagnosisService(provider=provider, capacity=1, ttl=0, snapshot_dir=None)
+    _, old = call('POST', '/sessions')
+    call('POST', f"/sessions/{old['session_id']}/answer", {'question': 'red_eye', 'answer': 'Yes'})
+
+    model = storage_json.load_model()
+    for weights in model.values():
+        weights['red_eye']['Yes'] = 0
+    storage_json.save_model(model)
+    assert provider.check() is True
+    call('POST', '/sessions')
+    assert provider.status()['retained_versions'] == [old_version]
+
+    restored = service.sessions.get(old['session_id'])
+    assert restored.compiled.version == old_version
+    assert restored.answered == {'red_eye': 'Yes'}
+    assert restored.scores['Conjunctivitis'] == 3
+
+    call('DELETE', f"/sessions/{old['session_id']}")
+    assert provider.status()['retained_versions'] == [provider.version]
+    service.sessions._snapshots['gone'] = json.dumps(
+        {'version': old_version, 'answers': []}
+    ).encode()
+    status, err = call('GET', '/sessions/gone/question')
+    assert status == 410
+    service.close()
+
+
+def test_sqlite_backend_sees_admin_writes(monkeypatch, tmp_path):
+    from storage_sqlite import SQLiteStorage
+
+    db = str(tmp_path / 'aivo.db')
+    admin = SQLiteStorage(db)
+    admin.import_from(storage_json)
+    monkeypatch.setattr(config, 'STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setattr(config, 'SQLITE_FILE', db)
+    monkeypatch.setattr(config, 'POLICY_TREE_FILE', str(tmp_path / 'policy_tree.json'))
+    provider = ModelProvider()
+    version = provider.version
+    assert version == storage_json.load_compiled_model().version
+    assert provider.check() is False
+
+    disease = admin.load_diseases()[0]
+    admin.set_weight(disease, 'red_eye', 'Yes', 9)
+    assert provider.check() is True
+    assert provider.version != version
+    assert provider.current.model[disease]['red_eye']['Yes'] == 9
+    assert provider.check() is False
+    admin.close()
+
+
+def test_reload_drops_cached_questions_of_the_old_version(data_copy):
+    from question_cache import QuestionCache
+
+    cache = QuestionCache()
+    provider = ModelProvider(paths=_watched(data_copy), question_cache=cache)
+    old_version = provider.version
+    provider.new_engine(question_cache=cache).select_best_question()
+    retained = provider.new_engine(question_cache=cache)
+    retained.answer_question('red_eye', 'Yes')
+    retained.select_best_question()
+    provider.retain(retained.compiled)
+    cache.put(('other', frozenset()), 'pain')
+
+    model = storage_json.load_model()
+    for weights in model.values():
+        weights['red_eye']['Yes'] = 0
+    storage_json.save_model(model)
+    assert provider.check() is True
+    assert len(cache) == 3
+    provider.release(old_version)
+    assert [key[0] for key in cache._entries] == ['other']
+    provider.new_engine(question_cache=cache).select_best_question()
+    assert len(cache) == 2
+    for weights in model.values():
+        weights['red_eye']['No'] = 0
+    storage_json.save_model(model)
+    assert provider.check() is True
+    assert [key[0] for key in cache._entries] == ['other']
@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_questions, load_diseases, load_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from policy_tree import (  # noqa: E402
+    build_policy_tree,
+    load_policy_tree,
+    save_policy_tree,
+)
+
+
+def _engine(**kwargs):
+    q_ids = [q.qid for q in load_questions()]
+    return DiagnosisEngine(
+        load_diseases(), q_ids, load_model(), question_cache=None, **kwargs
+    )
+
+
+def test_policy_tree_matches_live_selection(tmp_path):
+    tree = build_policy_tree(_engine(), max_depth=2, max_nodes=50)
+    path = tmp_path / 'policy.json'
+    save_policy_tree(tree, str(path))
+    tree = load_policy_tree(str(path))
+
+    engine = _engine(policy=tree)
+    live = _engine()
+    assert engine.select_best_question() == 'red_eye'
+    for q, a in [('red_eye', 'Yes'), ('vision_loss', 'No')]:
+        engine.answer_question(q, a)
+        live.answer_question(q, a)
+        assert engine.session.policy_nodes[-1] is not None
+        assert engine.select_best_question() == live._select_best_question()
+    engine.answer_question('pain', 'Yes')
+    assert engine.session.policy_nodes[-1] is None
+    engine.undo_last_answer()
+    assert engine.session.policy_nodes[-1] is not None
+
+
+def test_policy_tree_for_other_model_is_ignored():
+    tree = build_policy_tree(_engine(), max_depth=1, max_nodes=5)
+    tree.version = 'stale'
+    assert _engine(policy=tree).policy is None
+
+
+def test_load_missing_policy_tree_returns_none(tmp_path):
+    assert load_policy_tree(str(tmp_path / 'absent.json')) is None
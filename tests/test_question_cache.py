@@ -0,0 +1,48 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+from storage_json import load_questions, load_diseases, load_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from question_cache import MISSING, QuestionCache  # noqa: E402
+
+
+def _engine(cache):
+    q_ids = [q.qid for q in load_questions()]
+    return DiagnosisEngine(
+        load_diseases(), q_ids, load_model(), question_cache=cache
+    )
+
+
+def test_sessions_share_cached_selections():
+    cache = QuestionCache(16)
+    first = _engine(cache)
+    assert first.select_best_question() == 'red_eye'
+    assert cache.stats()['misses'] == 1
+    second = _engine(cache)
+    assert second.select_best_question() == 'red_eye'
+    assert cache.stats()['hits'] == 1
+    second.answer_question('red_eye', 'Yes')
+    assert second.select_best_question() == 'vision_loss'
+    assert len(cache) == 2
+
+
+def test_lru_eviction_and_invalidation():
+    cache = QuestionCache(2)
+    cache.put(('v1', 'a'), 'q1')
+    cache.put(('v1', 'b'), 'q2')
+    assert cache.get(('v1', 'a')) == 'q1'
+    cache.put(('v2', 'c'), 'q3')
+    assert cache.get(('v1', 'b')) is MISSING
+    assert cache.stats()['evictions'] == 1
+    cache.invalidate('v1')
+    assert cache.get(('v1', 'a')) is MISSING
+    assert cache.get(('v2', 'c')) == 'q3'
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        QuestionCache(4, policy='random')
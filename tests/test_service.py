@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+from storage_json import load_compiled_model  # noqa: E402
+from service import DiagnosisService  # noqa: E402
+
+
+def _call(service, method, target, body=None):
+    data = json.dumps(body).encode() if body is not None else b''
+    return asyncio.run(service.dispatch(method, target, data))
+
+
+def test_session_flow():
+    service = DiagnosisService(load_compiled_model())
+    status, started = _call(service, 'POST', '/sessions')
+    assert status == 200
+    sid = started['session_id']
+    assert started['question']['id'] == 'red_eye'
+    assert started['question']['answers'] == ['Yes', 'No']
+
+    status, result = _call(
+        service, 'POST', f'/sessions/{sid}/answer',
+        {'question': 'red_eye', 'answer': 'Yes'},
+    )
+    assert status == 200 and result['answered'] == 1
+    status, nxt = _call(service, 'GET', f'/sessions/{sid}/question')
+    assert nxt['question']['id'] == 'vision_loss'
+    status, ranking = _call(service, 'GET', f'/sessions/{sid}/ranking?n=2')
+    assert len(ranking['top']) == 2
+    status, undone = _call(service, 'POST', f'/sessions/{sid}/undo')
+    assert undone['undone'] == 'red_eye'
+    status, _ = _call(service, 'DELETE', f'/sessions/{sid}')
+    assert status == 200
+    status, err = _call(service, 'GET', f'/sessions/{sid}/question')
+    assert status == 404
+    service.close()
+
+
+def test_invalid_requests():
+    service = DiagnosisService(load_compiled_model())
+    _, started = _call(service, 'POST', '/sessions')
+    sid = started['session_id']
+    status, err = _call(
+        service, 'POST', f'/sessions/{sid}/answer',
+        {'question': 'red_eye', 'answer': 'Maybe'},
+    )
+    assert status == 400
+    status, _ = asyncio.run(service.dispatch('POST', '/sessions', b'{bad'))
+    assert status == 400
+    status, _ = _call(service, 'GET', '/nowhere')
+    assert status == 404
+    status, _ = _call(
+        service, 'POST', f'/sessions/{sid}/answer', {'question': ['red_eye'], 'answer': 'Yes'}
+    )
+    assert status == 400
+    for n in ('0', '-2'):
+        status, _ = _call(service, 'GET', f'/sessions/{sid}/ranking?n={n}')
+        assert status == 400
+
+    def fail(*args):
+        raise RuntimeError('boom')
+
+    service.sessions.get = fail
+    status, err = _call(service, 'GET', f'/sessions/{sid}/question')
+    assert status == 500 and err == {'error': 'Internal server error'}
+    service.close()
+
+
+def test_http_round_trip():
+    async def scenario():
+        service = DiagnosisService(load_compiled_model())
+        server = await service.serve('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(
+            b'POST /sessions HTTP/1.1\r\nHost: x\r\nContent-Length: 0\r\n'
+            b'Connection: close\r\n\r\n'
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        service.close()
+        return response
+
+    response = asyncio.run(scenario())
+    head, _, body = response.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 200 OK')
+    assert json.loads(body)['question']['id'] == 'red_eye'
+
+
+def test_stop_reason_runs_once_off_the_event_loop(monkeypatch):
+    import threading
+    from engine_rule import DiagnosisEngine
+
+    calls = []
+    stop_reason = DiagnosisEngine.stop_reason
+
+    def record(engine, *args, **kwargs):
+        calls.append(threading.current_thread() is threading.main_thread())
+        return stop_reason(engine, *args, **kwargs)
+
+    monkeypatch.setattr(DiagnosisEngine, 'stop_reason', record)
+    service = DiagnosisService(load_compiled_model())
+    _, started = _call(service, 'POST', '/sessions')
+    sid = started['session_id']
+    _call(service, 'POST', f'/sessions/{sid}/answer', {'question': 'red_eye', 'answer': 'Yes'})
+    _call(service, 'GET', f'/sessions/{sid}/question')
+    _call(service, 'GET', f'/sessions/{sid}/ranking?n=2')
+    assert calls == [False] * 4
+    service.close()
@@ -0,0 +1,145 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+from storage_json import load_compiled_model  # noqa: E402
+from engine_rule import DiagnosisEngine  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _factory(version=None):
+    compiled = load_compiled_model()
+    if version is not None and version != compiled.version:
+        raise LookupError(version)
+    return DiagnosisEngine.from_compiled(compiled, question_cache=None)
+
+
+def _engine_with(*answers):
+    engine = _factory()
+    for q, a in answers:
+        engine.answer_question(q, a)
+    return engine
+
+
+def test_capacity_eviction_restores_by_replay():
+    store = SessionStore(_factory, capacity=2, ttl=0)
+    store['a'] = _engine_with(('red_eye', 'Yes'), ('pain', 'No'))
+    store['b'] = _engine_with(('red_eye', 'No'))
+    store['c'] = _factory()
+    assert len(store) == 2
+    assert store.metrics()['evictions'] == 1
+    restored = store.get('a')
+    assert restored.history == ['red_eye', 'pain']
+    assert restored.scores['Conjunctivitis'] == 4
+    metrics = store.metrics()
+    assert metrics['restores'] == 1
+    assert metrics['live'] == 2
+
+
+def test_idle_sessions_expire_to_disk(tmp_path):
+    clock = FakeClock()
+    store = SessionStore(
+        _factory, capacity=10, ttl=60, snapshot_dir=str(tmp_path), clock=clock
+    )
+    store['a'] = _engine_with(('red_eye', 'Yes'))
+    clock.now = 120
+    store.expire_idle()
+    assert len(store) == 0
+    assert store.metrics()['expirations'] == 1
+
+    reopened = SessionStore(_factory, snapshot_dir=str(tmp_path))
+    assert 'a' in reopened
+    assert reopened.get('a').answered == {'red_eye': 'Yes'}
+    assert reopened.discard('a')
+    assert reopened.get('a') is None
+
+
+def test_invalid_session_id_rejected():
+    store = SessionStore(_factory)
+    with pytest.raises(ValueError):
+        store['../x'] = _factory()
+
+
+def test_restore_uses_snapshot_version():
+    versions = []
+    retained = []
+
+    def factory(version):
+        versions.append(version)
+        if version == 'gone':
+            raise LookupError(version)
+        return _factory(version)
+
+    store = SessionStore(
+        factory, retain=lambda e: retained.append(e.compiled.version),
+        release=retained.remove, capacity=1, ttl=0,
+    )
+    store['a'] = _engine_with(('red_eye', 'Yes'))
+    store['b'] = _factory()
+    assert retained == [store.get('b').compiled.version]
+    assert store.get('a').answered == {'red_eye': 'Yes'}
+    assert versions == [load_compiled_model().version]
+    assert retained == [load_compiled_model().version]
+
+    store._snapshots['c'] = b'{"version":"gone","answers":[]}'
+    with pytest.raises(LookupError):
+        store.get('c')
+    assert 'c' in store
+
+
+def test_snapshots_expire_and_are_bounded():
+    clock = FakeClock()
+    released = []
+    store = SessionStore(
+        _factory, retain=lambda e: None, release=released.append, capacity=1,
+        ttl=0, snapshot_capacity=2, snapshot_ttl=100, clock=clock,
+    )
+    for sid in 'abcd':
+        store[sid] = _factory()
+        clock.now += 10
+    assert store.metrics()['snapshots'] == 2
+    assert 'a' not in store and 'b' in store and 'c' in store
+    clock.now = 125
+    store.expire_idle()
+    assert 'b' not in store and 'c' in store
+    metrics = store.metrics()
+    assert metrics['snapshots'] == 1
+    assert metrics['snapshot_expirations'] == 2
+    assert len(released) == 2
+
+
+def test_snapshot_count_tracks_files_without_listing(tmp_path, monkeypatch):
+    clock = FakeClock()
+    (tmp_path / 'old.snap').write_bytes(b'{}')
+    store = SessionStore(
+        _factory, capacity=1, ttl=0, snapshot_capacity=2, snapshot_ttl=100,
+        snapshot_dir=str(tmp_path), clock=clock,
+    )
+
+    def listdir(path):
+        raise AssertionError('metrics must not list the snapshot directory')
+
+    monkeypatch.setattr(os, 'listdir', listdir)
+    assert store.metrics()['snapshots'] == 1
+    for sid in 'abcd':
+        store[sid] = _factory()
+        clock.now += 10
+    assert store.metrics()['snapshots'] == 3
+    # Restoring 'c' deletes its file and evicts 'd' to a new one.
+    store.get('c')
+    assert store.metrics()['snapshots'] == 3
+    clock.now = 200
+    store.expire_idle()
+    store.discard('old')
+    assert store.metrics()['snapshots'] == 0
+    monkeypatch.undo()
+    assert [n for n in os.listdir(tmp_path) if n.endswith('.snap')] == []
@@ -0,0 +1,50 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import pytest  # noqa: E402
+from storage_json import load_compiled_model  # noqa: E402
+from simulate import simulate  # noqa: E402
+
+
+def _strip_latency(report):
+    report = dict(report)
+    report.pop('step_latency')
+    return report
+
+
+def test_simulate_report_shape():
+    compiled = load_compiled_model()
+    report = simulate(compiled, runs_per_disease=3, noise=0.0, seed=1)
+    assert report['runs'] == 3 * len(compiled.diseases)
+    assert 0.0 <= report['top1'] <= report['top3'] <= 1.0
+    assert sum(report['question_counts'].values()) == report['runs']
+    assert report['step_latency']['count'] > 0
+    assert set(report['diseases']) == set(compiled.diseases)
+    assert report['meta']['model_version'] == compiled.version
+
+
+def test_simulate_is_deterministic_across_workers():
+    compiled = load_compiled_model()
+    diseases = compiled.diseases[:4]
+    a = simulate(compiled, runs_per_disease=4, noise=0.1, seed='x', diseases=diseases)
+    b = simulate(
+        runs_per_disease=4, noise=0.1, seed='x', diseases=diseases, workers=2, chunk_size=3
+    )
+    c = simulate(compiled, runs_per_disease=4, noise=0.1, seed='y', diseases=diseases)
+    assert _strip_latency(a) == _strip_latency(b)
+    assert _strip_latency(a) != _strip_latency(c)
+
+
+def test_workers_simulate_the_given_model(synthetic_model):
+    paths = synthetic_model(diseases=6, questions=8, choices=3, sparsity=0.4, seed=5)
+    compiled = load_compiled_model(**paths)
+    a = simulate(compiled, runs_per_disease=3, noise=0.1, seed='z')
+    b = simulate(
+        compiled, paths=paths, runs_per_disease=3, noise=0.1, seed='z', workers=2, chunk_size=4
+    )
+    assert set(b['diseases']) == set(compiled.diseases)
+    assert b['meta']['model_version'] == compiled.version
+    assert _strip_latency(a) == _strip_latency(b)
+    with pytest.raises(ValueError):
+        simulate(compiled, runs_per_disease=1, workers=2)
@@ -0,0 +1,148 @@
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import config  # noqa: E402
+import storage_json  # noqa: E402
+from instrumentation import metrics  # noqa: E402
+
+
+def _use_copy(monkeypatch, tmp_path):
+    for name, src in (
+        ('QUESTIONS_FILE', config.QUESTIONS_FILE),
+        ('DISEASES_FILE', config.DISEASES_FILE),
+        ('DIAGNOSIS_MODEL_FILE', config.DIAGNOSIS_MODEL_FILE),
+    ):
+        dst = tmp_path / os.path.basename(src)
+        shutil.copy(src, dst)
+        monkeypatch.setattr(storage_json, name, str(dst))
+    monkeypatch.setattr(storage_json, 'MODEL_BINARY_FILE', str(tmp_path / 'none.bin'))
+    storage_json.invalidate_cache(disk=False)
+
+
+def test_cached_loads_return_fresh_copies(monkeypatch, tmp_path):
+    _use_copy(monkeypatch, tmp_path)
+    model = storage_json.load_model()
+    disease = next(iter(model))
+    model[disease]['red_eye']['Yes'] = 99
+    questions = storage_json.load_questions()
+    questions[0].text = 'changed'
+    assert storage_json.load_model()[disease]['red_eye']['Yes'] != 99
+    assert storage_json.load_questions()[0].text != 'changed'
+
+
+def test_compiled_model_cached_until_files_change(monkeypatch, tmp_path):
+    _use_copy(monkeypatch, tmp_path)
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    first = storage_json.load_compiled_model()
+    assert storage_json.load_compiled_model() is first
+    assert (tmp_path / 'diagnosis_model.cache').exists()
+
+    # A new process would reuse the on-disk cache.
+    storage_json.invalidate_cache(disk=False)
+    second = storage_json.load_compiled_model()
+    assert second.version == first.version
+    assert metrics.snapshot()['counters']['storage.disk_cache_hit'] == 1
+
+    model = storage_json.load_model()
+    disease = next(iter(model))
+    model[disease]['red_eye']['Yes'] = 7
+    storage_json.save_model(model)
+    third = storage_json.load_compiled_model()
+    assert third.version != first.version
+
+    storage_json.invalidate_cache()
+    assert not (tmp_path / 'diagnosis_model.cache').exists()
+    metrics.reset()
+    storage_json.invalidate_cache(disk=False)
+
+
+def test_saves_are_atomic_and_skip_unchanged(monkeypatch, tmp_path):
+    _use_copy(monkeypatch, tmp_path)
+    model_file = tmp_path / 'diagnosis_model.json'
+    model = storage_json.load_model()
+    assert storage_json.save_model(model) is False
+    assert storage_json.save_all(
+        storage_json.load_questions(), storage_json.load_diseases(), model
+    ) == []
+
+    size = model_file.stat().st_size
+    disease = next(iter(model))
+    model[disease]['red_eye']['Yes'] = 5
+    assert storage_json.save_all(model=model, compact=True) == ['model']
+    assert model_file.stat().st_size < size * 0.6
+    assert storage_json.load_model() == model
+    assert not [p for p in os.listdir(tmp_path) if p.endswith('.tmp')]
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    model[disease]['red_eye']['Yes'] = 6
+    monkeypatch.setattr(storage_json.os, 'fsync', fail)
+    try:
+        storage_json.save_model(model)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('save_model should fail')
+    assert storage_json.load_model()[disease]['red_eye']['Yes'] == 5
+    assert not [p for p in os.listdir(tmp_path) if p.endswith('.tmp')]
+    storage_json.invalidate_cache(disk=False)
+
+
+def test_compiled_model_reloads_with_cache_disabled(monkeypatch, tmp_path):
+    _use_copy(monkeypatch, tmp_path)
+    monkeypatch.setattr(storage_json, 'STORAGE_CACHE', False)
+    first = storage_json.load_compiled_model()
+    assert storage_json.load_compiled_model() is first
+    model = storage_json.load_model()
+    disease = next(iter(model))
+    model[disease]['red_eye']['Yes'] = 7
+    storage_json.save_model(model)
+    assert storage_json.load_compiled_model().version != first.version
+    assert not (tmp_path / 'diagnosis_model.cache').exists()
+    storage_json.invalidate_cache(disk=False)
+
+
+def test_rebuilt_binary_is_picked_up_with_its_mapping(monkeypatch, tmp_path):
+    from model_binary import write_binary_model
+
+    _use_copy(monkeypatch, tmp_path)
+    # Warm start from the disk cache still exposes the JSON mapping.
+    storage_json.load_compiled_model()
+    storage_json.invalidate_cache(disk=False)
+    assert storage_json.load_compiled_model().model == storage_json.load_model()
+
+    binary = str(tmp_path / 'diagnosis_model.bin')
+    monkeypatch.setattr(storage_json, 'MODEL_BINARY_FILE', binary)
+    questions, diseases = storage_json.load_questions(), storage_json.load_diseases()
+    model = storage_json.load_model()
+    disease = next(iter(model))
+    versions = []
+    for weight in (7, 8):
+        model[disease]['red_eye']['Yes'] = weight
+        versions.append(write_binary_model(binary, diseases, questions, model).version)
+        compiled = storage_json.load_compiled_model()
+        assert compiled.version == versions[-1]
+        assert compiled.model[disease]['red_eye']['Yes'] == weight
+    assert versions[0] != versions[1]
+    storage_json.invalidate_cache(disk=False)
+
+
+def test_compiling_drops_parsed_json_and_invalidates_given_paths(synthetic_model):
+    paths = synthetic_model(diseases=4, questions=5, seed=2)
+    cache_file = paths['model_file'][:-len('.json')] + '.cache'
+    storage_json.load_compiled_model(**paths)
+    assert os.path.exists(cache_file)
+    assert not set(storage_json._parsed) & set(paths.values())
+
+    storage_json.invalidate_cache()
+    assert not os.path.exists(cache_file)
+    storage_json.load_compiled_model(**paths)
+    storage_json.load_compiled_model()
+    storage_json.invalidate_cache(model_file=paths['model_file'])
+    assert not os.path.exists(cache_file)
+    assert os.path.exists(os.path.splitext(storage_json.DIAGNOSIS_MODEL_FILE)[0] + '.cache')
+    storage_json.invalidate_cache(disk=False)
@@ -0,0 +1,37 @@
+import os
+import sys
+import sqlite3
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
+
+import storage_json  # noqa: E402
+from storage_sqlite import SQLiteStorage  # noqa: E402
+
+
+def test_import_export_round_trip(tmp_path):
+    db = SQLiteStorage(str(tmp_path / 'aivo.db'))
+    db.import_from(storage_json)
+    assert db.load_questions() == storage_json.load_questions()
+    assert db.load_diseases() == storage_json.load_diseases()
+    model = db.load_model()
+    assert model == storage_json.load_model()
+    assert list(model) == list(storage_json.load_model())
+    disease = next(iter(model))
+    assert list(model[disease]) == list(storage_json.load_model()[disease])
+    assert db.load_compiled_model().version == storage_json.load_compiled_model().version
+    db.close()
+
+
+def test_set_weight_is_a_single_row_upsert(tmp_path):
+    path = str(tmp_path / 'aivo.db')
+    db = SQLiteStorage(path)
+    db.save_model({'D': {'q': {'Yes': 1, 'No': 0}}})
+    db.set_weight('D', 'q', 'Yes', 4)
+    db.set_weight('D', 'q2', 'Yes', -1)
+    assert db.load_model() == {'D': {'q': {'Yes': 4, 'No': 0}, 'q2': {'Yes': -1}}}
+    assert isinstance(db.load_model()['D']['q']['Yes'], int)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('SELECT COUNT(*) FROM weights').fetchone()[0] == 3
+    conn.close()
+    db.close()
@@ -7,8 +7,8 @@ from tkinter import ttk, messagebox
 from typing import Optional
 
 import config
-from engine_rule import DiagnosisEngine
-from storage_json import load_questions, load_diseases, load_model
+from model_provider import ModelProvider
+from policy_tree import load_policy_tree
 
 
 class DiagnosisUI:
@@ -16,21 +16,15 @@ class DiagnosisUI:
 
     def __init__(self, master, *, debug: Optional[bool] = None):
         self.master = master
-        self.questions = load_questions()
-        self.diseases = load_diseases()
-        self.model = load_model()
-        # ``load_questions`` now returns ``Question`` objects
-        self.question_ids = [q.qid for q in self.questions]
         if debug is None:
             debug = config.get_env_bool("AIVO_DEBUG")
-        self.engine = DiagnosisEngine(
-            self.diseases,
-            self.question_ids,
-            self.model,
-            debug=debug,
-        )
+        self.debug = debug
+        # Picks up weights saved by the admin panel; a running diagnosis
+        # keeps its model and the next one starts on the new version.
+        self.provider = ModelProvider(policy_loader=load_policy_tree)
+        self.provider.start()
+        self.start_engine()
         self.current_question = None
-        self.total_questions = len(self.question_ids)
         self.init_ui()
         self.next_question()
 
@@ -127,13 +121,24 @@ class DiagnosisUI:
         self.back_button.pack_forget()
         self.restart_button.pack_forget()
 
+    def start_engine(self):
+        """Start a session on the provider's current model."""
+        self.engine = self.provider.new_engine(debug=self.debug)
+        compiled = self.engine.compiled
+        self.index = compiled.index
+        self.question_ids = list(compiled.askable)
+        self.total_questions = len(self.question_ids)
+
     def clear_buttons(self):
         for widget in self.button_frame.winfo_children():
             widget.destroy()
 
     def restart(self):
         """Reset the engine and UI so the user can start over."""
-        self.engine.reset()
+        if self.provider.version != self.engine.compiled.version:
+            self.start_engine()
+        else:
+            self.engine.reset()
         self.current_question = None
         self.result_label.config(text="")
         self.progress_label.config(text="")
@@ -144,7 +149,7 @@ class DiagnosisUI:
         self.next_question()
 
     def display_question(self, question_id):
-        qdata = next(q for q in self.questions if q.qid == question_id)
+        qdata = self.index.question(question_id)
         self.question_label.config(text=qdata.text)
         self.clear_buttons()
         options = self.engine.get_possible_answers(question_id)
@@ -191,8 +196,12 @@ class DiagnosisUI:
             self.back_button.pack_forget()
 
     def next_question(self):
-        if self.engine.is_done():
-            self.question_label.config(text="Diagnosis complete.")
+        reason = self.engine.stop_reason()
+        if reason is not None:
+            text = "Diagnosis complete."
+            if reason == "ranking_fixed":
+                text = "Diagnosis complete: further answers cannot change the ranking."
+            self.question_label.config(text=text)
             self.clear_buttons()
             # Clear interim progress to avoid repeating the final results
             self.progress_label.config(text="")